@@ -8,9 +8,16 @@ __author__ = 'Mahyar Osanlouy'
 __stepname__ = 'Scaffold Rigid Aligner'
 __location__ = ''
 
-# import class that derives itself from the step mountpoint.
-from mapclientplugins.scaffoldrigidalignerstep import step
+try:
+    import PySide
+except ImportError:
+    # Headless use, such as the batch runner, needs neither the step nor its resources.
+    PySide = None
 
-# Import the resource file when the module is loaded,
-# this enables the framework to use the step icon.
-from . import resources_rc
\ No newline at end of file
+if PySide is not None:
+    # import class that derives itself from the step mountpoint.
+    from mapclientplugins.scaffoldrigidalignerstep import step
+
+    # Import the resource file when the module is loaded,
+    # this enables the framework to use the step icon.
+    from . import resources_rc
\ No newline at end of file
@@ -0,0 +1,136 @@
+"""
+Headless batch alignment of a scaffold onto many subjects' point clouds, without the MAP Client or PySide.
+
+Each subject runs in a worker process and gets its own output directory holding the aligned mesh,
+rigid-settings.json and rigid-metrics.json; a batch-summary.json lists the results of all subjects,
+flagging fits whose RMS error exceeds a threshold. Subjects are the parallel units, so registrations
+which start worker processes of their own run them serially under the pool.
+"""
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from .model.filescaffold import FileScaffoldDescription
+from .model.mastermodel import MasterModel
+
+REGISTRATION_MODES = ['automatic', 'temporal', 'multi_start']
+
+
+def _register(model, registration):
+    options = dict(registration)
+    mode = options.pop('mode', 'automatic')
+    if mode == 'automatic':
+        return model.register_automatically(**options)
+    if mode == 'temporal':
+        return model.register_temporally(**options)
+    if mode == 'multi_start':
+        result, _ = model.register_multi_start(**options)
+        return result
+    raise ValueError('Unknown registration mode: {}'.format(mode))
+
+
+def align_subject(scaffold_file, data_file, output_directory, settings_file=None, registration=None,
+                  max_rms_error=None):
+    """
+    Align the scaffold onto one subject's data, either by replaying saved settings or by automatic
+    registration, and write the aligned mesh, settings and metrics to output_directory.
+
+    :param registration: Dict of a 'mode' in REGISTRATION_MODES and the options of the matching
+     MasterModel register method.
+    :param max_rms_error: Flag the fit as bad if its point to surface RMS error exceeds this.
+    :return: Dict of the subject's data file, output directory, metrics and whether the fit is flagged.
+    """
+    if not os.path.isdir(output_directory):
+        os.makedirs(output_directory)
+    model = MasterModel(FileScaffoldDescription(scaffold_file))
+    model.set_location(os.path.join(output_directory, ''))
+    model.set_lazy_loading(False)
+    model.initialise_data(data_file)
+    model.load_data()
+    model.initialise_scaffold()
+    model.set_time_value(0.0)
+    if settings_file is not None:
+        model.restore_settings(settings_file)
+    elif registration is not None:
+        _register(model, registration)
+    temporal = len(model.get_time_sequence() or []) > 1
+    model.done(temporal)
+    metrics = model.get_alignment_report()
+    flagged = (max_rms_error is not None) and ((metrics['rms_error'] is None) or (metrics['rms_error'] > max_rms_error))
+    return dict(data_file=data_file, output_directory=output_directory, metrics=metrics, flagged=flagged)
+
+
+def _align_subject(arguments):
+    try:
+        return align_subject(*arguments)
+    except Exception as e:
+        return dict(data_file=arguments[1], output_directory=arguments[2], error=str(e))
+
+
+def get_subject_name(data_file):
+    return os.path.splitext(os.path.basename(data_file))[0]
+
+
+def run_batch(scaffold_file, data_files, output_directory, settings_file=None, registration=None,
+              max_workers=None, max_rms_error=None):
+    """
+    Align the scaffold onto every data file in a pool of worker processes. A failing subject is
+    recorded with its error and does not stop the others.
+
+    :param max_workers: Number of worker processes, None for the number of processors.
+    :param max_rms_error: Flag subjects whose point to surface RMS error exceeds this.
+    :return: List of the subject results, in the order of data_files.
+    """
+    if (settings_file is None) and (registration is None):
+        registration = dict(mode='automatic', similarity=True)
+    if (max_workers != 1) and (registration is not None) and (registration.get('mode') in ['temporal', 'multi_start']):
+        registration = dict(registration, max_workers=1)
+    if not os.path.isdir(output_directory):
+        os.makedirs(output_directory)
+    tasks = [(scaffold_file, data_file, os.path.join(output_directory, get_subject_name(data_file)),
+              settings_file, registration, max_rms_error) for data_file in data_files]
+    if max_workers == 1:
+        results = [_align_subject(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_align_subject, tasks))
+    with open(os.path.join(output_directory, 'batch-summary.json'), 'w') as f:
+        f.write(json.dumps(results, sort_keys=True, indent=4))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rigidly align a scaffold onto many point clouds.')
+    parser.add_argument('scaffold', help='Scaffold EX file.')
+    parser.add_argument('data', nargs='+', help='Point cloud files, EX, JSON or .npc.')
+    parser.add_argument('-o', '--output', required=True, help='Output directory, one subdirectory per subject.')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-s', '--settings', help='rigid-settings.json to replay on every subject.')
+    group.add_argument('-r', '--registration',
+                       help='JSON file of the registration mode ({}) and options.'.format(
+                           ', '.join(REGISTRATION_MODES)))
+    parser.add_argument('-j', '--workers', type=int, default=None, help='Number of worker processes.')
+    parser.add_argument('--max-rms-error', type=float, default=None,
+                        help='Flag subjects whose point to surface RMS error exceeds this.')
+    arguments = parser.parse_args(argv)
+
+    registration = None
+    if arguments.registration is not None:
+        with open(arguments.registration) as f:
+            registration = json.load(f)
+    results = run_batch(arguments.scaffold, arguments.data, arguments.output, arguments.settings, registration,
+                        arguments.workers, arguments.max_rms_error)
+    failures = [result for result in results if 'error' in result]
+    for failure in failures:
+        print('{}: {}'.format(failure['data_file'], failure['error']))
+    flagged = [result for result in results if result.get('flagged')]
+    for result in flagged:
+        print('{}: RMS error {} exceeds {}'.format(result['data_file'], result['metrics']['rms_error'],
+                                                  arguments.max_rms_error))
+    print('Aligned {} of {} subjects, {} flagged.'.format(len(results) - len(failures), len(results), len(flagged)))
+    return 1 if failures or flagged else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
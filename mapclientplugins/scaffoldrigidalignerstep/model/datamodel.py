@@ -1,25 +1,19 @@
-import random
+import copy
 
 from opencmiss.zinc.field import Field
 from opencmiss.zinc.glyph import Glyph
 from opencmiss.zinc.status import OK as ZINC_OK
 from opencmiss.zinc.scenecoordinatesystem import SCENECOORDINATESYSTEM_NORMALISED_WINDOW_FIT_TOP
-from opencmiss.utils.zinc import create_node, create_finite_element_field, AbstractNodeDataObject
+from opencmiss.utils.zinc import create_finite_element_field
 
 from ..utils import maths
+from ..utils import zincutils
+from ..utils.subsampling import subsample_frames
+from ..utils.timeseries import FrameCache
+from ..utils.framestatistics import compute_frame_statistics, compute_frame_statistics_from_frames
 import numpy as np
 
 
-class DataCreator(AbstractNodeDataObject):
-
-    def __init__(self, coordinates, time_sequence):
-        super(DataCreator, self).__init__(['coordinates'], time_sequence, ['coordinates'])
-        self._coordinates = coordinates
-
-    def coordinates(self):
-        return self._coordinates
-
-
 class DataModel(object):
 
     def __init__(self, context, region, material_module):
@@ -34,6 +28,16 @@ class DataModel(object):
         self._current_time = None
         self._maximum_time = None
         self._time_sequence = None
+        self._positions = None
+        self._mask = None
+        self._subsampling_strategy = 'random'
+        self._subsampling_options = dict(seed=0)
+        self._frame_cache = None
+        self._materialised_frame = None
+        self._range_cache = {}
+        self._frame_statistics = None
+        self._field_module_notifier = self._region.getFieldmodule().createFieldmodulenotifier()
+        self._field_module_notifier.setCallback(self._field_module_changed)
 
     def _initialise_scene(self):
         self._scene = self._region.getScene()
@@ -47,10 +51,24 @@ class DataModel(object):
     def set_time(self, time):
         self._current_time = time
         self._timekeeper.setTime(time)
+        if self._frame_cache is not None:
+            self._materialise_frame(self._get_frame_index(time))
 
     def _set_maximum_time(self):
         self._timekeeper.setMaximumTime(self._maximum_time)
 
+    def _set_time_sequence(self, number_of_frames, times=None):
+        """
+        Time the frames by times, or by their index if None.
+        """
+        if times is None:
+            self._time_sequence = [int(x) for x in range(number_of_frames)]
+            self._maximum_time = number_of_frames
+        else:
+            self._time_sequence = [float(x) for x in times]
+            self._maximum_time = self._time_sequence[-1]
+        self._set_maximum_time()
+
     def get_maximum_time(self):
         return self._maximum_time
 
@@ -130,61 +148,216 @@ class DataModel(object):
         graphics.setCoordinateField(self._data_coordinate_field)
         self._scene.endChange()
 
-    def set_data_coordinate_field_from_json_file(self, json_description):
-        self._data_coordinate_field = create_finite_element_field(self._region, field_name='coordinates')
-        frames = json_description['AnnotatedFrames']
-        number_of_frames = len(frames)
-        self._maximum_time = number_of_frames
-        self._set_maximum_time()
-        self._time_sequence = [int(x) for x in range(number_of_frames)]
-
-        sorted_len_frames = self._get_minimum_number_of_datapoints_from_jason_dict(frames)
-        smallest_sample_length = len(frames[sorted_len_frames[0]])
-        frame_numbers = list(frames.keys())
-
-        all_positions = list()
-        for time in range(len(self._time_sequence)):
-            groups_and_positions = frames[frame_numbers[time]]
-            positions = [x[1] for x in groups_and_positions]
-            positions = random.sample(positions, smallest_sample_length)
-            all_positions.append(positions)
-
-        positions_timewise = list()
-        for position in range(len(all_positions[0])):
-            temp = list()
-            for time in range(len(all_positions)):
-                temp.append(all_positions[time][position])
-            positions_timewise.append(temp)
+    def set_subsampling(self, strategy, **options):
+        """
+        Set the strategy bringing all frames to the same number of points, see utils.subsampling.
+        """
+        self._subsampling_strategy = strategy
+        self._subsampling_options = options
+
+    def get_subsampling(self):
+        return dict(strategy=self._subsampling_strategy, **self._subsampling_options)
+
+    def read_frames(self, frames):
+        """
+        Convert an iterable of AnnotatedFrames frame values, each a list of [group, position] pairs,
+        to compact arrays one frame at a time and subsample them with the current strategy. Does not
+        touch the region so it may run on a worker thread.
+
+        :return: (frames, points, 3) positions and (frames, points) mask of real points.
+        """
+        frame_positions = [np.array([x[1] for x in groups_and_positions], dtype=np.float64).reshape(-1, 3)
+                           for groups_and_positions in frames]
+        return subsample_frames(frame_positions, self._subsampling_strategy, **self._subsampling_options)
+
+    def set_data_coordinate_field_from_positions(self, positions, mask=None, times=None):
+        """
+        Create the datapoints from a (frames, points, 3) positions array, which may be memory mapped.
+
+        :param mask: Optional (frames, points) boolean array, False for padding points.
+        :param times: Optional time of each frame, as stored in point cloud files; frames are timed by
+         their index if None.
+        """
+        self._mask = mask
+        self._prepare_data_coordinate_field()
+        self._set_time_sequence(len(positions), times)
+
+        self._create_data_points(positions, self._time_sequence)
+        return self._data_coordinate_field
 
+    def _prepare_data_coordinate_field(self):
+        """
+        Create the data coordinate field, or destroy the datapoints of the existing one so it can be refilled.
+        """
+        field_module = self._region.getFieldmodule()
+        field = field_module.findFieldByName('data_coordinates')
+        if field.isValid():
+            field_module.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_DATAPOINTS).destroyAllNodes()
+            self._data_coordinate_field = field
+        else:
+            self._data_coordinate_field = create_finite_element_field(self._region, field_name='coordinates')
+            self._data_coordinate_field.setName('data_coordinates')
+
+    def set_data_coordinate_field_from_frame_source(self, source, memory_budget=256 * 1024 * 1024, prefetch=2):
+        """
+        Lazy time series mode: only the frame at the current time is held in the region, read from
+        source through an LRU frame cache of memory_budget bytes which reads prefetch frames either
+        side ahead. Displayed frames are not subsampled; load_all_frames leaves the lazy mode.
+
+        :param source: Frame source, see utils.timeseries.
+        """
+        self._close_frame_cache()
+        self._frame_cache = FrameCache(source, memory_budget, prefetch)
+        self._positions = None
+        self._mask = None
+        self._frame_statistics = None
+        self._set_time_sequence(source.get_number_of_frames(), source.get_times())
+        self._materialise_frame(self._get_frame_index(self._current_time))
+        return self._data_coordinate_field
+
+    def is_lazy(self):
+        return self._frame_cache is not None
+
+    def _get_frame_index(self, time):
+        """
+        Get the index of the frame nearest time.
+        """
+        if (time is None) or not self._time_sequence:
+            return 0
+        return int(np.argmin(np.abs(np.asarray(self._time_sequence, dtype=np.float64) - time)))
+
+    def _materialise_frame(self, index):
+        """
+        Replace the datapoints with the points of frame index.
+        """
+        if index == self._materialised_frame:
+            return
+        frame = self._frame_cache.get_frame(index)
         field_module = self._region.getFieldmodule()
         field_module.beginChange()
-        node_set = field_module.findNodesetByName('datapoints')
+        self._prepare_data_coordinate_field()
+        node_set = field_module.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_DATAPOINTS)
+        node_template = node_set.createNodetemplate()
+        node_template.defineField(self._data_coordinate_field)
         field_cache = field_module.createFieldcache()
-
-        for index in range(len(positions_timewise)):
-            locations = positions_timewise[index]
-            location = locations[0]
-            data_creator = DataCreator(location, self._time_sequence)
-            identifier = create_node(field_module, data_creator, node_set_name='datapoints',
-                                     time=self._time_sequence[0])
-            node = node_set.findNodeByIdentifier(identifier)
+        for location in frame.tolist():
+            node = node_set.createNode(-1, node_template)
             field_cache.setNode(node)
-            assert len(self._time_sequence) == len(locations)
-            for next_index in range(1, number_of_frames):
-                location = locations[next_index]
-                if location == [0., 0., 0.]:
-                    print(next_index)
-                time = self._time_sequence[next_index]
+            self._data_coordinate_field.assignReal(field_cache, location)
+        field_module.endChange()
+        self._materialised_frame = index
+
+    def read_all_frames(self, progress=None):
+        """
+        Read and subsample all frames of the lazy time series without touching the region, so it may
+        run on a worker thread.
+
+        :param progress: Optional callable taking the fraction of frames read and a message; it may raise to abandon reading.
+        :return: (frames, points, 3) positions and (frames, points) mask, or None if not in lazy mode.
+        """
+        if self._frame_cache is None:
+            return None
+        number_of_frames = self._frame_cache.get_source().get_number_of_frames()
+        frame_positions = []
+        for index in range(number_of_frames):
+            frame_positions.append(self._frame_cache.get_frame(index, prefetch=False))
+            if progress is not None:
+                progress(float(index + 1) / number_of_frames, 'Read frame {} of {}'.format(index + 1, number_of_frames))
+        return subsample_frames(frame_positions, self._subsampling_strategy, **self._subsampling_options)
+
+    def load_all_frames(self, frames=None):
+        """
+        Leave the lazy time series mode, putting all frames into the region.
+
+        :param frames: Positions and mask from read_all_frames, read here if None.
+        """
+        if self._frame_cache is None:
+            return self._data_coordinate_field
+        if frames is None:
+            frames = self.read_all_frames()
+        times = self._frame_cache.get_source().get_times()
+        self._close_frame_cache()
+        positions, mask = frames
+        return self.set_data_coordinate_field_from_positions(positions, mask, times)
+
+    def set_frame_cache_budget(self, memory_budget):
+        if self._frame_cache is not None:
+            self._frame_cache.set_memory_budget(memory_budget)
+
+    def _close_frame_cache(self):
+        if self._frame_cache is not None:
+            self._frame_cache.close()
+            self._frame_cache = None
+        self._materialised_frame = None
+
+    def _create_data_points(self, positions, time_sequence):
+        """
+        Create a datapoint per point from a (frames, points, 3) positions array, all with one node
+        template and a single time sequence, assigning each point's values over time together.
+        """
+        self._positions = positions
+        self._frame_statistics = None
+        field_module = self._region.getFieldmodule()
+        field_module.beginChange()
+        node_set = field_module.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_DATAPOINTS)
+        node_template = node_set.createNodetemplate()
+        node_template.defineField(self._data_coordinate_field)
+        times = [float(time) for time in time_sequence]
+        if len(times) > 1:
+            zinc_time_sequence = field_module.getMatchingTimesequence(times)
+            node_template.setTimesequence(self._data_coordinate_field, zinc_time_sequence)
+        field_cache = field_module.createFieldcache()
+        # Points by frames view of the positions, no copy.
+        positions_timewise = positions.transpose(1, 0, 2)
+        for locations in positions_timewise:
+            node = node_set.createNode(-1, node_template)
+            field_cache.setNode(node)
+            for time, location in zip(times, locations.tolist()):
                 field_cache.setTime(time)
                 self._data_coordinate_field.assignReal(field_cache, location)
-
         field_module.endChange()
-        self._data_coordinate_field.setName('data_coordinates')
-        return self._data_coordinate_field
 
-    @staticmethod
-    def _get_minimum_number_of_datapoints_from_jason_dict(frames):
-        return sorted(frames, key=lambda key: len(frames[key]))
+    def get_positions(self):
+        """
+        Get the (frames, points, 3) positions array the datapoints were created from, or None.
+        """
+        return self._positions
+
+    def get_frames(self, stride=1):
+        """
+        Get the real points of every stride-th frame as a list of (n, 3) arrays.
+        """
+        if self._positions is not None:
+            indexes = range(0, len(self._positions), stride)
+            if self._mask is None:
+                return [np.asarray(self._positions[index], dtype=np.float64) for index in indexes]
+            return [np.asarray(self._positions[index][self._mask[index]], dtype=np.float64) for index in indexes]
+        if self._frame_cache is not None:
+            number_of_frames = self._frame_cache.get_source().get_number_of_frames()
+            return [self._frame_cache.get_frame(index, prefetch=False) for index in range(0, number_of_frames, stride)]
+        return [self.get_node_coordinates()]
+
+    def get_frame_statistics(self):
+        """
+        Get the per frame ranges, centroids and covariances of the data, computed in one pass over
+        all frames on first use. Padding points are left out.
+
+        :return: FrameStatistics, or None if no time series data is loaded.
+        """
+        if self._frame_statistics is None:
+            if self._positions is not None:
+                self._frame_statistics = compute_frame_statistics(self._positions, self._mask)
+            elif self._frame_cache is not None:
+                number_of_frames = self._frame_cache.get_source().get_number_of_frames()
+                self._frame_statistics = compute_frame_statistics_from_frames(
+                    self._frame_cache.get_frame(index, prefetch=False) for index in range(number_of_frames))
+        return self._frame_statistics
+
+    def get_mask(self):
+        """
+        Get the (frames, points) mask of real, not padding, points or None if all points are real.
+        """
+        return self._mask
 
     def _create_node_at_location(self, location, cache, domain_type=Field.DOMAIN_TYPE_DATAPOINTS, node_id=-1):
         fieldmodule = self._region.getFieldmodule()
@@ -222,15 +395,43 @@ class DataModel(object):
         self._data_coordinate_field.setName('data_coordinates')
         return field
 
+    def _field_module_changed(self, event):
+        if (self._data_coordinate_field is not None) and \
+                (event.getFieldChangeFlags(self._data_coordinate_field) != Field.CHANGE_FLAG_NONE):
+            self._range_cache = {}
+
     def _get_data_range(self):
-        fm = self._region.getFieldmodule()
-        data_points = fm.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_DATAPOINTS)
-        minimums, maximums = self._get_nodeset_minimum_maximum(data_points, self._data_coordinate_field)
-        return minimums, maximums
+        """
+        Get the range of the datapoints, cached per coordinate field until the datapoints change.
+        """
+        field_name = self._data_coordinate_field.getName()
+        if field_name not in self._range_cache:
+            fm = self._region.getFieldmodule()
+            data_points = fm.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_DATAPOINTS)
+            self._range_cache[field_name] = self._get_nodeset_minimum_maximum(data_points,
+                                                                              self._data_coordinate_field)
+        minimums, maximums = self._range_cache[field_name]
+        return copy.copy(minimums), copy.copy(maximums)
 
     def get_range(self):
         return self._get_data_range()
 
+    def get_node_coordinates(self, time=None):
+        """
+        Get the coordinates of the real datapoints at time, default current time, as an (N, 3) array.
+        Time series are read from the frame nearest time in their positions without the padding points,
+        so registration and metrics do not count those twice.
+        """
+        if time is None:
+            time = self._current_time
+        if self._positions is not None:
+            index = self._get_frame_index(time)
+            frame = np.asarray(self._positions[index], dtype=np.float64)
+            return frame if self._mask is None else frame[self._mask[index]]
+        if self._frame_cache is not None:
+            return self._frame_cache.get_frame(self._get_frame_index(time))
+        return zincutils.get_nodeset_coordinates(self._data_coordinate_field, time=time)
+
     def _get_auto_point_size(self):
         minimums, maximums = self._get_data_range()
         data_size = maths.magnitude(maths.sub(maximums, minimums))
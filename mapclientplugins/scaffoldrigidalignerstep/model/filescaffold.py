@@ -0,0 +1,66 @@
+from opencmiss.zinc.context import Context
+from opencmiss.zinc.status import OK as ZINC_OK
+
+
+class FileScaffoldGenerator(object):
+    """
+    Stands in for the scaffold generator model of the scaffold creator step, holding a scaffold
+    read from a file. Method names follow the generator model's.
+    """
+
+    def __init__(self, region, scale='1.0*1.0*1.0'):
+        self._region = region
+        self._settings = dict(scale=scale)
+
+    def getRegion(self):
+        return self._region
+
+    def getSettings(self):
+        return self._settings
+
+    def setSettings(self, settings):
+        self._settings = settings
+
+
+class FileScaffoldDescription(object):
+    """
+    Scaffold description read from an EX file, in place of the one the scaffold creator step
+    provides, so MasterModel can run without the MAP Client.
+    """
+
+    def __init__(self, file_name, model_name=None, species=None):
+        self._context = Context('scaffold_rigid_aligner')
+        self._region = self._context.getDefaultRegion().createChild('scaffold')
+        if self._region.readFile(file_name) != ZINC_OK:
+            raise ValueError('Failed to read scaffold file {}'.format(file_name))
+        self._generator = FileScaffoldGenerator(self._region)
+        self._parameters = dict(scale=self._generator.getSettings()['scale'])
+        self._model_name = model_name
+        self._species = species
+
+    def get_generator(self):
+        return self._generator
+
+    def get_context(self):
+        return self._context
+
+    def get_region(self):
+        return self._region
+
+    def get_parameters(self):
+        return self._parameters
+
+    def get_model_name(self):
+        return self._model_name
+
+    def get_model_species(self):
+        return self._species
+
+    def get_scaffold_package(self):
+        return None
+
+    def get_scaffold_package_class(self):
+        return None
+
+    def get_shareable_open_gl_widget(self):
+        return None
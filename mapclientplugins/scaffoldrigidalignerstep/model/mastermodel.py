@@ -1,21 +1,41 @@
+import collections
+import contextlib
 import json
+import os
 import platform
 
 import math
 
+import numpy as np
+
 from opencmiss.zinc.field import Field
 from opencmiss.zinc.status import OK as ZINC_OK
 from opencmiss.zinc.streamregion import StreaminformationRegion
 
 from .scaffoldmodel import ScaffoldModel
 from .datamodel import DataModel
+from .metrics import compute_alignment_metrics
+from .registration import MultiStartRegistration, TemporalRegistration, TemporalRegistrationResult, \
+    axis_aligned_rotations, create_solver, estimate_initial_orientation, random_rotations, solve_frames, \
+    start_matrices
+from ..utils import contenthash
+from ..utils import jsonstream
 from ..utils import maths
-from ..utils import zincutils
+from ..utils import pointcloud
+from ..utils import timeseries
+from ..utils.affine import AffineTransform
+from ..utils.framestatistics import STATISTICS_MODES
+
+WINDOWS_OS_FLAG = platform.system() == 'Windows'
+LINUX_OS_FLAG = not WINDOWS_OS_FLAG
+
+EX_FILE_FORMATS = ['.exf', '.exdata', '.ex2', 'exnode', '.ex']
 
-if platform.system() == 'Windows':
-    WINDOWS_OS_FLAG = True
-else:
-    LINUX_OS_FLAG = True
+ROTATION_ANGLES = ['yaw', 'pitch', 'roll']
+
+HISTORY_LIMIT = 100
+
+_MISSING = object()
 
 
 class MasterModel(object):
@@ -40,8 +60,30 @@ class MasterModel(object):
 
         self._data_file_name = None
         self._data_sir = None
-        self._rotation = None
+        self._rotation = [1.0, 0.0, 0.0, 0.0]
+        self._rotation_baseline = [1.0, 0.0, 0.0, 0.0]
         self._correction_factor = None
+        self._applied_transform = AffineTransform()
+        self._orientation_transform = AffineTransform()
+        self._pending_transform = AffineTransform()
+        self._registration_solver = None
+        self._registration_solver_key = None
+        self._registration_data_points = None
+        self._registration_data_time = None
+        self._registration_result = None
+        self._statistics_mode = None
+        self._reference_frame = 0
+        self._lazy_loading = True
+        self._frame_cache_budget = 256 * 1024 * 1024
+        self._prefetch_frames = 2
+        self._scaffold_hash = None
+        self._data_hash = None
+        self._transform_scaled = False
+        self._undo_history = collections.deque(maxlen=HISTORY_LIMIT)
+        self._redo_history = []
+        self._history_depth = 0
+        self._alignment_metrics = None
+        self._metrics_points_per_element_edge = 4
 
         self._scaffold_model = ScaffoldModel(self._context, self._scaffold_region, self._material_module)
         self._data_model = DataModel(self._context, self._data_region, self._material_module)
@@ -109,11 +151,159 @@ class MasterModel(object):
         return node_positions
 
     def reset_settings(self):
-        self._settings = dict(partial_z=None, partial_y=None, partial_x=None,
-                              yaw=0.0, pitch=0.0, roll=0.0,
-                              scaffold_up=None, data_up=None,
-                              flip=None)
+        with self._history_step():
+            self._settings = dict(partial_z=None, partial_y=None, partial_x=None,
+                                  yaw=0.0, pitch=0.0, roll=0.0,
+                                  scaffold_up=None, data_up=None,
+                                  flip=None)
+            self._resync_statistics_mode()
+            self._registration_result = None
+            self._transform_scaled = False
+            self._current_angle_value = [0., 0., 0.]
+            self.reset_scaffold()
+            self._apply_callback()
+
+    def reset_scaffold(self):
+        """
+        Clear all transforms of the scaffold. If some were already applied to the nodes, the coordinates
+        kept at initialise_scaffold are written back in one bulk change rather than regenerating the scaffold.
+
+        :return: True on success, False if the coordinates could not be restored.
+        """
+        success = True
+        if not self._applied_transform.is_identity():
+            success = self._scaffold_model.restore_coordinates()
+        self._applied_transform.reset()
+        self._orientation_transform.reset()
+        self._pending_transform.reset()
+        self._rotation_baseline = [1.0, 0.0, 0.0, 0.0]
+        self._update_rotation()
+        self._update_preview()
+        return success
+
+    def _get_history_state(self):
+        """
+        Get the scaffold transform state: three 4x4 matrices, the rotation angles and baseline and a few
+        references, so each history step has the same small size whatever the scaffold.
+        """
+        return dict(applied=self._applied_transform.get_matrix(),
+                    orientation=self._orientation_transform.get_matrix(),
+                    pending=self._pending_transform.get_matrix(),
+                    angles=list(self._current_angle_value), rotation_baseline=list(self._rotation_baseline),
+                    registration_result=self._registration_result, transform_scaled=self._transform_scaled,
+                    generator_scale=self._generator_settings['scale'])
+
+    @staticmethod
+    def _is_same_history_state(state, other_state):
+        for key in state:
+            if key in ['applied', 'orientation', 'pending']:
+                if not np.array_equal(state[key], other_state[key]):
+                    return False
+            elif key == 'registration_result':
+                if state[key] is not other_state[key]:
+                    return False
+            elif state[key] != other_state[key]:
+                return False
+        return True
+
+    @contextlib.contextmanager
+    def _history_step(self):
+        """
+        Record the changes made in the with block as one undo step: the transform state before and the
+        previous values of the settings which changed. Nested steps are part of the outermost one.
+        """
+        self._history_depth += 1
+        if self._history_depth > 1:
+            try:
+                yield
+            finally:
+                self._history_depth -= 1
+            return
+        state = self._get_history_state()
+        settings = dict(self._settings)
+        try:
+            yield
+        finally:
+            self._history_depth -= 1
+        settings_delta = dict((key, settings.get(key, _MISSING)) for key in set(settings) | set(self._settings)
+                              if settings.get(key, _MISSING) != self._settings.get(key, _MISSING))
+        if settings_delta or not self._is_same_history_state(state, self._get_history_state()):
+            state['settings'] = settings_delta
+            self._undo_history.append(state)
+            self._redo_history = []
+
+    def _swap_history_state(self, state):
+        """
+        Return to a recorded state. Transforms already applied to the nodes are recomposed from the
+        pristine coordinates in one bulk apply, the others are only previewed.
+
+        :return: The state left, to return to it again.
+        """
+        current_state = self._get_history_state()
+        current_state['settings'] = dict((key, self._settings.get(key, _MISSING)) for key in state['settings'])
+        for key, value in state['settings'].items():
+            if value is _MISSING:
+                self._settings.pop(key, None)
+            else:
+                self._settings[key] = value
+        self._resync_statistics_mode()
+        if not np.array_equal(state['applied'], self._applied_transform.get_matrix()):
+            self._scaffold_model.restore_coordinates()
+            self._applied_transform.set_matrix(state['applied'])
+            if not self._applied_transform.is_identity():
+                self._scaffold_model.apply_transform(self._applied_transform)
+        self._orientation_transform.set_matrix(state['orientation'])
+        self._pending_transform.set_matrix(state['pending'])
+        self._current_angle_value = list(state['angles'])
+        self._rotation_baseline = list(state['rotation_baseline'])
+        self._registration_result = state['registration_result']
+        self._transform_scaled = state['transform_scaled']
+        # Only the settings passed to the next step change, as in _scale_generator.
+        self._generator_settings['scale'] = state['generator_scale']
+        self._parameters['scale'] = state['generator_scale']
+        self._update_rotation()
+        self._update_preview()
         self._apply_callback()
+        return current_state
+
+    def undo(self):
+        """
+        Undo the last orientation, rotation, registration, restored settings or reset.
+
+        :return: True if a step was undone, False if there is nothing to undo.
+        """
+        if not self._undo_history:
+            return False
+        self._redo_history.append(self._swap_history_state(self._undo_history.pop()))
+        return True
+
+    def redo(self):
+        """
+        Redo the last undone step.
+
+        :return: True if a step was redone, False if there is nothing to redo.
+        """
+        if not self._redo_history:
+            return False
+        self._undo_history.append(self._swap_history_state(self._redo_history.pop()))
+        return True
+
+    def can_undo(self):
+        return len(self._undo_history) > 0
+
+    def can_redo(self):
+        return len(self._redo_history) > 0
+
+    def set_history_limit(self, limit):
+        """
+        Set the number of undo steps kept, dropping the oldest.
+        """
+        self._undo_history = collections.deque(self._undo_history, maxlen=limit)
+        self._redo_history = self._redo_history[-limit:] if limit > 0 else []
+
+    def clear_history(self):
+        self._undo_history.clear()
+        self._redo_history = []
 
     def get_context(self):
         return self._context
@@ -157,6 +347,110 @@ class MasterModel(object):
     def _get_time_sequence(self):
         return self._data_model.get_time_sequence()
 
+    def get_time_sequence(self):
+        """
+        Get the time of each data frame: the times stored in point cloud files, otherwise the frame index.
+        """
+        return self._get_time_sequence()
+
+    def get_transform(self):
+        """
+        Get the 4x4 matrix of all transforms made to the scaffold, applied or pending.
+        """
+        transform = self._applied_transform.copy()
+        transform.compose(self._get_pending_transform().get_matrix())
+        return transform.get_matrix()
+
+    def _get_rotation_matrix(self):
+        matrix = np.identity(4)
+        matrix[:3, :3] = maths.rotmx(np.asarray(self._rotation))
+        return matrix
+
+    def _get_pending_transform(self):
+        """
+        Get the transform not yet applied to the nodes: the up axes swap, then the yaw, pitch and roll
+        rotation about the data axes, then the other pending transforms.
+        """
+        transform = self._orientation_transform.copy()
+        transform.compose(self._get_rotation_matrix())
+        transform.compose(self._pending_transform.get_matrix())
+        return transform
+
+    def _set_pending_transform(self, matrix):
+        """
+        Set the pending transforms so that, after the current axes swap and rotation, the scaffold gets
+        the 4x4 matrix.
+        """
+        oriented = np.dot(self._get_rotation_matrix(), self._orientation_transform.get_matrix())
+        self._pending_transform.set_matrix(np.dot(matrix, np.linalg.inv(oriented)))
+
+    def _update_rotation(self):
+        """
+        Rebuild the rotation quaternion from the absolute yaw, pitch and roll, relative to the angles
+        already applied to the nodes, so it does not depend on the order or number of angle edits.
+        """
+        angles = [math.radians(x) for x in self._current_angle_value]
+        rotation = maths.quaternionMultiply(maths.eulerToQuaternion(angles),
+                                            maths.quaternionConjugate(self._rotation_baseline))
+        self._rotation = maths.normalize(rotation)
+
+    def _commit_transform(self):
+        """
+        Apply the pending transform to the scaffold coordinate field in one node traversal.
+        """
+        pending = self._get_pending_transform()
+        if pending.is_identity():
+            return True
+        success = self._scaffold_model.apply_transform(pending)
+        self._applied_transform.compose(pending.get_matrix())
+        self._orientation_transform.reset()
+        self._pending_transform.reset()
+        self._rotation_baseline = maths.eulerToQuaternion([math.radians(x) for x in self._current_angle_value])
+        self._rotation = [1.0, 0.0, 0.0, 0.0]
+        self._scaffold_model.set_coordinate_field(self._scaffold_coordinate_field)
+        self._scaffold_model.reset_preview_transform()
+        return success
+
+    def _update_preview(self):
+        """
+        Draw the scaffold with the pending transform without rewriting its nodes.
+        """
+        pending = self._get_pending_transform()
+        self._scaffold_model.set_preview_transform(pending.get_linear(), pending.get_translation())
+
+    def set_statistics_mode(self, mode, reference_frame=0):
+        """
+        Set which data range scaling and centring use for time series: None for the frame evaluated by
+        Zinc, 'reference' for reference_frame, 'union' for the range bounding all frames or 'mean' for
+        the mean per frame range. The per frame statistics are computed once for all frames.
+        """
+        if (mode is not None) and (mode not in STATISTICS_MODES):
+            raise ValueError('Unknown statistics mode: {}'.format(mode))
+        self._statistics_mode = mode
+        self._reference_frame = reference_frame
+        self._settings['statistics_mode'] = mode
+        self._settings['reference_frame'] = reference_frame
+
+    def _resync_statistics_mode(self):
+        """
+        Take the statistics mode and reference frame back from the settings after they were loaded,
+        reset or swapped by undo and redo.
+        """
+        self._statistics_mode = self._settings.get('statistics_mode')
+        self._reference_frame = self._settings.get('reference_frame', 0)
+
+    def _get_data_range(self):
+        frame_statistics = None
+        if self._statistics_mode is not None:
+            frame_statistics = self._data_model.get_frame_statistics()
+        if frame_statistics is None:
+            return self._data_model.get_range()
+        return frame_statistics.get_range(self._statistics_mode, self._reference_frame)
+
+    def _get_data_scale(self):
+        minimums, maximums = self._get_data_range()
+        return maths.sub(minimums, maximums)
+
     def get_scaffold_to_data_ratio(self, partial=None):
         if partial:
             correction_factors = [1.0, 1.0, 1.0]
@@ -175,7 +469,7 @@ class MasterModel(object):
                 if correction_factors[factor_index] == 0.0:
                     correction_factors[factor_index] = 1.0
 
-            data_range_temp = self._data_model.get_scale()
+            data_range_temp = self._get_data_scale()
 
             for range_index in range(len(data_range_temp)):
                 if data_range_temp[range_index] == 0.0:
@@ -191,7 +485,7 @@ class MasterModel(object):
                     diff[temp_index] = 1.0
 
         else:
-            data_scale = self._data_model.get_scale()
+            data_scale = self._get_data_scale()
             scaffold_scale = self._scaffold_model.get_scale()
             diff = maths.eldiv(scaffold_scale, data_scale)
             self._correction_factor = None
@@ -203,6 +497,25 @@ class MasterModel(object):
 
     def initialise_scaffold(self,):
         self._scaffold_coordinate_field = self._scaffold_model.get_coordinate_field()
+        pristine_parameters = self._scaffold_model.snapshot_coordinates()
+        self._scaffold_hash = None if pristine_parameters is None else contenthash.hash_arrays(*pristine_parameters)
+        self.clear_history()
+
+    def initialise_data(self, file_name):
+        """
+        Initialise the data from an EX, JSON or point cloud file, matching its extension.
+        """
+        _, file_extension = os.path.splitext(file_name)
+        self._data_hash = None
+        if file_extension in EX_FILE_FORMATS:
+            self.initialise_ex_data(file_name)
+        elif file_extension == '.json':
+            self.initialise_json_data(file_name)
+        elif file_extension == pointcloud.POINT_CLOUD_FILE_EXTENSION:
+            self.initialise_point_cloud_data(file_name)
+        else:
+            raise TypeError('Data file with {} format is not supported.'
+                            'Use EX, JSON or {}.'.format(file_extension, pointcloud.POINT_CLOUD_FILE_EXTENSION))
 
     def initialise_ex_data(self, file_name):
         self._data_sir = self._data_region.createStreaminformationRegion()
@@ -222,13 +535,78 @@ class MasterModel(object):
     def initialise_json_data(self, file_name):
         self._data_file_name = file_name
 
-    def _initialise_jason_data(self):
-        with open(self._data_file_name, 'r') as f:
-            json_dict = json.loads(f.read())
-        self._data_coordinate_field = self._data_model.set_data_coordinate_field_from_json_file(json_dict)
+    @staticmethod
+    def _iterate_json_frames(file_object, progress=None):
+        file_size = float(max(os.fstat(file_object.fileno()).st_size, 1))
+        for _, value, _, end in jsonstream.iterate_object_items(file_object, 'AnnotatedFrames'):
+            if progress is not None:
+                progress(end / file_size, 'Reading frames')
+            yield value
+
+    def set_subsampling(self, strategy, **options):
+        """
+        Set how the frames of JSON data are brought to the same number of points: 'random' with
+        a seed, 'farthest_point', 'voxel_grid' or 'keep_all'. Takes effect on the next load.
+        """
+        self._data_model.set_subsampling(strategy, **options)
+
+    def initialise_point_cloud_data(self, file_name):
+        self._data_file_name = file_name
 
-    def load_json_data(self):
-        self._initialise_jason_data()
+    def set_lazy_loading(self, lazy_loading, memory_budget=None, prefetch=None):
+        """
+        Set whether JSON and point cloud time series are loaded lazily, only the frame at the current
+        time being put in the data region and the last frames kept in a cache of memory_budget bytes.
+        """
+        self._lazy_loading = lazy_loading
+        if memory_budget is not None:
+            self._frame_cache_budget = memory_budget
+            self._data_model.set_frame_cache_budget(memory_budget)
+        if prefetch is not None:
+            self._prefetch_frames = prefetch
+
+    def read_data(self, progress=None):
+        """
+        Read the data file given to the initialise method without touching the Zinc regions, so it can
+        run on a worker thread. Pass the result to load_data.
+
+        :param progress: Optional callable taking the fraction read and a message; it may raise to abandon reading.
+        :return: Dict of a lazy frame 'source', or of 'positions' and 'mask'; None for EX files which Zinc reads.
+        """
+        if self._lazy_loading:
+            source = timeseries.open_frame_source(self._data_file_name, progress)
+            if source is not None:
+                return dict(source=source)
+        _, file_extension = os.path.splitext(self._data_file_name)
+        if file_extension == pointcloud.POINT_CLOUD_FILE_EXTENSION:
+            positions, times = pointcloud.read_point_cloud(self._data_file_name)
+            return dict(positions=positions, mask=None, times=times)
+        if file_extension == '.json':
+            with open(self._data_file_name, 'rb') as f:
+                positions, mask = self._data_model.read_frames(self._iterate_json_frames(f, progress))
+            return dict(positions=positions, mask=mask)
+        return None
+
+    def load_data(self, data=None):
+        """
+        Load the data file given to the initialise method matching its format into the data region.
+
+        :param data: Result of read_data, read here if None.
+        """
+        self._clear_registration_cache()
+        if data is None:
+            data = self.read_data()
+        if data is None:
+            self.load_ex_data()
+            return
+        if 'source' in data:
+            self._data_coordinate_field = self._data_model.set_data_coordinate_field_from_frame_source(
+                data['source'], self._frame_cache_budget, self._prefetch_frames)
+        else:
+            self._data_coordinate_field = self._data_model.set_data_coordinate_field_from_positions(
+                data['positions'], data['mask'], data.get('times'))
+        if not self._data_file_name.endswith(pointcloud.POINT_CLOUD_FILE_EXTENSION):
+            self._settings['subsampling'] = self._data_model.get_subsampling()
 
     def create_graphics(self):
         self._scaffold_model.create_scaffold_graphics()
@@ -262,78 +640,413 @@ class MasterModel(object):
         file_name = path + self._os_specific_sep + 'aligned_mesh.exf'
         self._aligned_scaffold_filename = file_name
 
-    def load_settings(self):
-        path = self._os_specific_sep.join(self._location.split(self._os_specific_sep)[:-1])
-        file_name = path + self._os_specific_sep + 'rigid-settings.json'
+    def _get_data_hash(self):
+        if (self._data_hash is None) and (self._data_file_name is not None):
+            self._data_hash = contenthash.hash_file(self._data_file_name)
+        return self._data_hash
+
+    def load_settings(self, file_name=None):
+        """
+        Load settings saved by save_settings, by default from rigid-settings.json in the step location.
+        """
+        if file_name is None:
+            path = self._os_specific_sep.join(self._location.split(self._os_specific_sep)[:-1])
+            file_name = path + self._os_specific_sep + 'rigid-settings.json'
         with open(file_name, 'r') as f:
             self._settings.update(json.loads(f.read()))
 
-    def apply_after_load_settings(self):
-        self.apply_orientation()
-        self._apply_callback()
+    def settings_match_inputs(self):
+        """
+        Whether the loaded settings were saved for a scaffold and data with the same content as the current ones.
+        """
+        scaffold_hash = self._settings.get('scaffold_hash')
+        data_hash = self._settings.get('data_hash')
+        return (scaffold_hash is not None) and (data_hash is not None) and \
+            (scaffold_hash == self._scaffold_hash) and (data_hash == self._get_data_hash())
+
+    def restore_settings(self, file_name=None):
+        """
+        Load settings saved by save_settings and restore the scaffold alignment in one operation. If the
+        settings were saved for the same scaffold and data content, the saved transform is previewed as it
+        is, and done() does not recompute the scale and centring if they were saved with it; otherwise the
+        orientation and angles are replayed.
+
+        :return: True if the saved transform was restored, False if the settings were replayed.
+        """
+        with self._history_step():
+            self.load_settings(file_name)
+            self._resync_statistics_mode()
+            self._apply_saved_subsampling()
+            if ('transform' in self._settings) and self.settings_match_inputs():
+                target = np.array(self._settings['transform'], dtype=np.float64)
+                self._orientation_transform.reset()
+                self._orientation_transform.swap_axes(self._settings)
+                self._current_angle_value = [self._settings['yaw'], self._settings['pitch'], self._settings['roll']]
+                self._update_rotation()
+                self._set_pending_transform(np.dot(target, np.linalg.inv(self._applied_transform.get_matrix())))
+                if self._settings.get('generator_scale') is not None:
+                    self._generator_settings['scale'] = self._settings['generator_scale']
+                    self._parameters['scale'] = self._settings['generator_scale']
+                self._transform_scaled = bool(self._settings.get('transform_scaled'))
+                self._update_preview()
+                self._apply_callback()
+                return True
+            self._transform_scaled = False
+            self.apply_orientation()
+            self.set_rotation(self._settings['yaw'], self._settings['pitch'], self._settings['roll'])
+            return False
+
+    def _apply_saved_subsampling(self):
+        """
+        Set the subsampling recorded in the loaded settings, reloading JSON data already subsampled
+        otherwise, so the restored alignment is on the same points it was saved for.
+        """
+        subsampling = self._settings.get('subsampling')
+        if (subsampling is None) or (subsampling == self._data_model.get_subsampling()):
+            return
+        options = dict(subsampling)
+        self._data_model.set_subsampling(options.pop('strategy'), **options)
+        if self._data_file_name.endswith('.json') and (self._data_model.get_positions() is not None):
+            self.load_data()
+        self._settings['subsampling'] = self._data_model.get_subsampling()
 
     def save_settings(self):
+        """
+        Save the settings with the transform made to the scaffold and the content hashes of the scaffold
+        and data to rigid-settings.json in the step location, for restore_settings.
+        """
+        settings = self._update_saved_settings()
+        self._write_settings(settings)
+        self._settings['data_hash'] = settings['data_hash']
+
+    def _update_saved_settings(self):
+        """
+        Record the transform made to the scaffold, whether it includes the scale and centring to the data,
+        the generator scale and the scaffold content hash in the settings and get a copy of them for
+        _write_settings.
+        """
+        self._settings['transform'] = self.get_transform().tolist()
+        self._settings['transform_scaled'] = self._transform_scaled
+        self._settings['generator_scale'] = self._generator_settings['scale']
+        self._settings['scaffold_hash'] = self._scaffold_hash
+        return dict(self._settings)
+
+    def _write_settings(self, settings):
+        """
+        Add the data content hash to settings and write them to rigid-settings.json. Hashing the data
+        file and writing do not touch Zinc, so this can run on a worker thread.
+        """
+        settings['data_hash'] = self._get_data_hash()
         path = self._os_specific_sep.join(self._location.split(self._os_specific_sep)[:-1])
         file_name = path + self._os_specific_sep + 'rigid-settings.json'
         with open(file_name, 'w') as f:
-            f.write(json.dumps(self._settings, default=lambda o: o.__dict__, sort_keys=True, indent=4))
+            f.write(json.dumps(settings, default=lambda o: o.__dict__, sort_keys=True, indent=4))
 
     def apply_orientation(self):
-        zincutils.swap_axes(self._scaffold_coordinate_field, self._settings)
-        self._scaffold_model.set_coordinate_field(self._scaffold_coordinate_field)
-        self._apply_callback()
+        """
+        Set the axes swap mapping the scaffold up axis onto the data up axis. It is applied before the
+        yaw, pitch and roll rotation, which therefore turns the scaffold about the data axes. No axes
+        chosen means no swap.
+
+        :raises ValueError: If the axes combination is not implemented.
+        """
+        orientation = AffineTransform()
+        if ((self._settings['scaffold_up'] is not None) or (self._settings['data_up'] is not None)) and \
+                not orientation.swap_axes(self._settings):
+            raise ValueError('The scaffold {} up and data {} up axes combination is not yet implemented.'.format(
+                self._settings['scaffold_up'], self._settings['data_up']))
+        with self._history_step():
+            self._orientation_transform = orientation
+            self._update_preview()
+            self._apply_callback()
 
     def rotate_scaffold(self, angle, value):
-        self._update_scaffold_coordinate_field()
-        next_angle_value = value
-        if angle == 'yaw':
-            if next_angle_value > self._current_angle_value[0]:
-                angle_value = next_angle_value - self._current_angle_value[0]
-            else:
-                angle_value = -(self._current_angle_value[0] - next_angle_value)
-            euler_angles = [angle_value, 0., 0.]
-            self._current_angle_value[0] = next_angle_value
-            self._settings['yaw'] = next_angle_value
-        elif angle == 'pitch':
-            if next_angle_value > self._current_angle_value[1]:
-                angle_value = next_angle_value - self._current_angle_value[1]
-            else:
-                angle_value = -(self._current_angle_value[1] - next_angle_value)
-            euler_angles = [0., angle_value, 0.]
-            self._current_angle_value[1] = next_angle_value
-            self._settings['pitch'] = next_angle_value
+        """
+        Set the absolute yaw, pitch or roll angle in degrees of the scaffold rotation.
+        """
+        with self._history_step():
+            self._update_scaffold_coordinate_field()
+            self._current_angle_value[ROTATION_ANGLES.index(angle)] = value
+            self._settings[angle] = value
+            self._update_rotation()
+            self._update_preview()
+            self._apply_callback()
+
+    def set_rotation(self, yaw, pitch, roll):
+        """
+        Set all three absolute rotation angles in degrees in one update.
+        """
+        with self._history_step():
+            self._current_angle_value = [yaw, pitch, roll]
+            self._settings.update(yaw=yaw, pitch=pitch, roll=roll)
+            self._update_rotation()
+            self._update_preview()
+            self._apply_callback()
+
+    def _clear_registration_cache(self):
+        self._registration_solver = None
+        self._registration_solver_key = None
+        self._registration_data_points = None
+        self._registration_data_time = None
+
+    def _get_registration_data_points(self):
+        """
+        Get a NumPy snapshot of the data cloud at the current time, kept until the time or the loaded data change.
+        """
+        if (self._registration_data_points is None) or (self._registration_data_time != self._current_time):
+            self._registration_solver = None
+            self._registration_data_points = self._data_model.get_node_coordinates(self._current_time)
+            self._registration_data_time = self._current_time
+        return self._registration_data_points
+
+    def _get_registration_solver(self, data_points, levels, coarsest_voxel_fraction, similarity, max_iterations,
+                                 tolerance):
+        """
+        Get the registration solver over the data points from _get_registration_data_points. The KD-trees
+        over them are only rebuilt when the data points or the solver options change. Uses NumPy alone, so
+        it can run on a worker thread.
+        """
+        key = (id(data_points), levels, coarsest_voxel_fraction, similarity, str(max_iterations), str(tolerance))
+        solver = self._registration_solver
+        if (solver is None) or (self._registration_solver_key != key):
+            options = dict(levels=levels, similarity=similarity, max_iterations=max_iterations, tolerance=tolerance)
+            if levels > 1:
+                options['coarsest_voxel_fraction'] = coarsest_voxel_fraction
+            solver = create_solver(data_points, **options)
+            self._registration_solver = solver
+            self._registration_solver_key = key
+        return solver
+
+    def estimate_orientation(self, similarity=False, points_per_element_edge=4):
+        """
+        Orient the scaffold onto the data cloud by matching their principal axes, replacing the manual
+        up axes selection, and preview the result.
+
+        :return: The 4x4 matrix composed onto the scaffold transform.
+        """
+        source_points = self._scaffold_model.get_surface_sample_points(points_per_element_edge)
+        data_points = self._data_model.get_node_coordinates(self._current_time)
+        matrix, _ = estimate_initial_orientation(source_points, data_points, similarity=similarity)
+        with self._history_step():
+            self._pending_transform.compose(matrix)
+            self._update_preview()
+            self._apply_callback()
+        return matrix
+
+    def create_registration_task(self, similarity=True, max_iterations=50, tolerance=1.0e-6,
+                                 points_per_element_edge=4, levels=3, coarsest_voxel_fraction=0.05,
+                                 initial_orientation=True):
+        """
+        Take NumPy snapshots of the scaffold sample points and the data cloud and get a function
+        solving the registration on them alone, so it can run on a worker thread. The KD-trees are
+        built by the function, not here. It takes an optional progress callable and returns the
+        result to pass to apply_registration_result. See register_automatically for the options.
+        """
+        source_points = self._scaffold_model.get_surface_sample_points(points_per_element_edge)
+        data_points = self._get_registration_data_points()
+
+        def solve(progress=None):
+            solver = self._get_registration_solver(data_points, levels, coarsest_voxel_fraction, similarity,
+                                                   max_iterations, tolerance)
+            initial_matrix = None
+            if initial_orientation:
+                initial_matrix, _ = estimate_initial_orientation(source_points, data_points, similarity=similarity)
+            return solver.solve(source_points, initial_matrix, progress)
+
+        return solve
+
+    def apply_registration_result(self, result):
+        """
+        Compose a registration result onto the scaffold transform and preview it. The scale of a
+        similarity fit multiplies the generator scale passed to the next step.
+        """
+        with self._history_step():
+            self._pending_transform.compose(result.matrix)
+            self._scale_generator(result.get_scale())
+            self._registration_result = result
+            self._transform_scaled = True
+            self._settings['registration_rms_error'] = result.rms_error
+            if isinstance(result, TemporalRegistrationResult):
+                self._settings['temporal_registration'] = dict(frame_rms_errors=list(result.frame_rms_errors),
+                                                               drift=result.drift)
+            self._update_preview()
+            self._apply_callback()
+        return result
+
+    def register_automatically(self, similarity=True, max_iterations=50, tolerance=1.0e-6,
+                               points_per_element_edge=4, levels=3, coarsest_voxel_fraction=0.05,
+                               initial_orientation=True):
+        """
+        Register the scaffold onto the data cloud with iterative closest point and preview the result.
+        The scale and centring in done() are skipped afterwards as the registration already includes them,
+        so a rigid fit with similarity False leaves the scaffold at its generator scale.
+
+        :param similarity: Also fit a uniform scale, which is carried into the generator scale.
+
+        :param initial_orientation: Start from the principal axes estimate rather than the current orientation.
+        :param levels: Number of coarse to fine pyramid levels; 1 solves at full resolution only.
+        :param max_iterations: Iteration cap, or a list of caps per level, coarsest first.
+        :param tolerance: Relative RMS tolerance, or a list of tolerances per level, coarsest first.
+        :return: RegistrationResult with the transform and the RMS error.
+        """
+        solve = self.create_registration_task(similarity, max_iterations, tolerance, points_per_element_edge,
+                                              levels, coarsest_voxel_fraction, initial_orientation)
+        return self.apply_registration_result(solve())
+
+    def create_temporal_registration_task(self, stride=1, similarity=True, max_iterations=50, tolerance=1.0e-6,
+                                          points_per_element_edge=4, initial_orientation=True, per_frame=False,
+                                          max_workers=None):
+        """
+        Like create_registration_task, but the task solves one transform minimising the residual over
+        every stride-th frame of the data together.
+
+        :param per_frame: Also register each of these frames on its own, in worker processes, and report
+         how far the per frame transforms drift from the joint one.
+        :param max_workers: Number of worker processes for the per frame registrations.
+        """
+        source_points = self._scaffold_model.get_surface_sample_points(points_per_element_edge)
+        frames = self._data_model.get_frames(stride)
+
+        def solve(progress=None):
+            initial_matrix = None
+            if initial_orientation:
+                initial_matrix, _ = estimate_initial_orientation(source_points, np.concatenate(frames),
+                                                                 similarity=similarity)
+            registration = TemporalRegistration(frames, similarity=similarity, max_iterations=max_iterations,
+                                                tolerance=tolerance)
+            result = registration.solve(source_points, initial_matrix, progress)
+            if per_frame:
+                result.set_frame_results(solve_frames(frames, source_points, result.matrix, max_workers=max_workers,
+                                                      progress=progress, similarity=similarity,
+                                                      max_iterations=max_iterations, tolerance=tolerance))
+            return result
+
+        return solve
+
+    def register_temporally(self, stride=1, similarity=True, max_iterations=50, tolerance=1.0e-6,
+                            points_per_element_edge=4, initial_orientation=True, per_frame=False, max_workers=None):
+        """
+        Register the scaffold onto all frames of the data at once and preview the result, see
+        create_temporal_registration_task.
+
+        :return: TemporalRegistrationResult, with the per frame results and drift if per_frame is True.
+        """
+        solve = self.create_temporal_registration_task(stride, similarity, max_iterations, tolerance,
+                                                       points_per_element_edge, initial_orientation, per_frame,
+                                                       max_workers)
+        return self.apply_registration_result(solve())
+
+    def register_multi_start(self, starts='principal', count=24, seed=None, max_workers=None, similarity=True,
+                             max_iterations=50, tolerance=1.0e-6, points_per_element_edge=4, levels=1):
+        """
+        Register the scaffold from several initial orientations in parallel worker processes, keep the
+        lowest residual and preview it. Workers get NumPy snapshots of the coordinates, not Zinc objects.
+
+        :param starts: 'principal' for the 24 axis permutations and sign flips of the principal frames,
+         'axis' for the 24 axis-aligned rotations or 'random' for count uniform random rotations.
+        :param seed: Random seed for 'random' starts.
+        :param max_workers: Number of worker processes, None for the number of processors.
+        :return: The best RegistrationResult and the list of all candidate results.
+        """
+        source_points = self._scaffold_model.get_surface_sample_points(points_per_element_edge)
+        data_points = self._data_model.get_node_coordinates(self._current_time)
+        if starts == 'principal':
+            rotations = None
+        elif starts == 'axis':
+            rotations = axis_aligned_rotations()
+        elif starts == 'random':
+            rotations = random_rotations(count, seed)
         else:
-            if next_angle_value > self._current_angle_value[2]:
-                angle_value = next_angle_value - self._current_angle_value[2]
-            else:
-                angle_value = -(self._current_angle_value[2] - next_angle_value)
-            euler_angles = [0., 0., angle_value]
-            self._current_angle_value[2] = next_angle_value
-            self._settings['roll'] = next_angle_value
-        angles = euler_angles
-        angles = [math.radians(x) for x in angles]
-        self._rotation = maths.eulerToRotationMatrix3(angles)
-        zincutils.transform_coordinates(self._scaffold_coordinate_field, self._rotation)
-        # self._scaffold_model.set_scaffold_graphics_post_rotate(self._transformed_scaffold_field)
-        self._apply_callback()
+            raise ValueError('Unknown registration starts: {}'.format(starts))
+        initial_matrices = start_matrices(source_points, data_points, rotations, similarity)
+        options = dict(levels=levels, similarity=similarity, max_iterations=max_iterations, tolerance=tolerance)
+        registration = MultiStartRegistration(data_points, max_workers=max_workers, **options)
+        result, candidates = registration.solve(source_points, initial_matrices)
+        self.apply_registration_result(result)
+        return result, candidates
+
+    def _scale_generator(self, factor):
+        """
+        Multiply each component of the generator scale setting by factor. Like _apply_scale, only the
+        settings passed to the next step change; the scaffold is not regenerated under the aligner.
+        """
+        if np.isclose(factor, 1.0, rtol=0.0, atol=1.0e-12):
+            return
+        scale = [float(value) * factor for value in str(self._generator_settings['scale']).split('*')]
+        scale_string = '*'.join('%.2f' % value for value in scale)
+        self._generator_settings['scale'] = scale_string
+        self._parameters['scale'] = scale_string
+
+    def get_registration_result(self):
+        return self._registration_result
+
+    def compute_alignment_metrics(self, points_per_element_edge=None):
+        """
+        Measure the fit of the scaffold surface, as previewed, to the data points at the current time:
+        point to surface and point to point residuals with their RMS, percentiles and Hausdorff distance.
+
+        :param points_per_element_edge: Surface samples along each element xi direction, default as set
+         with set_metrics_sampling.
+        :return: AlignmentMetrics.
+        """
+        if points_per_element_edge is None:
+            points_per_element_edge = self._metrics_points_per_element_edge
+        scaffold_points = self._scaffold_model.get_surface_sample_points(points_per_element_edge)
+        data_points = self._data_model.get_node_coordinates(self._current_time)
+        return compute_alignment_metrics(scaffold_points, data_points)
+
+    def set_metrics_sampling(self, points_per_element_edge):
+        """
+        Set the surface samples along each element xi direction used for the metrics computed by done().
+        """
+        self._metrics_points_per_element_edge = points_per_element_edge
+
+    def get_alignment_metrics(self):
+        """
+        Get the AlignmentMetrics of the aligned scaffold computed by done(), or None before.
+        """
+        return self._alignment_metrics
+
+    def get_alignment_report(self):
+        """
+        Get the metrics computed by done() as a dict, with the registration result if there is one.
+        """
+        return self._get_alignment_report(self._alignment_metrics)
+
+    def _get_alignment_report(self, metrics):
+        report = metrics.as_dict()
+        if self._registration_result is not None:
+            report['registration'] = self._registration_result.as_dict()
+        return report
+
+    def save_alignment_metrics(self):
+        """
+        Write the alignment report to rigid-metrics.json next to rigid-settings.json.
+        """
+        self._write_alignment_report(self.get_alignment_report())
+
+    def _write_alignment_report(self, report):
+        path = self._os_specific_sep.join(self._location.split(self._os_specific_sep)[:-1])
+        file_name = path + self._os_specific_sep + 'rigid-metrics.json'
+        with open(file_name, 'w') as f:
+            f.write(json.dumps(report, sort_keys=True, indent=4))
 
     def _apply_callback(self):
-        self._settings_change_callback()
+        # No callback is set when running without the widget.
+        if self._settings_change_callback is not None:
+            self._settings_change_callback()
 
     def set_settings_change_callback(self, settings_change_callback):
         self._settings_change_callback = settings_change_callback
 
     def _align_scaffold_on_data(self):
-        data_minimums, data_maximums = self._data_model.get_range()
+        data_minimums, data_maximums = self._get_data_range()
         data_centre = maths.mult(maths.add(data_minimums, data_maximums), 0.5)
         model_minimums, model_maximums = self._scaffold_model.get_range()
         model_maximums[1] = model_maximums[1] / 1.4
         model_centre = maths.mult(maths.add(model_minimums, model_maximums), 0.5)
         offset = maths.sub(data_centre, model_centre)
-        # zincutils.swap_axes(self._scaffold_coordinate_field, self._settings)
-        # zincutils.transform_coordinates(self._scaffold_coordinate_field, self._rotation)
-        zincutils.offset_scaffold(self._scaffold_coordinate_field, offset)
-        self._scaffold_model.set_coordinate_field(self._scaffold_coordinate_field)
+        self._pending_transform.translate(offset)
 
     def _scale_scaffold_to_data(self):
         if self._scaffold_data_scale_ratio is None:
@@ -370,7 +1083,7 @@ class MasterModel(object):
         scale_scaffold[2] = scale_scaffold[2] - 1
         # zincutils.scale_coordinates(self._scaffold_coordinate_field, scale_scaffold)
         mean_diff = sum(scale_scaffold) / len(scale_scaffold)
-        zincutils.scale_coordinates(self._scaffold_coordinate_field, [mean_diff]*3)
+        self._pending_transform.scale(mean_diff)
 
     def _update_scaffold_coordinate_field(self):
         self._scaffold_coordinate_field = self._scaffold_model.get_coordinate_field()
@@ -382,14 +1095,73 @@ class MasterModel(object):
         self._scaffold_coordinate_field = None
         self._scaffold_model.reset_region(self._scaffold_region)
         self._scaffold_coordinate_field = self._scaffold_model.get_coordinate_field()
-
-    def done(self, time=False):
-        self._scale_scaffold_to_data()
-        self._align_scaffold_on_data()
-        self.save_settings()
+        self._applied_transform.reset()
+        self._orientation_transform.reset()
+        self._pending_transform.reset()
+        self._rotation_baseline = [1.0, 0.0, 0.0, 0.0]
+        self._update_rotation()
+
+    def read_all_data(self, progress=None):
+        """
+        Read all frames of lazily loaded data without touching the Zinc regions, so it can run on a
+        worker thread before done().
+
+        :param progress: Optional callable taking the fraction read and a message; it may raise to abandon reading.
+        :return: Frames to pass to done() or create_done_task, or None if the data is already all loaded.
+        """
+        return self._data_model.read_all_frames(progress)
+
+    def create_done_task(self, frames=None):
+        """
+        Do the part of done() touching Zinc: load all data frames, commit the scaffold transform,
+        write the aligned scaffold and take NumPy snapshots of the scaffold surface samples and the
+        data points. Get a function computing the alignment metrics on these snapshots alone and
+        saving the settings and metrics files, so it can run on a worker thread. It takes an optional
+        progress callable and returns the metrics and data content hash to pass to apply_done_result.
+
+        :param frames: Result of read_all_data, read here if None.
+        """
+        self._data_coordinate_field = self._data_model.load_all_frames(frames)
+        if not self._transform_scaled:
+            self._scale_scaffold_to_data()
+            self._update_preview()
+            self._align_scaffold_on_data()
+            self._transform_scaled = True
+        self._commit_transform()
         self._scaffold_model.write_model(self._aligned_scaffold_filename)
-        model_description = self._get_model_description(time)
-        return model_description
+        settings = self._update_saved_settings()
+        scaffold_points = self._scaffold_model.get_surface_sample_points(self._metrics_points_per_element_edge)
+        data_points = self._data_model.get_node_coordinates(self._current_time)
+
+        def finish(progress=None):
+            if progress is not None:
+                progress(0.0, 'Saving settings')
+            self._write_settings(settings)
+            if progress is not None:
+                progress(0.5, 'Computing alignment metrics')
+            metrics = compute_alignment_metrics(scaffold_points, data_points)
+            self._write_alignment_report(self._get_alignment_report(metrics))
+            return metrics, settings['data_hash']
+
+        return finish
+
+    def apply_done_result(self, result, time=False):
+        """
+        Keep the alignment metrics and data content hash from the done task and describe the result
+        for the next step.
+        """
+        self._alignment_metrics, self._settings['data_hash'] = result
+        return self._get_model_description(time)
+
+    def done(self, time=False, frames=None):
+        """
+        Load all data frames, commit the scaffold transform, save the settings, alignment metrics and
+        aligned scaffold and describe the result for the next step, see create_done_task.
+
+        :param frames: Result of read_all_data, read here if None.
+        """
+        finish = self.create_done_task(frames)
+        return self.apply_done_result(finish(), time)
 
     def _write_scaffold(self):
         resources = {}
@@ -422,48 +1194,44 @@ class MasterModel(object):
         resources = {}
         stream_information = self._data_region.createStreaminformationRegion()
         if time_series:
-            time_values = self._get_time_sequence()
-            for time_value in time_values:
+            for time_value in self._get_time_sequence():
                 memory_resource = stream_information.createStreamresourceMemory()
                 stream_information.setResourceDomainTypes(memory_resource, Field.DOMAIN_TYPE_DATAPOINTS)
                 stream_information.setResourceAttributeReal(memory_resource, StreaminformationRegion.ATTRIBUTE_TIME,
                                                             time_value)
                 resources[str(time_value)] = memory_resource
-            self._data_region.write(stream_information)
-
-            buffer_contents = {}
-            for key in resources:
-                buffer_contents[key] = resources[key].getBuffer()[1]
-
-            return buffer_contents, time_values
         else:
             memory_resource = stream_information.createStreamresourceMemory()
             stream_information.setResourceDomainTypes(memory_resource, Field.DOMAIN_TYPE_DATAPOINTS)
             resources['datapoints'] = memory_resource
-            self._data_region.write(stream_information)
+        self._data_region.write(stream_information)
 
-            buffer_contents = {}
-            for key in resources:
-                buffer_contents[key] = resources[key].getBuffer()[1]
+        buffer_contents = {}
+        for key in resources:
+            buffer_contents[key] = resources[key].getBuffer()[1]
 
-            return buffer_contents
+        return buffer_contents
 
     def _get_model_description(self, time=False):
-        scaffold_region_description = self._write_scaffold()
-        if time:
-            data_region_description, time_sequence = self._write_data(time)
-        else:
-            time_sequence = None
-            data_region_description = self._write_data()
-
+        """
+        Describe the aligned scaffold and data for the next step. The live regions, the data positions
+        and the applied transform are handed over as they are; the serialised region buffers are only
+        written if the next step asks for them.
+        """
+        time_sequence = self._get_time_sequence() if time else None
         descriptions = dict(context=self._context, scaffold_region=self._scaffold_region,
                             coordinates=self._scaffold_coordinate_field, settings=self._settings,
                             generator_settings=self._generator_settings, parameters=self._parameters,
                             generator_model=self._generator_model, model_name=self._model_name,
                             model_species=self._species, scaffold_package=self._scaffold_package,
                             scaffold_package_class=self._scaffold_package_class, shareable_widget=self._shareable_widget,
-                            data_region_description=data_region_description, time_sequence=time_sequence,
-                            correction_factor=self._correction_factor)
+                            data_region=self._data_region, data_coordinates=self._data_coordinate_field,
+                            data_positions=self._data_model.get_positions(),
+                            transform=self._applied_transform.get_matrix().tolist(),
+                            alignment_metrics=self._alignment_metrics,
+                            scaffold_region_writer=self._write_scaffold,
+                            data_region_writer=lambda: self._write_data(time),
+                            time_sequence=time_sequence, correction_factor=self._correction_factor)
         model_description = ModelDescription(descriptions)
         return model_description
 
@@ -483,7 +1251,15 @@ class ModelDescription(object):
         self._scaffold_package = description['scaffold_package']
         self._scaffold_package_class = description['scaffold_package_class']
         self._shareable_widget = description['shareable_widget']
-        self._data_region_description = description['data_region_description']
+        self._data_region = description.get('data_region')
+        self._data_coordinate_field = description.get('data_coordinates')
+        self._data_positions = description.get('data_positions')
+        self._transform = description.get('transform')
+        self._alignment_metrics = description.get('alignment_metrics')
+        self._scaffold_region_writer = description.get('scaffold_region_writer')
+        self._scaffold_region_description = description.get('scaffold_region_description')
+        self._data_region_writer = description.get('data_region_writer')
+        self._data_region_description = description.get('data_region_description')
         time = description['time_sequence']
         if time:
             self._time = time
@@ -529,7 +1305,44 @@ class ModelDescription(object):
     def get_shareable_widget(self):
         return self._shareable_widget
 
+    def get_data_region(self):
+        return self._data_region
+
+    def get_data_coordinates(self):
+        return self._data_coordinate_field
+
+    def get_data_positions(self):
+        """
+        Get the (frames, points, 3) data positions array, without copying, or None for EX data.
+        """
+        return self._data_positions
+
+    def get_transform(self):
+        """
+        Get the 4x4 transform applied to the scaffold coordinates, as nested lists.
+        """
+        return self._transform
+
+    def get_alignment_metrics(self):
+        """
+        Get the AlignmentMetrics of the scaffold onto the data, see model.metrics.
+        """
+        return self._alignment_metrics
+
+    def get_scaffold_region_description(self):
+        """
+        Get the scaffold region serialised into memory buffers, written on first call.
+        """
+        if (self._scaffold_region_description is None) and (self._scaffold_region_writer is not None):
+            self._scaffold_region_description = self._scaffold_region_writer()
+        return self._scaffold_region_description
+
     def get_data_region_description(self):
+        """
+        Get the data region serialised into memory buffers, per time if temporal, written on first call.
+        """
+        if (self._data_region_description is None) and (self._data_region_writer is not None):
+            self._data_region_description = self._data_region_writer()
         return self._data_region_description
 
     def get_start_time(self):
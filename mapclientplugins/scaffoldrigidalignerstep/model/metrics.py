@@ -0,0 +1,125 @@
+"""
+Quality measures of an alignment of scaffold sample points onto a data point cloud.
+
+Like the registration module everything here works on NumPy arrays only, no Zinc objects.
+"""
+import numpy as np
+
+from scipy.spatial import cKDTree
+
+PERCENTILES = [50, 90, 95, 99]
+
+
+def estimate_normals(points, neighbours=8, tree=None):
+    """
+    Estimate unit normals of a sampled surface as the least principal axis of each point's
+    neighbourhood, in one batched eigen decomposition.
+
+    :param points: (N, 3) array of surface samples.
+    :param neighbours: Number of nearest samples, including the point itself, in each neighbourhood.
+    :param tree: Optional cKDTree over points, built here if None.
+    :return: (N, 3) array of normals, with arbitrary sign.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    neighbours = max(3, min(neighbours, len(points)))
+    if tree is None:
+        tree = cKDTree(points)
+    _, indexes = tree.query(points, k=neighbours)
+    neighbourhoods = points[indexes]
+    centred = neighbourhoods - neighbourhoods.mean(axis=1)[:, np.newaxis]
+    covariances = np.einsum('nki,nkj->nij', centred, centred)
+    _, vectors = np.linalg.eigh(covariances)
+    return vectors[:, :, 0]
+
+
+def summarise_distances(distances, percentiles=None):
+    """
+    Get the RMS, mean, maximum and percentiles of distances as a dict of floats.
+    """
+    distances = np.asarray(distances, dtype=np.float64)
+    if percentiles is None:
+        percentiles = PERCENTILES
+    if len(distances) == 0:
+        return dict(rms=None, mean=None, max=None, percentiles=dict((str(p), None) for p in percentiles))
+    values = np.percentile(distances, percentiles)
+    return dict(rms=float(np.sqrt(np.mean(distances * distances))), mean=float(distances.mean()),
+                max=float(distances.max()),
+                percentiles=dict((str(p), float(value)) for p, value in zip(percentiles, values)))
+
+
+class AlignmentMetrics(object):
+    """
+    Residuals of an alignment: for every data point its distance to the closest scaffold sample and to
+    the scaffold surface, and for every scaffold sample its distance to the closest data point.
+    """
+
+    def __init__(self, data_to_scaffold, scaffold_to_data, point_to_surface, percentiles=None):
+        self.data_to_scaffold = data_to_scaffold
+        self.scaffold_to_data = scaffold_to_data
+        self.point_to_surface = point_to_surface
+        self.percentiles = PERCENTILES if percentiles is None else list(percentiles)
+
+    def get_rms_error(self):
+        """
+        Get the RMS point to surface distance of the data points.
+        """
+        return summarise_distances(self.point_to_surface, self.percentiles)['rms']
+
+    def get_hausdorff_distance(self):
+        """
+        Get the symmetric Hausdorff distance between the data points and the scaffold samples.
+        """
+        if (len(self.data_to_scaffold) == 0) or (len(self.scaffold_to_data) == 0):
+            return None
+        return float(max(self.data_to_scaffold.max(), self.scaffold_to_data.max()))
+
+    def as_dict(self, residuals=False):
+        """
+        :param residuals: Also include the per point residuals as lists.
+        """
+        description = dict(rms_error=self.get_rms_error(), hausdorff_distance=self.get_hausdorff_distance(),
+                           data_points=len(self.data_to_scaffold), scaffold_points=len(self.scaffold_to_data),
+                           point_to_surface=summarise_distances(self.point_to_surface, self.percentiles),
+                           data_to_scaffold=summarise_distances(self.data_to_scaffold, self.percentiles),
+                           scaffold_to_data=summarise_distances(self.scaffold_to_data, self.percentiles))
+        if residuals:
+            description['residuals'] = dict(point_to_surface=self.point_to_surface.tolist(),
+                                            data_to_scaffold=self.data_to_scaffold.tolist(),
+                                            scaffold_to_data=self.scaffold_to_data.tolist())
+        return description
+
+
+def compute_alignment_metrics(scaffold_points, data_points, percentiles=None, normal_neighbours=8):
+    """
+    Measure how well scaffold surface samples fit a data cloud, with a KD-tree over each.
+
+    The point to surface distance of a data point is its distance to the tangent plane at the closest
+    scaffold sample, or the distance to that sample where the point lies beyond the sample spacing from
+    it along the plane, so it is never more than the point to point distance.
+
+    :param scaffold_points: (M, 3) array of samples of the scaffold surface.
+    :param data_points: (N, 3) array of the data cloud.
+    :param percentiles: Percentiles to report, default PERCENTILES.
+    :param normal_neighbours: Number of samples used to estimate each surface normal.
+    :return: AlignmentMetrics.
+    """
+    scaffold_points = np.asarray(scaffold_points, dtype=np.float64).reshape(-1, 3)
+    data_points = np.asarray(data_points, dtype=np.float64).reshape(-1, 3)
+    if (len(scaffold_points) == 0) or (len(data_points) == 0):
+        empty = np.zeros(0)
+        return AlignmentMetrics(empty, empty, empty, percentiles)
+    scaffold_tree = cKDTree(scaffold_points)
+    data_tree = cKDTree(data_points)
+    data_to_scaffold, closest = scaffold_tree.query(data_points)
+    scaffold_to_data, _ = data_tree.query(scaffold_points)
+
+    if len(scaffold_points) < 3:
+        return AlignmentMetrics(data_to_scaffold, scaffold_to_data, data_to_scaffold.copy(), percentiles)
+    normals = estimate_normals(scaffold_points, normal_neighbours, scaffold_tree)
+    spacing = scaffold_tree.query(scaffold_points, k=2)[0][:, 1]
+    offsets = data_points - scaffold_points[closest]
+    normal_distances = np.abs(np.einsum('ni,ni->n', offsets, normals[closest]))
+    tangential_distances = np.sqrt(np.maximum(data_to_scaffold * data_to_scaffold -
+                                              normal_distances * normal_distances, 0.0))
+    point_to_surface = np.where(tangential_distances <= spacing[closest], normal_distances, data_to_scaffold)
+    return AlignmentMetrics(data_to_scaffold, scaffold_to_data, point_to_surface, percentiles)
@@ -0,0 +1,553 @@
+"""
+Automatic registration of scaffold sample points onto a data point cloud.
+
+Everything here works on NumPy arrays only, no Zinc objects, so it can run anywhere.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from scipy.spatial import cKDTree
+
+from ..utils.subsampling import voxel_downsample
+
+
+def kabsch(source, target, similarity=False):
+    """
+    Get the least squares rotation, translation and optional uniform scale mapping source onto target
+    paired points, i.e. target ~ scale * rotation . source + translation.
+
+    :param source: (N, 3) array.
+    :param target: (N, 3) array paired with source.
+    :param similarity: Also solve for a uniform scale if True.
+    :return: rotation (3, 3), translation (3,), scale.
+    """
+    source_centroid = source.mean(axis=0)
+    target_centroid = target.mean(axis=0)
+    source_centred = source - source_centroid
+    target_centred = target - target_centroid
+    covariance = np.dot(target_centred.T, source_centred)
+    u, s, vt = np.linalg.svd(covariance)
+    correction = np.ones(3)
+    if np.linalg.det(np.dot(u, vt)) < 0.0:
+        # Avoid reflections.
+        correction[2] = -1.0
+    rotation = np.dot(u * correction, vt)
+    scale = 1.0
+    if similarity:
+        source_variance = np.sum(source_centred * source_centred)
+        if source_variance > 0.0:
+            scale = np.sum(s * correction) / source_variance
+    translation = target_centroid - scale * np.dot(rotation, source_centroid)
+    return rotation, translation, scale
+
+
+def to_matrix(rotation, translation, scale=1.0):
+    matrix = np.identity(4)
+    matrix[:3, :3] = scale * np.asarray(rotation)
+    matrix[:3, 3] = translation
+    return matrix
+
+
+def transform_points(matrix, points):
+    return np.dot(points, matrix[:3, :3].T) + matrix[:3, 3]
+
+
+def centroid_matrix(source, target):
+    """
+    Get the translation matrix moving the centroid of source onto the centroid of target.
+    """
+    matrix = np.identity(4)
+    matrix[:3, 3] = np.mean(target, axis=0) - np.mean(source, axis=0)
+    return matrix
+
+
+def subsample_evenly(points, max_points):
+    """
+    Deterministically take at most max_points of points at an even stride.
+    """
+    if len(points) <= max_points:
+        return points
+    return points[np.linspace(0, len(points) - 1, max_points).astype(np.int64)]
+
+
+def principal_axes(points):
+    """
+    Get the centroid, principal variances in decreasing order and the principal axes of points
+    as the columns of a right-handed rotation matrix.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    centroid = points.mean(axis=0)
+    centred = points - centroid
+    covariance = np.dot(centred.T, centred) / len(points)
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    order = np.argsort(eigenvalues)[::-1]
+    eigenvalues = eigenvalues[order]
+    eigenvectors = eigenvectors[:, order]
+    if np.linalg.det(eigenvectors) < 0.0:
+        eigenvectors[:, 2] = -eigenvectors[:, 2]
+    return centroid, eigenvalues, eigenvectors
+
+
+def axis_aligned_rotations():
+    """
+    Get the 24 proper rotations permuting and flipping the coordinate axes as a (24, 3, 3) array.
+    """
+    rotations = []
+    for permutation in [(0, 1, 2), (0, 2, 1), (1, 0, 2), (1, 2, 0), (2, 0, 1), (2, 1, 0)]:
+        for signs in [(1, 1, 1), (1, 1, -1), (1, -1, 1), (1, -1, -1),
+                      (-1, 1, 1), (-1, 1, -1), (-1, -1, 1), (-1, -1, -1)]:
+            rotation = np.zeros((3, 3))
+            rotation[range(3), permutation] = signs
+            if np.linalg.det(rotation) > 0.0:
+                rotations.append(rotation)
+    return np.array(rotations)
+
+
+def estimate_initial_orientation(source_points, target_points, similarity=False, max_points=2000):
+    """
+    Estimate the transform mapping source onto target by matching their principal axes. Each of
+    the 24 axis permutations and sign flips of the principal frames is scored by the mean distance
+    from a subsample of the transformed source points to their closest target points.
+
+    :param similarity: Also match the overall spread of the point sets with a uniform scale.
+    :param max_points: Number of points of each set used for scoring.
+    :return: Best 4x4 matrix and the (24,) array of candidate scores.
+    """
+    source_points = np.asarray(source_points, dtype=np.float64)
+    target_points = np.asarray(target_points, dtype=np.float64)
+    source_centroid, source_variances, source_axes = principal_axes(source_points)
+    target_centroid, target_variances, target_axes = principal_axes(target_points)
+    scale = 1.0
+    if similarity and np.sum(source_variances) > 0.0:
+        scale = np.sqrt(np.sum(target_variances) / np.sum(source_variances))
+    tree = cKDTree(subsample_evenly(target_points, max_points * 10))
+    samples = subsample_evenly(source_points, max_points) - source_centroid
+    # Rotations mapping the source principal frame onto each permuted target principal frame.
+    rotations = np.einsum('ij,njk,lk->nil', target_axes, axis_aligned_rotations(), source_axes)
+    candidates = scale * np.einsum('nij,mj->nmi', rotations, samples) + target_centroid
+    distances, _ = tree.query(candidates.reshape(-1, 3))
+    scores = distances.reshape(len(rotations), -1).mean(axis=1)
+    best = int(np.argmin(scores))
+    matrix = to_matrix(rotations[best], target_centroid - scale * np.dot(rotations[best], source_centroid), scale)
+    return matrix, scores
+
+
+class RegistrationResult(object):
+
+    def __init__(self, matrix, rms_error, iterations, converged):
+        self.matrix = matrix
+        self.rms_error = rms_error
+        self.iterations = iterations
+        self.converged = converged
+
+    def get_scale(self):
+        return float(np.cbrt(np.linalg.det(self.matrix[:3, :3])))
+
+    def as_dict(self):
+        return dict(matrix=self.matrix.tolist(), rms_error=self.rms_error, iterations=self.iterations,
+                    converged=self.converged)
+
+
+class IterativeClosestPoint(object):
+    """
+    Rigid, or optionally similarity, iterative closest point solver. The KD-tree over the
+    target cloud is built once and reused for every solve.
+    """
+
+    def __init__(self, target_points, similarity=False, max_iterations=50, tolerance=1.0e-6,
+                 rms_tolerance=0.0, trim_fraction=0.0):
+        """
+        :param target_points: (N, 3) array of the fixed data cloud.
+        :param similarity: Also solve for a uniform scale if True.
+        :param max_iterations: Iteration cap.
+        :param tolerance: Stop when the relative decrease of the RMS error falls below this.
+        :param rms_tolerance: Stop when the RMS error falls below this.
+        :param trim_fraction: Fraction of the worst closest point pairs to ignore in each update.
+        """
+        self._target_points = np.asarray(target_points, dtype=np.float64)
+        self._tree = cKDTree(self._target_points)
+        self._similarity = similarity
+        self._max_iterations = max_iterations
+        self._tolerance = tolerance
+        self._rms_tolerance = rms_tolerance
+        self._trim_fraction = trim_fraction
+
+    def get_target_points(self):
+        return self._target_points
+
+    def _closest_pairs(self, points):
+        distances, indexes = self._tree.query(points)
+        keep = np.arange(len(points))
+        if self._trim_fraction > 0.0:
+            count = max(3, int(round(len(points) * (1.0 - self._trim_fraction))))
+            keep = np.argsort(distances)[:count]
+        return keep, indexes[keep], distances
+
+    def get_rms_error(self, source_points, matrix=None):
+        points = np.asarray(source_points, dtype=np.float64)
+        if matrix is not None:
+            points = transform_points(matrix, points)
+        distances, _ = self._tree.query(points)
+        return float(np.sqrt(np.mean(distances * distances)))
+
+    def solve(self, source_points, initial_matrix=None, progress=None):
+        """
+        Register source points onto the target cloud.
+
+        :param source_points: (M, 3) array of points sampled from the scaffold.
+        :param initial_matrix: Initial 4x4 transform; defaults to aligning the centroids.
+        :param progress: Optional callable taking the fraction of the iteration cap done and a message,
+         called every iteration; it may raise to abandon the solve.
+        :return: RegistrationResult with the 4x4 matrix mapping source onto target.
+        """
+        source_points = np.asarray(source_points, dtype=np.float64)
+        if initial_matrix is None:
+            matrix = centroid_matrix(source_points, self._target_points)
+        else:
+            matrix = np.array(initial_matrix, dtype=np.float64)
+        rms_error = None
+        converged = False
+        iteration = 0
+        while iteration < self._max_iterations:
+            iteration += 1
+            if progress is not None:
+                progress(float(iteration - 1) / self._max_iterations, 'Registration iteration {}'.format(iteration))
+            points = transform_points(matrix, source_points)
+            keep, indexes, distances = self._closest_pairs(points)
+            previous_rms_error = rms_error
+            rms_error = float(np.sqrt(np.mean(distances * distances)))
+            if (rms_error <= self._rms_tolerance) or ((previous_rms_error is not None) and (
+                    previous_rms_error - rms_error <= self._tolerance * previous_rms_error)):
+                converged = True
+                break
+            rotation, translation, scale = kabsch(points[keep], self._target_points[indexes], self._similarity)
+            matrix = np.dot(to_matrix(rotation, translation, scale), matrix)
+        else:
+            rms_error = self.get_rms_error(source_points, matrix)
+        return RegistrationResult(matrix, rms_error, iteration, converged)
+
+
+class PyramidRegistration(object):
+    """
+    Coarse to fine registration: iterative closest point is solved on voxel grid downsampled
+    copies of the data cloud and scaffold sample points, coarsest first, each level starting
+    from the previous level's transform and the finest level using the full resolution points.
+    """
+
+    def __init__(self, target_points, levels=3, coarsest_voxel_fraction=0.05, similarity=False,
+                 max_iterations=None, tolerances=None):
+        """
+        :param target_points: (N, 3) array of the fixed data cloud.
+        :param levels: Number of pyramid levels including full resolution.
+        :param coarsest_voxel_fraction: Voxel size of the coarsest level as a fraction of the
+         target bounding box diagonal; each finer level halves it.
+        :param similarity: Also solve for a uniform scale if True.
+        :param max_iterations: Iteration cap per level, coarsest first, or None for 50 each.
+        :param tolerances: Relative RMS tolerance per level, coarsest first, or None for 1.0e-6 each.
+        """
+        target_points = np.asarray(target_points, dtype=np.float64)
+        self._levels = max(1, levels)
+        diagonal = np.linalg.norm(target_points.max(axis=0) - target_points.min(axis=0))
+        self._voxel_sizes = [diagonal * coarsest_voxel_fraction / (2.0 ** level)
+                             for level in range(self._levels - 1)] + [0.0]
+        if max_iterations is None:
+            max_iterations = [50] * self._levels
+        if tolerances is None:
+            tolerances = [1.0e-6] * self._levels
+        self._solvers = [IterativeClosestPoint(voxel_downsample(target_points, voxel_size), similarity=similarity,
+                                               max_iterations=max_iterations[level], tolerance=tolerances[level])
+                         for level, voxel_size in enumerate(self._voxel_sizes)]
+
+    def get_voxel_sizes(self):
+        return self._voxel_sizes
+
+    def solve(self, source_points, initial_matrix=None, progress=None):
+        """
+        :param progress: Optional callable taking the fraction done and a message, see IterativeClosestPoint.
+        :return: RegistrationResult of the finest level, with iterations summed over all levels.
+        """
+        source_points = np.asarray(source_points, dtype=np.float64)
+        matrix = initial_matrix
+        iterations = 0
+        result = None
+        for level, (voxel_size, solver) in enumerate(zip(self._voxel_sizes, self._solvers)):
+            level_progress = None
+            if progress is not None:
+                def level_progress(fraction, message, level=level):
+                    progress((level + fraction) / self._levels, 'Level {}: {}'.format(level + 1, message))
+            result = solver.solve(voxel_downsample(source_points, voxel_size), matrix, level_progress)
+            matrix = result.matrix
+            iterations += result.iterations
+        return RegistrationResult(result.matrix, result.rms_error, iterations, result.converged)
+
+
+def random_rotations(count, seed=None):
+    """
+    Get count rotations sampled uniformly over SO(3) as a (count, 3, 3) array.
+    """
+    quaternions = np.random.RandomState(seed).normal(size=(count, 4))
+    quaternions /= np.linalg.norm(quaternions, axis=1)[:, np.newaxis]
+    w, x, y, z = quaternions.T
+    return np.array([[w * w + x * x - y * y - z * z, 2 * (x * y - w * z), 2 * (x * z + w * y)],
+                     [2 * (x * y + w * z), w * w - x * x + y * y - z * z, 2 * (y * z - w * x)],
+                     [2 * (x * z - w * y), 2 * (y * z + w * x), w * w - x * x - y * y + z * z]]).transpose(2, 0, 1)
+
+
+def start_matrices(source_points, target_points, rotations=None, similarity=False):
+    """
+    Get initial transforms rotating source about its centroid and moving it onto the target centroid.
+
+    :param rotations: (K, 3, 3) rotations, or None for the 24 axis permutations and sign flips
+     of the principal frames.
+    :return: (K, 4, 4) array.
+    """
+    source_centroid, source_variances, source_axes = principal_axes(source_points)
+    target_centroid, target_variances, target_axes = principal_axes(target_points)
+    if rotations is None:
+        rotations = np.einsum('ij,njk,lk->nil', target_axes, axis_aligned_rotations(), source_axes)
+    scale = 1.0
+    if similarity and np.sum(source_variances) > 0.0:
+        scale = np.sqrt(np.sum(target_variances) / np.sum(source_variances))
+    matrices = np.zeros((len(rotations), 4, 4))
+    matrices[:, :3, :3] = scale * rotations
+    matrices[:, :3, 3] = target_centroid - scale * np.einsum('nij,j->ni', rotations, source_centroid)
+    matrices[:, 3, 3] = 1.0
+    return matrices
+
+
+def create_solver(target_points, levels=1, max_iterations=50, tolerance=1.0e-6, **options):
+    """
+    Create an IterativeClosestPoint solver, or a PyramidRegistration one if levels > 1.
+
+    :param max_iterations: Iteration cap, or a list of caps per pyramid level, coarsest first.
+    :param tolerance: Relative RMS tolerance, or a list of tolerances per pyramid level, coarsest first.
+    """
+    if levels > 1:
+        if not isinstance(max_iterations, list):
+            max_iterations = [max_iterations] * levels
+        if not isinstance(tolerance, list):
+            tolerance = [tolerance] * levels
+        return PyramidRegistration(target_points, levels=levels, max_iterations=max_iterations,
+                                   tolerances=tolerance, **options)
+    return IterativeClosestPoint(target_points, max_iterations=max_iterations, tolerance=tolerance, **options)
+
+
+_worker_solver = None
+
+
+def _initialise_worker(target_points, solver_options):
+    global _worker_solver
+    _worker_solver = create_solver(target_points, **solver_options)
+
+
+def _solve_from_start(arguments):
+    source_points, initial_matrix = arguments
+    return _worker_solver.solve(source_points, initial_matrix)
+
+
+class MultiStartRegistration(object):
+    """
+    Solve registrations from several initial transforms in a pool of worker processes and keep
+    the lowest residual. Workers only receive NumPy snapshots of the points and build their
+    own solver, and KD-trees, once.
+    """
+
+    def __init__(self, target_points, max_workers=None, **solver_options):
+        """
+        :param target_points: (N, 3) array of the fixed data cloud.
+        :param max_workers: Number of worker processes, None for the number of processors.
+         With 1 the solves run serially in this process.
+        :param solver_options: Options passed to create_solver.
+        """
+        self._target_points = np.ascontiguousarray(target_points, dtype=np.float64)
+        self._max_workers = max_workers
+        self._solver_options = solver_options
+
+    def solve(self, source_points, initial_matrices, progress=None):
+        """
+        :param source_points: (M, 3) array of points sampled from the scaffold.
+        :param initial_matrices: (K, 4, 4) array of initial transforms.
+        :param progress: Optional callable taking the fraction of starts solved and a message; it may
+         raise to abandon the remaining starts.
+        :return: The best RegistrationResult and the list of all K results.
+        """
+        source_points = np.ascontiguousarray(source_points, dtype=np.float64)
+        tasks = [(source_points, initial_matrix) for initial_matrix in initial_matrices]
+        results = []
+        if self._max_workers == 1:
+            _initialise_worker(self._target_points, self._solver_options)
+            for task in tasks:
+                results.append(_solve_from_start(task))
+                self._report(progress, len(results), len(tasks))
+        else:
+            with ProcessPoolExecutor(max_workers=self._max_workers, initializer=_initialise_worker,
+                                     initargs=(self._target_points, self._solver_options)) as executor:
+                futures = [executor.submit(_solve_from_start, task) for task in tasks]
+                try:
+                    for future in futures:
+                        results.append(future.result())
+                        self._report(progress, len(results), len(tasks))
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        best = min(results, key=lambda result: result.rms_error)
+        return best, results
+
+    @staticmethod
+    def _report(progress, done, total):
+        if progress is not None:
+            progress(float(done) / total, 'Solved {} of {} starts'.format(done, total))
+
+
+class TemporalRegistrationResult(RegistrationResult):
+    """
+    Registration result over several frames, with the RMS error against each frame and optionally
+    the results of registering each frame on its own and their drift, see frame_drift.
+    """
+
+    def __init__(self, matrix, rms_error, iterations, converged, frame_rms_errors):
+        super(TemporalRegistrationResult, self).__init__(matrix, rms_error, iterations, converged)
+        self.frame_rms_errors = frame_rms_errors
+        self.frame_results = None
+        self.drift = None
+
+    def set_frame_results(self, frame_results):
+        self.frame_results = frame_results
+        angles, translations, scales = frame_drift([result.matrix for result in frame_results], self.matrix)
+        self.drift = dict(rotation_degrees=angles.tolist(), translation=translations.tolist(),
+                          scale_ratio=scales.tolist())
+
+    def as_dict(self):
+        description = super(TemporalRegistrationResult, self).as_dict()
+        description['frame_rms_errors'] = list(self.frame_rms_errors)
+        description['drift'] = self.drift
+        return description
+
+
+class TemporalRegistration(object):
+    """
+    Solve one transform minimising the residual of the source points against several target
+    frames together. Every iteration the closest point pairs of all frames are stacked and a
+    single transform is fitted to them. A KD-tree is built once per frame.
+    """
+
+    def __init__(self, frames, similarity=False, max_iterations=50, tolerance=1.0e-6, trim_fraction=0.0):
+        """
+        :param frames: List of (N, 3) arrays of the data cloud at each frame, or a (frames, N, 3) array.
+        :param similarity: Also solve for a uniform scale if True.
+        :param max_iterations: Iteration cap.
+        :param tolerance: Stop when the relative decrease of the RMS error falls below this.
+        :param trim_fraction: Fraction of the worst closest point pairs of each frame to ignore in each update.
+        """
+        self._solvers = [IterativeClosestPoint(frame, similarity=similarity, trim_fraction=trim_fraction)
+                         for frame in frames]
+        self._similarity = similarity
+        self._max_iterations = max_iterations
+        self._tolerance = tolerance
+
+    def get_frame_rms_errors(self, source_points, matrix):
+        return np.array([solver.get_rms_error(source_points, matrix) for solver in self._solvers])
+
+    def solve(self, source_points, initial_matrix=None, progress=None):
+        """
+        :param source_points: (M, 3) array of points sampled from the scaffold.
+        :param initial_matrix: Initial 4x4 transform; defaults to aligning the centroid of all frames.
+        :param progress: Optional callable taking the fraction of the iteration cap done and a message.
+        :return: TemporalRegistrationResult.
+        """
+        source_points = np.asarray(source_points, dtype=np.float64)
+        if initial_matrix is None:
+            all_points = np.concatenate([solver.get_target_points() for solver in self._solvers])
+            matrix = centroid_matrix(source_points, all_points)
+        else:
+            matrix = np.array(initial_matrix, dtype=np.float64)
+        rms_error = None
+        converged = False
+        iteration = 0
+        while iteration < self._max_iterations:
+            iteration += 1
+            if progress is not None:
+                progress(float(iteration - 1) / self._max_iterations, 'Temporal registration iteration {}'.format(
+                    iteration))
+            points = transform_points(matrix, source_points)
+            sources = []
+            targets = []
+            squared_distances = 0.0
+            for solver in self._solvers:
+                keep, indexes, distances = solver._closest_pairs(points)
+                sources.append(points[keep])
+                targets.append(solver.get_target_points()[indexes])
+                squared_distances += np.sum(distances * distances)
+            previous_rms_error = rms_error
+            rms_error = float(np.sqrt(squared_distances / (len(points) * len(self._solvers))))
+            if (previous_rms_error is not None) and (
+                    previous_rms_error - rms_error <= self._tolerance * previous_rms_error):
+                converged = True
+                break
+            rotation, translation, scale = kabsch(np.concatenate(sources), np.concatenate(targets), self._similarity)
+            matrix = np.dot(to_matrix(rotation, translation, scale), matrix)
+        frame_rms_errors = self.get_frame_rms_errors(source_points, matrix)
+        rms_error = float(np.sqrt(np.mean(frame_rms_errors * frame_rms_errors)))
+        return TemporalRegistrationResult(matrix, rms_error, iteration, converged, frame_rms_errors)
+
+
+def _solve_frame(arguments):
+    frame_points, source_points, initial_matrix, solver_options = arguments
+    return create_solver(frame_points, **solver_options).solve(source_points, initial_matrix)
+
+
+def solve_frames(frames, source_points, initial_matrix=None, max_workers=None, progress=None, **solver_options):
+    """
+    Register source points onto every frame independently, in a pool of worker processes.
+
+    :param max_workers: Number of worker processes, None for the number of processors. With 1
+     the solves run serially in this process.
+    :param progress: Optional callable taking the fraction of frames solved and a message.
+    :param solver_options: Options passed to create_solver.
+    :return: List of RegistrationResult, one per frame.
+    """
+    source_points = np.ascontiguousarray(source_points, dtype=np.float64)
+    tasks = [(np.ascontiguousarray(frame, dtype=np.float64), source_points, initial_matrix, solver_options)
+             for frame in frames]
+    results = []
+    if max_workers == 1:
+        for task in tasks:
+            results.append(_solve_frame(task))
+            if progress is not None:
+                progress(float(len(results)) / len(tasks), 'Solved {} of {} frames'.format(len(results), len(tasks)))
+        return results
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_solve_frame, task) for task in tasks]
+        try:
+            for future in futures:
+                results.append(future.result())
+                if progress is not None:
+                    progress(float(len(results)) / len(tasks), 'Solved {} of {} frames'.format(
+                        len(results), len(tasks)))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    return results
+
+
+def frame_drift(matrices, reference_matrix):
+    """
+    Measure how far per frame transforms drift from a reference transform.
+
+    :param matrices: (K, 4, 4) array of per frame transforms.
+    :return: (K,) rotation angles in degrees, (K,) translation distances and (K,) scale ratios
+     of each transform relative to the reference.
+    """
+    matrices = np.asarray(matrices, dtype=np.float64)
+    reference_matrix = np.asarray(reference_matrix, dtype=np.float64)
+    scales = np.cbrt(np.linalg.det(matrices[:, :3, :3]))
+    reference_scale = np.cbrt(np.linalg.det(reference_matrix[:3, :3]))
+    rotations = matrices[:, :3, :3] / scales[:, np.newaxis, np.newaxis]
+    reference_rotation = reference_matrix[:3, :3] / reference_scale
+    relative_traces = np.einsum('nij,ij->n', rotations, reference_rotation)
+    angles = np.degrees(np.arccos(np.clip((relative_traces - 1.0) / 2.0, -1.0, 1.0)))
+    translations = np.linalg.norm(matrices[:, :3, 3] - reference_matrix[:3, 3], axis=1)
+    return angles, translations, scales / reference_scale
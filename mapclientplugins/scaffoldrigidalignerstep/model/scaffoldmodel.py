@@ -1,10 +1,18 @@
+import copy
+
+import numpy as np
+
+from opencmiss.zinc.element import Element
 from opencmiss.zinc.field import Field
 from opencmiss.zinc.graphics import Graphics
 from opencmiss.zinc.glyph import Glyph
 from opencmiss.zinc.material import Material
+from opencmiss.zinc.status import OK as ZINC_OK
 from opencmiss.zinc.scenecoordinatesystem import SCENECOORDINATESYSTEM_NORMALISED_WINDOW_FIT_TOP
 
 from ..utils import maths
+from ..utils import zincutils
+from ..utils.affine import AffineTransform
 
 
 class ScaffoldModel(object):
@@ -17,6 +25,18 @@ class ScaffoldModel(object):
 
         self._initialise_scene()
         self._scaffold_coordinate_field = None
+        self._preview_source_field = None
+        self._preview_rotation_field = None
+        self._preview_offset_field = None
+        self._preview_coordinate_field = None
+        self._preview_transform = AffineTransform()
+        self._range_cache = {}
+        self._preview_range = None
+        self._surface_samples = {}
+        self._pristine_parameters = None
+        self._pristine_range = None
+        self._field_module_notifier = None
+        self._initialise_field_module_notifier()
         self._initialise_surface_material()
 
     def _create_axis_graphics(self):
@@ -73,7 +93,7 @@ class ScaffoldModel(object):
 
     def _create_surface_graphics(self):
         surface = self._scene.createGraphicsSurfaces()
-        surface.setCoordinateField(self._scaffold_coordinate_field)
+        surface.setCoordinateField(self._get_preview_coordinate_field())
         surface.setRenderPolygonMode(Graphics.RENDER_POLYGON_MODE_SHADED)
         surface_material = self._material_module.findMaterialByName('trans_blue')
         surface.setMaterial(surface_material)
@@ -83,7 +103,7 @@ class ScaffoldModel(object):
     def _create_line_graphics(self):
         lines = self._scene.createGraphicsLines()
         fieldmodule = self._context.getMaterialmodule()
-        lines.setCoordinateField(self._scaffold_coordinate_field)
+        lines.setCoordinateField(self._get_preview_coordinate_field())
         lines.setName('display_lines')
         black = fieldmodule.findMaterialByName('white')
         lines.setMaterial(black)
@@ -95,12 +115,82 @@ class ScaffoldModel(object):
         self._create_axis_graphics()
         self._set_window_name()
 
-    def _get_node_coordinates_range(self):
-        fm = self._scaffold_coordinate_field.getFieldmodule()
+    def _initialise_field_module_notifier(self):
+        self._field_module_notifier = self._region.getFieldmodule().createFieldmodulenotifier()
+        self._field_module_notifier.setCallback(self._field_module_changed)
+
+    def _field_module_changed(self, event):
+        if (self._scaffold_coordinate_field is not None) and \
+                (event.getFieldChangeFlags(self._scaffold_coordinate_field) != Field.CHANGE_FLAG_NONE):
+            self.clear_range_cache()
+
+    def clear_range_cache(self):
+        """
+        Forget the ranges and surface samples cached for the current nodes.
+        """
+        self._range_cache = {}
+        self._preview_range = None
+        self._surface_samples = {}
+
+    def apply_transform(self, transform):
+        """
+        Apply the AffineTransform to the nodes of the coordinate field. When the transform maps boxes
+        onto boxes the cached range is transformed with it, otherwise it is evaluated again on the next query.
+        """
+        field_name = self._scaffold_coordinate_field.getName()
+        source_range = self._range_cache.get(field_name)
+        surface_samples = self._surface_samples
+        success = transform.apply_to_field(self._scaffold_coordinate_field)
+        self.clear_range_cache()
+        if (source_range is not None) and transform.is_axis_aligned() and (len(source_range[0]) == 3):
+            self._range_cache[field_name] = transform.transform_range(*source_range)
+        if success:
+            self._surface_samples = dict((key, transform.transform_points(points))
+                                         for key, points in surface_samples.items() if key[0] == field_name)
+        return success
+
+    def snapshot_coordinates(self):
+        """
+        Keep the nodal parameters of the coordinate field, with its range, so restore_coordinates can
+        return the scaffold to them without regenerating it.
+
+        :return: The node identifiers, parameters and mask arrays kept, or None if they cannot be got.
+        """
+        success, node_identifiers, parameters, mask = zincutils.get_nodal_parameters(self._scaffold_coordinate_field)
+        if not success:
+            self._pristine_parameters = None
+            return None
+        self._pristine_parameters = (node_identifiers, parameters, mask)
+        self._pristine_range = self._range_cache.get(self._scaffold_coordinate_field.getName())
+        return self._pristine_parameters
+
+    def get_pristine_parameters(self):
+        return self._pristine_parameters
+
+    def restore_coordinates(self):
+        """
+        Write the nodal parameters kept by snapshot_coordinates back to the coordinate field in one
+        bulk change and clear the preview transform.
+
+        :return: True on success, False if there is no snapshot or a parameter could not be set.
+        """
+        if self._pristine_parameters is None:
+            return False
+        node_identifiers, parameters, mask = self._pristine_parameters
+        success = zincutils.set_nodal_parameters(self._scaffold_coordinate_field, node_identifiers, parameters, mask,
+                                                 Field.DOMAIN_TYPE_NODES)
+        self.clear_range_cache()
+        if success and (self._pristine_range is not None):
+            self._range_cache[self._scaffold_coordinate_field.getName()] = copy.deepcopy(self._pristine_range)
+        self.reset_preview_transform()
+        return success
+
+    def _evaluate_range(self, coordinate_field):
+        fm = coordinate_field.getFieldmodule()
         fm.beginChange()
         nodes = fm.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES)
-        min_coordinates = fm.createFieldNodesetMinimum(self._scaffold_coordinate_field, nodes)
-        max_coordinates = fm.createFieldNodesetMaximum(self._scaffold_coordinate_field, nodes)
+        min_coordinates = fm.createFieldNodesetMinimum(coordinate_field, nodes)
+        max_coordinates = fm.createFieldNodesetMaximum(coordinate_field, nodes)
         components_count = self._scaffold_coordinate_field.getNumberOfComponents()
         cache = fm.createFieldcache()
         result, min_x = min_coordinates.evaluateReal(cache, components_count)
@@ -108,6 +198,27 @@ class ScaffoldModel(object):
         fm.endChange()
         return min_x, max_x
 
+    def _get_node_coordinates_range(self):
+        """
+        Get the range of the scaffold as drawn, through the preview transform. The range of the
+        coordinate field is cached until its nodes change. Where the preview transform only scales
+        and permutes axes the drawn range follows from it exactly, otherwise the range evaluated
+        through the preview field is cached for the current preview transform.
+        """
+        field_name = self._scaffold_coordinate_field.getName()
+        if field_name not in self._range_cache:
+            self._range_cache[field_name] = self._evaluate_range(self._scaffold_coordinate_field)
+        min_x, max_x = self._range_cache[field_name]
+        if self._preview_transform.is_identity():
+            return copy.copy(min_x), copy.copy(max_x)
+        if self._preview_transform.is_axis_aligned() and (len(min_x) == 3):
+            return self._preview_transform.transform_range(min_x, max_x)
+        key = (field_name, self._preview_transform.get_matrix().tobytes())
+        if (self._preview_range is None) or (self._preview_range[0] != key):
+            self._preview_range = (key, self._evaluate_range(self._get_preview_coordinate_field()))
+        min_x, max_x = self._preview_range[1]
+        return copy.copy(min_x), copy.copy(max_x)
+
     def get_range(self):
         return self._get_node_coordinates_range()
 
@@ -167,6 +278,12 @@ class ScaffoldModel(object):
         if self._region:
             self._region = None
         self._region = region
+        self._preview_source_field = None
+        self._preview_transform.reset()
+        self._pristine_parameters = None
+        self._pristine_range = None
+        self.clear_range_cache()
+        self._initialise_field_module_notifier()
 
     def _get_mesh(self):
         fm = self._region.getFieldmodule()
@@ -217,6 +334,123 @@ class ScaffoldModel(object):
         pointattr.setLabelField(tmp)
         window_label.setMaterial(self._material_module.findMaterialByName('yellow'))
 
+    def _get_preview_coordinate_field(self):
+        """
+        Get the field the scaffold graphics are drawn with: the coordinate field multiplied by a
+        constant square matrix plus a constant offset, sized by its number of components. Changing
+        the preview transform only assigns these constant values, so redrawing does not depend on
+        the number of nodes.
+        """
+        if (self._preview_source_field is None) or \
+                (self._preview_source_field.getName() != self._scaffold_coordinate_field.getName()):
+            components_count = self._scaffold_coordinate_field.getNumberOfComponents()
+            fm = self._region.getFieldmodule()
+            fm.beginChange()
+            self._preview_rotation_field = fm.createFieldConstant(np.identity(components_count).ravel().tolist())
+            self._preview_offset_field = fm.createFieldConstant([0.0] * components_count)
+            rotated_field = fm.createFieldMatrixMultiply(components_count, self._preview_rotation_field,
+                                                         self._scaffold_coordinate_field)
+            self._preview_coordinate_field = fm.createFieldAdd(rotated_field, self._preview_offset_field)
+            fm.endChange()
+            self._preview_source_field = self._scaffold_coordinate_field
+            self._scene.beginChange()
+            for name in ['display_lines', 'display_surfaces']:
+                graphics = self._scene.findGraphicsByName(name)
+                if graphics.isValid():
+                    graphics.setCoordinateField(self._preview_coordinate_field)
+            self._scene.endChange()
+        return self._preview_coordinate_field
+
+    def set_preview_transform(self, matrix, offset):
+        """
+        Draw the scaffold transformed by the 3x3 matrix and offset without changing its nodes. A
+        coordinate field with fewer components is drawn with the leading block of each.
+        """
+        self._get_preview_coordinate_field()
+        self._preview_transform.reset()
+        self._preview_transform.compose_linear(matrix, offset)
+        components_count = self._scaffold_coordinate_field.getNumberOfComponents()
+        fm = self._region.getFieldmodule()
+        fm.beginChange()
+        cache = fm.createFieldcache()
+        self._preview_rotation_field.assignReal(
+            cache, np.asarray(matrix, dtype=np.float64)[:components_count, :components_count].ravel().tolist())
+        self._preview_offset_field.assignReal(cache, np.asarray(offset, dtype=np.float64)[:components_count].tolist())
+        fm.endChange()
+
+    def reset_preview_transform(self):
+        self.set_preview_transform([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]], [0.0, 0.0, 0.0])
+
+    def _get_surface_mesh_and_group(self):
+        """
+        Get the mesh to sample the scaffold surface on and an optional field flagging its exterior elements.
+        """
+        fm = self._region.getFieldmodule()
+        mesh = self._get_mesh()
+        if mesh.getDimension() == 3:
+            mesh2d = fm.findMeshByDimension(2)
+            if mesh2d.getSize() > 0:
+                return mesh2d, fm.createFieldIsExterior()
+        return mesh, None
+
+    def get_surface_sample_points(self, points_per_element_edge=4):
+        """
+        Sample the scaffold surface, as currently drawn, on a regular xi grid in each exterior face.
+        Falls back to all elements of the highest dimension mesh if no faces are defined. The samples
+        of the coordinate field are evaluated once and cached until its nodes change; the preview
+        transform is applied to them with NumPy.
+
+        :param points_per_element_edge: Number of samples along each element xi direction.
+        :return: (N, 3) array of sample coordinates.
+        """
+        key = (self._scaffold_coordinate_field.getName(), points_per_element_edge)
+        if key not in self._surface_samples:
+            self._surface_samples[key] = self._evaluate_surface_sample_points(self._scaffold_coordinate_field,
+                                                                              points_per_element_edge)
+        points = self._surface_samples[key]
+        if self._preview_transform.is_identity():
+            return points.copy()
+        if points.shape[1] == 3:
+            return self._preview_transform.transform_points(points)
+        return self._evaluate_surface_sample_points(self._get_preview_coordinate_field(), points_per_element_edge)
+
+    def _evaluate_surface_sample_points(self, coordinate_field, points_per_element_edge):
+        components_count = coordinate_field.getNumberOfComponents()
+        mesh, exterior_field = self._get_surface_mesh_and_group()
+        dimension = mesh.getDimension()
+        xi_values = (np.arange(points_per_element_edge) + 0.5) / points_per_element_edge
+        if dimension == 1:
+            xi_grid = xi_values.reshape(-1, 1)
+        else:
+            xi_grid = np.array(np.meshgrid(*[xi_values] * dimension, indexing='ij')).reshape(dimension, -1).T
+        simplex_xi_grid = xi_grid[np.sum(xi_grid, axis=1) <= 1.0]
+
+        fm = self._region.getFieldmodule()
+        fm.beginChange()
+        cache = fm.createFieldcache()
+        points = []
+        element_iter = mesh.createElementiterator()
+        element = element_iter.next()
+        while element.isValid():
+            if exterior_field is not None:
+                cache.setMeshLocation(element, [0.5] * dimension)
+                _, is_exterior = exterior_field.evaluateReal(cache, 1)
+                if not is_exterior:
+                    element = element_iter.next()
+                    continue
+            if element.getShapeType() in [Element.SHAPE_TYPE_TRIANGLE, Element.SHAPE_TYPE_TETRAHEDRON]:
+                element_xi_grid = simplex_xi_grid
+            else:
+                element_xi_grid = xi_grid
+            for xi in element_xi_grid:
+                cache.setMeshLocation(element, xi.tolist())
+                result, values = coordinate_field.evaluateReal(cache, components_count)
+                if result == ZINC_OK:
+                    points.append(values)
+            element = element_iter.next()
+        fm.endChange()
+        return np.array(points, dtype=np.float64).reshape(-1, components_count)
+
     def set_scaffold_graphics_post_rotate(self, field):
         self._scene.beginChange()
         for name in ['display_lines', 'display_surfaces']:
@@ -12,8 +12,6 @@ from mapclientplugins.scaffoldrigidalignerstep.configuredialog import ConfigureD
 from mapclientplugins.scaffoldrigidalignerstep.model.mastermodel import MasterModel
 from mapclientplugins.scaffoldrigidalignerstep.view.scaffoldrigidalignerwidget import ScaffoldRigidAlignerWidget
 
-EX_FILE_FORMATS = ['.exf', '.exdata', '.ex2', 'exnode', '.ex']
-
 
 class ScaffoldRigidAlignerStep(WorkflowStepMountPoint):
     """
@@ -55,16 +53,7 @@ class ScaffoldRigidAlignerStep(WorkflowStepMountPoint):
         # Put your execute step code here before calling the '_doneExecution' method.
         if self._view is None:
             self._model = MasterModel(self._model_description)
-
-            _, file_extension = os.path.splitext(self._point_cloud_data)
-            if file_extension in EX_FILE_FORMATS:
-                self._model.initialise_ex_data(self._point_cloud_data)
-            elif file_extension == '.json':
-                self._model.initialise_json_data(self._point_cloud_data)
-            else:
-                raise TypeError('Data file with {} format is not supported.'
-                                'Use EX or JSON.'.format(file_extension))
-
+            self._model.initialise_data(self._point_cloud_data)
             self._model.set_location(os.path.join(self._location, self._config['identifier']))
 
             shareable_widget = self._model_description.get_shareable_open_gl_widget()
@@ -0,0 +1,119 @@
+import numpy as np
+
+from . import maths
+from . import zincutils
+
+
+class AffineTransform(object):
+    """
+    Accumulated 4x4 affine transform. Axis swaps, rotations, scales and offsets compose onto
+    the matrix cheaply so the result can be applied to a Zinc field in a single node traversal.
+    Each operation is applied after the operations already accumulated.
+    """
+
+    def __init__(self, matrix=None):
+        if matrix is None:
+            self._matrix = np.identity(4)
+        else:
+            self._matrix = np.array(matrix, dtype=np.float64).reshape(4, 4)
+
+    def reset(self):
+        self._matrix = np.identity(4)
+
+    def copy(self):
+        return AffineTransform(self._matrix)
+
+    def get_matrix(self):
+        return self._matrix.copy()
+
+    def set_matrix(self, matrix):
+        self._matrix = np.array(matrix, dtype=np.float64).reshape(4, 4)
+
+    def get_linear(self):
+        return self._matrix[:3, :3].copy()
+
+    def get_translation(self):
+        return self._matrix[:3, 3].copy()
+
+    def is_identity(self):
+        return np.allclose(self._matrix, np.identity(4), rtol=0.0, atol=1.0e-14)
+
+    def is_axis_aligned(self):
+        """
+        Whether the linear part only scales and permutes axes, so boxes map exactly onto boxes.
+        """
+        return bool(np.all(np.count_nonzero(self._matrix[:3, :3], axis=1) <= 1))
+
+    def compose(self, matrix):
+        """
+        Apply the 4x4 matrix after the current transform.
+        """
+        self._matrix = np.dot(np.asarray(matrix, dtype=np.float64), self._matrix)
+
+    def compose_linear(self, linear, offset=None):
+        matrix = np.identity(4)
+        matrix[:3, :3] = linear
+        if offset is not None:
+            matrix[:3, 3] = offset
+        self.compose(matrix)
+
+    def swap_axes(self, axes):
+        """
+        Compose the axis swap mapping the scaffold up axis onto the data up axis.
+
+        :return: False if the axes combination is not implemented, True otherwise.
+        """
+        matrix = zincutils.get_swap_axes_matrix(axes)
+        if matrix is None:
+            return False
+        self.compose_linear(matrix)
+        return True
+
+    def rotate(self, euler_angles):
+        """
+        Compose a rotation given as Euler angles in radians, about the origin.
+        """
+        self.compose_linear(maths.eulerToRotationMatrix3(euler_angles))
+
+    def scale(self, scale):
+        """
+        Compose a scale about the origin, either uniform or per component.
+        """
+        self.compose_linear(np.diag(np.broadcast_to(np.asarray(scale, dtype=np.float64), (3,))))
+
+    def translate(self, offset):
+        self.compose_linear(np.identity(3), offset)
+
+    def inverse(self):
+        return AffineTransform(np.linalg.inv(self._matrix))
+
+    def transform_points(self, points):
+        """
+        Transform an (N, 3) array of positions.
+        """
+        points = np.asarray(points, dtype=np.float64)
+        return np.dot(points, self._matrix[:3, :3].T) + self._matrix[:3, 3]
+
+    def transform_range(self, minimums, maximums):
+        """
+        Get the range bounding the transformed corners of the box minimums-maximums.
+        Exact for linear parts that only scale and permute axes.
+        """
+        corners = np.array([[minimums[0], minimums[1], minimums[2]],
+                            [maximums[0], minimums[1], minimums[2]],
+                            [minimums[0], maximums[1], minimums[2]],
+                            [maximums[0], maximums[1], minimums[2]],
+                            [minimums[0], minimums[1], maximums[2]],
+                            [maximums[0], minimums[1], maximums[2]],
+                            [minimums[0], maximums[1], maximums[2]],
+                            [maximums[0], maximums[1], maximums[2]]])
+        transformed = self.transform_points(corners)
+        return transformed.min(axis=0).tolist(), transformed.max(axis=0).tolist()
+
+    def apply_to_field(self, field):
+        """
+        Apply the transform to all nodal parameters of field in one node traversal. Values get the
+        full affine transform, derivatives only the linear part.
+        """
+        return zincutils.transform_nodal_parameters(field, matrix=self.get_linear(),
+                                                    offset=self.get_translation())
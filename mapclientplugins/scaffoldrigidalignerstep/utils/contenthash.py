@@ -0,0 +1,44 @@
+"""
+Content hashes identifying the scaffold and data a saved alignment was made for.
+"""
+import hashlib
+
+import numpy as np
+
+from . import zincutils
+
+
+def hash_file(file_name, block_size=1024 * 1024):
+    """
+    Get the SHA-256 hex digest of a file's content, read in blocks of block_size bytes.
+    """
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        block = f.read(block_size)
+        while block:
+            digest.update(block)
+            block = f.read(block_size)
+    return digest.hexdigest()
+
+
+def hash_arrays(*arrays):
+    """
+    Get the SHA-256 hex digest of the shapes, types and values of the arrays.
+    """
+    digest = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update('{}{}'.format(array.dtype.str, array.shape).encode('ascii'))
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def hash_field(field):
+    """
+    Get the SHA-256 hex digest of the node identifiers and nodal parameters of field, or None if
+    they cannot be evaluated.
+    """
+    success, node_identifiers, parameters, mask = zincutils.get_nodal_parameters(field)
+    if not success:
+        return None
+    return hash_arrays(node_identifiers, parameters, mask)
@@ -0,0 +1,110 @@
+"""
+Per frame bounding boxes and moments of point cloud time series.
+"""
+import numpy as np
+
+STATISTICS_MODES = ['reference', 'union', 'mean']
+
+
+class FrameStatistics(object):
+    """
+    Minimum, maximum, centroid and covariance of the points of every frame, as (frames, 3) and
+    (frames, 3, 3) arrays, with the number of points of each frame.
+    """
+
+    def __init__(self, minimums, maximums, centroids, covariances, counts):
+        self._minimums = minimums
+        self._maximums = maximums
+        self._centroids = centroids
+        self._covariances = covariances
+        self._counts = counts
+
+    def get_number_of_frames(self):
+        return len(self._counts)
+
+    def get_minimums(self):
+        return self._minimums
+
+    def get_maximums(self):
+        return self._maximums
+
+    def get_centroids(self):
+        return self._centroids
+
+    def get_covariances(self):
+        return self._covariances
+
+    def get_counts(self):
+        return self._counts
+
+    def get_range(self, mode='reference', reference_frame=0):
+        """
+        Get the range of the data over time as lists of minimums and maximums.
+
+        :param mode: 'reference' for the range of reference_frame, 'union' for the range bounding
+         all frames or 'mean' for the mean of the per frame minimums and maximums.
+        """
+        if mode == 'reference':
+            return self._minimums[reference_frame].tolist(), self._maximums[reference_frame].tolist()
+        if mode == 'union':
+            return self._minimums.min(axis=0).tolist(), self._maximums.max(axis=0).tolist()
+        if mode == 'mean':
+            return self._minimums.mean(axis=0).tolist(), self._maximums.mean(axis=0).tolist()
+        raise ValueError('Unknown statistics mode: {}'.format(mode))
+
+    def get_centroid(self, mode='reference', reference_frame=0):
+        """
+        Get the centroid of reference_frame, or the point weighted mean centroid over all frames
+        for 'union' and 'mean'.
+        """
+        if mode == 'reference':
+            return self._centroids[reference_frame].tolist()
+        if mode in ['union', 'mean']:
+            return (np.dot(self._counts, self._centroids) / self._counts.sum()).tolist()
+        raise ValueError('Unknown statistics mode: {}'.format(mode))
+
+
+def compute_frame_statistics(positions, mask=None, block_size=64):
+    """
+    Compute the statistics of a (frames, points, 3) positions array in one pass, vectorized over
+    blocks of block_size frames so memory mapped positions are not read in whole.
+
+    :param mask: Optional (frames, points) boolean array, False for padding points to leave out.
+    :return: FrameStatistics.
+    """
+    number_of_frames = len(positions)
+    minimums = np.empty((number_of_frames, 3))
+    maximums = np.empty((number_of_frames, 3))
+    centroids = np.empty((number_of_frames, 3))
+    covariances = np.empty((number_of_frames, 3, 3))
+    counts = np.empty(number_of_frames)
+    for start in range(0, number_of_frames, block_size):
+        block = np.asarray(positions[start:start + block_size], dtype=np.float64)
+        end = start + len(block)
+        if mask is None:
+            weights = np.ones(block.shape[:2])
+        else:
+            weights = np.asarray(mask[start:end], dtype=np.float64)
+        real = weights[:, :, np.newaxis] > 0.0
+        minimums[start:end] = np.where(real, block, np.inf).min(axis=1)
+        maximums[start:end] = np.where(real, block, -np.inf).max(axis=1)
+        counts[start:end] = weights.sum(axis=1)
+        centroids[start:end] = np.einsum('fp,fpc->fc', weights, block) / counts[start:end, np.newaxis]
+        centred = (block - centroids[start:end, np.newaxis]) * weights[:, :, np.newaxis]
+        covariances[start:end] = np.einsum('fpi,fpj->fij', centred, centred) / counts[start:end, np.newaxis, np.newaxis]
+    return FrameStatistics(minimums, maximums, centroids, covariances, counts)
+
+
+def compute_frame_statistics_from_frames(frames):
+    """
+    Compute the statistics of an iterable of per frame (n, 3) arrays, which may differ in size,
+    holding one frame at a time.
+    """
+    arrays = [[], [], [], [], []]
+    for frame in frames:
+        statistics = compute_frame_statistics(np.asarray(frame, dtype=np.float64)[np.newaxis])
+        for values, frame_values in zip(arrays, [statistics.get_minimums(), statistics.get_maximums(),
+                                                 statistics.get_centroids(), statistics.get_covariances(),
+                                                 statistics.get_counts()]):
+            values.append(frame_values)
+    return FrameStatistics(*[np.concatenate(values) for values in arrays])
@@ -0,0 +1,225 @@
+"""
+Incremental reading of large JSON files, one object item at a time.
+"""
+import json
+import re
+
+import numpy as np
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+_TOKEN = re.compile(r'[\[\]{}"\\]')
+_NON_ASCII = re.compile(u'[\x80-\xff]')
+_QUOTE = ord('"')
+_OPENING = [ord('['), ord('{')]
+_CLOSING = [ord(']'), ord('}')]
+_SCAN_WINDOW = 1 << 16
+
+
+class _StreamReader(object):
+    """
+    Buffered reader of a binary JSON stream. Bytes are decoded as latin-1 so buffer
+    positions map one to one onto file offsets; JSON structure and numbers are ASCII.
+    """
+
+    def __init__(self, file_object, chunk_size):
+        self._file = file_object
+        self._chunk_size = chunk_size
+        self._buffer = ''
+        self._position = 0
+        self._base_offset = file_object.tell()
+        self._eof = False
+
+    def _fill(self, size=None):
+        if self._eof:
+            return False
+        # Drop what has been consumed before growing the buffer.
+        self._base_offset += self._position
+        self._buffer = self._buffer[self._position:]
+        self._position = 0
+        chunk = self._file.read(size or self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer += chunk.decode('latin-1')
+        return True
+
+    def get_offset(self):
+        return self._base_offset + self._position
+
+    def peek(self):
+        while True:
+            while self._position < len(self._buffer) and self._buffer[self._position] in _WHITESPACE:
+                self._position += 1
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if not self._fill():
+                return ''
+
+    def expect(self, character):
+        if self.peek() != character:
+            raise ValueError('Expected {!r} at offset {} in JSON stream'.format(character, self.get_offset()))
+        self._position += 1
+
+    def decode_value(self):
+        """
+        Decode the next JSON value, reading more of the stream until it is complete.
+        """
+        self.peek()
+        read_size = self._chunk_size
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self._buffer, self._position)
+                # A number at the very end of the buffer may continue in the next chunk.
+                if end < len(self._buffer) or self._eof:
+                    text = self._buffer[self._position:end]
+                    self._position = end
+                    if _NON_ASCII.search(text):
+                        # Strings with UTF-8 multi-byte characters were decoded as latin-1.
+                        value = json.loads(text.encode('latin-1').decode('utf-8'))
+                    return value
+            except ValueError:
+                if self._eof:
+                    raise
+            self._fill(read_size)
+            read_size *= 2
+
+    def _scan(self, state):
+        """
+        Scan the rest of the buffer for the end of the array or object being skipped, updating state,
+        a list of the bracket depth, whether in a string and whether the next character is escaped.
+        Without escapes the depth is counted with NumPy over windows growing from 64 KB, so the scan
+        stops soon after the closing bracket.
+
+        :return: Buffer position after the value's closing bracket, or None if it is not in the buffer.
+        """
+        window = _SCAN_WINDOW
+        position = self._position
+        while position < len(self._buffer):
+            text = self._buffer[position:position + window]
+            if state[2] or ('\\' in text):
+                end = self._scan_escaped(text, state)
+                if end is not None:
+                    return position + end
+            else:
+                data = np.frombuffer(text.encode('latin-1'), dtype=np.uint8)
+                in_string = np.logical_xor.accumulate(data == _QUOTE)
+                if state[1]:
+                    in_string = ~in_string
+                steps = ((data == _OPENING[0]) | (data == _OPENING[1])).astype(np.int32)
+                steps -= (data == _CLOSING[0]) | (data == _CLOSING[1])
+                steps[in_string] = 0
+                depths = np.cumsum(steps, dtype=np.int64)
+                depths += state[0]
+                closed = np.flatnonzero((depths == 0) & (steps < 0))
+                if len(closed) > 0:
+                    return position + int(closed[0]) + 1
+                state[0] = int(depths[-1])
+                state[1] = bool(in_string[-1])
+            position += len(text)
+            window *= 2
+        return None
+
+    def _scan_escaped(self, text, state):
+        depth, in_string, escaped = state
+        position = 1 if escaped else 0
+        escaped = False
+        for match in _TOKEN.finditer(text, position):
+            index = match.start()
+            if index < position:
+                continue
+            character = match.group()
+            if in_string:
+                if character == '\\':
+                    position = index + 2
+                    escaped = position > len(text)
+                elif character == '"':
+                    in_string = False
+            elif character == '"':
+                in_string = True
+            elif character in '[{':
+                depth += 1
+            elif character in ']}':
+                depth -= 1
+                if depth == 0:
+                    return index + 1
+        state[:] = [depth, in_string, escaped]
+        return None
+
+    def skip_value(self):
+        """
+        Move past the next JSON value without decoding it. Arrays and objects are scanned for their
+        brackets and strings only, so numbers are never converted.
+        """
+        if self.peek() not in ['[', '{']:
+            self.decode_value()
+            return
+        state = [0, False, False]
+        while True:
+            end = self._scan(state)
+            if end is not None:
+                self._position = end
+                return
+            self._position = len(self._buffer)
+            if not self._fill():
+                raise ValueError('Unterminated JSON value at offset {} in JSON stream'.format(self.get_offset()))
+
+
+def iterate_object_items(file_object, key, chunk_size=1 << 20):
+    """
+    Iterate over the items of the object stored under key in the top level JSON object of a
+    binary file, decoding a single item value at a time so memory is bounded by the largest item.
+
+    :param file_object: JSON file opened in binary mode.
+    :param key: Top level key of the object to iterate.
+    :param chunk_size: Number of bytes to read at a time.
+    :return: Generator of (item key, item value, start offset, end offset) with the file offsets of the value.
+    """
+    return _iterate_object_items(file_object, key, chunk_size, True)
+
+
+def index_object_items(file_object, key, chunk_size=1 << 20):
+    """
+    Like iterate_object_items, but only find the file offsets of the item values without decoding
+    them, to read them later with read_value_at.
+
+    :return: Generator of (item key, start offset, end offset).
+    """
+    for item_key, _, start, end in _iterate_object_items(file_object, key, chunk_size, False):
+        yield item_key, start, end
+
+
+def _iterate_object_items(file_object, key, chunk_size, decode):
+    reader = _StreamReader(file_object, chunk_size)
+    reader.expect('{')
+    while reader.peek() not in ['}', '']:
+        top_level_key = reader.decode_value()
+        reader.expect(':')
+        if top_level_key == key:
+            reader.expect('{')
+            while reader.peek() not in ['}', '']:
+                item_key = reader.decode_value()
+                reader.expect(':')
+                reader.peek()
+                start = reader.get_offset()
+                if decode:
+                    item_value = reader.decode_value()
+                else:
+                    item_value = None
+                    reader.skip_value()
+                yield item_key, item_value, start, reader.get_offset()
+                if reader.peek() == ',':
+                    reader.expect(',')
+            return
+        reader.decode_value()
+        if reader.peek() == ',':
+            reader.expect(',')
+    raise KeyError(key)
+
+
+def read_value_at(file_object, start, end):
+    """
+    Read a single JSON value from its file offsets as given by iterate_object_items or index_object_items.
+    """
+    file_object.seek(start)
+    return json.loads(file_object.read(end - start).decode('utf-8'))
@@ -1,50 +1,85 @@
-from math import sqrt, cos, sin, fabs, atan2
+"""
+Vector, matrix, rotation and quaternion maths on NumPy arrays.
+
+Vectors are arrays whose last axis holds the components and matrices are arrays whose last two
+axes hold the rows and columns, so every function also works on stacks such as (N, 3) vectors and
+(N, 3, 3) matrices, broadcasting over the leading axes. Called with plain numbers and lists only,
+the functions return lists and floats as before.
+"""
 import numpy as np
 
 
+def _as_arrays(*values):
+    """
+    :return: The values as float arrays, and whether any value was already an array.
+    """
+    array_input = any(isinstance(value, np.ndarray) for value in values)
+    return [np.asarray(value, dtype=np.float64) for value in values], array_input
+
+
+def _output(result, array_input):
+    if array_input:
+        return result
+    if np.ndim(result) == 0:
+        return float(result)
+    return result.tolist()
+
+
+def _expand(c, dimensions):
+    """
+    Append axes to a per batch constant so it broadcasts over the last dimensions of a vector or matrix stack.
+    """
+    return c.reshape(c.shape + (1,) * dimensions) if c.ndim > 0 else c
+
+
 def magnitude(v):
-    return sqrt(sum((v[i] * v[i]) for i in range(len(v))))
+    (v,), array_input = _as_arrays(v)
+    return _output(np.sqrt(np.sum(v * v, axis=-1)), array_input)
 
 
 def add(u, v):
-    return [(u[i] + v[i]) for i in range(len(u))]
+    (u, v), array_input = _as_arrays(u, v)
+    return _output(u + v, array_input)
 
 
 def sub(u, v):
-    return [(u[i] - v[i]) for i in range(len(u))]
+    (u, v), array_input = _as_arrays(u, v)
+    return _output(u - v, array_input)
 
 
 def dot(u, v):
-    return sum((u[i] * v[i]) for i in range(len(u)))
+    (u, v), array_input = _as_arrays(u, v)
+    return _output(np.sum(u * v, axis=-1), array_input)
 
 
 def eldiv(u, v):
-    return [(u[i] / v[i]) for i in range(len(u))]
+    (u, v), array_input = _as_arrays(u, v)
+    return _output(u / v, array_input)
 
 
 def elmult(u, v):
-    return [(u[i] * v[i]) for i in range(len(u))]
+    (u, v), array_input = _as_arrays(u, v)
+    return _output(u * v, array_input)
 
 
 def normalize(v):
-    vmag = magnitude(v)
-    return [(val / vmag) for val in v]
+    (v,), array_input = _as_arrays(v)
+    return _output(v / np.sqrt(np.sum(v * v, axis=-1))[..., np.newaxis], array_input)
 
 
 def cross(u, v):
-    c = [u[1] * v[2] - u[2] * v[1],
-         u[2] * v[0] - u[0] * v[2],
-         u[0] * v[1] - u[1] * v[0]]
-
-    return c
+    (u, v), array_input = _as_arrays(u, v)
+    return _output(np.cross(u, v), array_input)
 
 
 def mult(u, c):
-    return [(u[i] * c) for i in range(len(u))]
+    (u, c), array_input = _as_arrays(u, c)
+    return _output(u * _expand(c, 1), array_input)
 
 
 def div(u, c):
-    return [(u[i] / c) for i in range(len(u))]
+    (u, c), array_input = _as_arrays(u, c)
+    return _output(u / _expand(c, 1), array_input)
 
 
 def rotmx(quaternion):
@@ -52,41 +87,41 @@ def rotmx(quaternion):
     This method takes a quaternion representing a rotation
     and turns it into a rotation matrix.
     """
-    mag_q = magnitude(quaternion)
-    norm_q = div(quaternion, mag_q)
-    qw, qx, qy, qz = norm_q
-    mx = [[qw * qw + qx * qx - qy * qy - qz * qz, 2 * qx * qy - 2 * qw * qz, 2 * qx * qz + 2 * qw * qy],
-          [2 * qx * qy + 2 * qw * qz, qw * qw - qx * qx + qy * qy - qz * qz, 2 * qy * qz - 2 * qw * qx],
-          [2 * qx * qz - 2 * qw * qy, 2 * qy * qz + 2 * qw * qx, qw * qw - qx * qx - qy * qy + qz * qz]]
-    return mx
+    (quaternion,), array_input = _as_arrays(quaternion)
+    norm_q = quaternion / np.sqrt(np.sum(quaternion * quaternion, axis=-1))[..., np.newaxis]
+    qw, qx, qy, qz = np.moveaxis(norm_q, -1, 0)
+    mx = np.stack([
+        np.stack([qw * qw + qx * qx - qy * qy - qz * qz, 2 * qx * qy - 2 * qw * qz, 2 * qx * qz + 2 * qw * qy], -1),
+        np.stack([2 * qx * qy + 2 * qw * qz, qw * qw - qx * qx + qy * qy - qz * qz, 2 * qy * qz - 2 * qw * qx], -1),
+        np.stack([2 * qx * qz - 2 * qw * qy, 2 * qy * qz + 2 * qw * qx, qw * qw - qx * qx - qy * qy + qz * qz], -1)],
+        -2)
+    return _output(mx, array_input)
 
 
 def matrixconstantmult(m, c):
     """
     Multiply components of matrix m by constant c
     """
-    return [mult(row_m, c) for row_m in m]
+    (m, c), array_input = _as_arrays(m, c)
+    return _output(m * _expand(c, 2), array_input)
 
 
 def matrixvectormult(m, v):
     """
     Post multiply matrix m by vector v
     """
-    return [dot(row_m, v) for row_m in m]
+    (m, v), array_input = _as_arrays(m, v)
+    return _output(np.einsum('...ij,...j->...i', m, v), array_input)
 
 
 def vectormatrixmult(v, m):
     """
     Premultiply matrix m by vector v
     """
-    rows = len(m)
-    if len(v) != rows:
+    (v, m), array_input = _as_arrays(v, m)
+    if v.shape[-1] != m.shape[-2]:
         raise ValueError('vectormatmult mismatched rows')
-    columns = len(m[0])
-    result = []
-    for c in range(0, columns):
-        result.append(sum(v[r] * m[r][c] for r in range(rows)))
-    return result
+    return _output(np.einsum('...i,...ij->...j', v, m), array_input)
 
 
 def matrixmult(a, b):
@@ -94,26 +129,25 @@ def matrixmult(a, b):
     Multiply 2 matrices: first index is down row, second is across column.
     Assumes sizes are compatible (
     """
-    return [vectormatrixmult(row_a, b) for row_a in a]
+    (a, b), array_input = _as_arrays(a, b)
+    return _output(np.matmul(a, b), array_input)
 
 
 def eulerToRotationMatrix3(euler_angles):
     """
     From OpenCMISS-Zinc graphics_library.cpp
     """
-    cos_azimuth = cos(euler_angles[0])
-    sin_azimuth = sin(euler_angles[0])
-    cos_elevation = cos(euler_angles[1])
-    sin_elevation = sin(euler_angles[1])
-    cos_roll = cos(euler_angles[2])
-    sin_roll = sin(euler_angles[2])
-    mat3x3 = [
-        [cos_azimuth * cos_elevation, sin_azimuth * cos_elevation, -sin_elevation],
-        [cos_azimuth * sin_elevation * sin_roll - sin_azimuth * cos_roll,
-         sin_azimuth * sin_elevation * sin_roll + cos_azimuth * cos_roll, cos_elevation * sin_roll],
-        [cos_azimuth * sin_elevation * cos_roll + sin_azimuth * sin_roll,
-         sin_azimuth * sin_elevation * cos_roll - cos_azimuth * sin_roll, cos_elevation * cos_roll]]
-    return mat3x3
+    (euler_angles,), array_input = _as_arrays(euler_angles)
+    cos_azimuth, cos_elevation, cos_roll = np.moveaxis(np.cos(euler_angles), -1, 0)
+    sin_azimuth, sin_elevation, sin_roll = np.moveaxis(np.sin(euler_angles), -1, 0)
+    mat3x3 = np.stack([
+        np.stack([cos_azimuth * cos_elevation, sin_azimuth * cos_elevation, -sin_elevation], -1),
+        np.stack([cos_azimuth * sin_elevation * sin_roll - sin_azimuth * cos_roll,
+                  sin_azimuth * sin_elevation * sin_roll + cos_azimuth * cos_roll, cos_elevation * sin_roll], -1),
+        np.stack([cos_azimuth * sin_elevation * cos_roll + sin_azimuth * sin_roll,
+                  sin_azimuth * sin_elevation * cos_roll - cos_azimuth * sin_roll, cos_elevation * cos_roll], -1)],
+        -2)
+    return _output(mat3x3, array_input)
 
 
 def rotationMatrix3ToEuler(matrix):
@@ -121,28 +155,57 @@ def rotationMatrix3ToEuler(matrix):
     From OpenCMISS-Zinc graphics_library.cpp
     """
     MATRIX_TO_EULER_TOLERANCE = 1.0E-12
-    euler_angles = [0.0, 0.0, 0.0]
-    if (fabs(matrix[0][0]) > MATRIX_TO_EULER_TOLERANCE) and (fabs(matrix[0][1]) > MATRIX_TO_EULER_TOLERANCE):
-        euler_angles[0] = atan2(matrix[0][1], matrix[0][0])
-        euler_angles[2] = atan2(matrix[1][2], matrix[2][2])
-        euler_angles[1] = atan2(-matrix[0][2], matrix[0][0] / cos(euler_angles[0]))
-    elif fabs(matrix[0][0]) > MATRIX_TO_EULER_TOLERANCE:
-        euler_angles[0] = atan2(matrix[0][1], matrix[0][0])
-        euler_angles[2] = atan2(matrix[1][2], matrix[2][2])
-        euler_angles[1] = atan2(-matrix[0][2], matrix[0][0] / cos(euler_angles[0]))
-    elif fabs(matrix[0][1]) > MATRIX_TO_EULER_TOLERANCE:
-        euler_angles[0] = atan2(matrix[0][1], matrix[0][0])
-        euler_angles[2] = atan2(matrix[1][2], matrix[2][2])
-        euler_angles[1] = atan2(-matrix[0][2], matrix[0][1] / sin(euler_angles[0]))
-    else:
-        euler_angles[1] = atan2(-matrix[0][2], 0)  # get +/-1
-        euler_angles[0] = 0
-        euler_angles[2] = atan2(-matrix[2][1], -matrix[2][0] * matrix[0][2])
-    return euler_angles
+    (matrix,), array_input = _as_arrays(matrix)
+    m00, m01, m02 = matrix[..., 0, 0], matrix[..., 0, 1], matrix[..., 0, 2]
+    has_cos = np.fabs(m00) > MATRIX_TO_EULER_TOLERANCE
+    has_sin = np.fabs(m01) > MATRIX_TO_EULER_TOLERANCE
+    general = has_cos | has_sin
+    azimuth = np.where(general, np.arctan2(m01, m00), 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        elevation = np.where(has_cos, np.arctan2(-m02, m00 / np.cos(azimuth)),
+                             np.where(has_sin, np.arctan2(-m02, m01 / np.sin(azimuth)),
+                                      np.arctan2(-m02, 0.0)))  # get +/-1
+    roll = np.where(general, np.arctan2(matrix[..., 1, 2], matrix[..., 2, 2]),
+                    np.arctan2(-matrix[..., 2, 1], -matrix[..., 2, 0] * m02))
+    return _output(np.stack([azimuth, elevation, roll], -1), array_input)
 
 
 def axisAngleToQuaternion(axis, angle):
-    return [cos(angle / 2), axis[0] * sin(angle / 2), axis[1] * sin(angle / 2), axis[2] * sin(angle / 2)]
+    (axis, angle), array_input = _as_arrays(axis, angle)
+    half_angle = angle / 2
+    return _output(np.concatenate([np.cos(half_angle)[..., np.newaxis],
+                                   axis * np.sin(half_angle)[..., np.newaxis]], -1), array_input)
+
+
+def quaternionMultiply(p, q):
+    """
+    Hamilton product of quaternions (w, x, y, z): the rotation q followed by p.
+    """
+    (p, q), array_input = _as_arrays(p, q)
+    pw, px, py, pz = np.moveaxis(p, -1, 0)
+    qw, qx, qy, qz = np.moveaxis(q, -1, 0)
+    return _output(np.stack([pw * qw - px * qx - py * qy - pz * qz,
+                             pw * qx + px * qw + py * qz - pz * qy,
+                             pw * qy - px * qz + py * qw + pz * qx,
+                             pw * qz + px * qy - py * qx + pz * qw], -1), array_input)
+
+
+def quaternionConjugate(q):
+    (q,), array_input = _as_arrays(q)
+    return _output(q * np.array([1.0, -1.0, -1.0, -1.0]), array_input)
+
+
+def eulerToQuaternion(euler_angles):
+    """
+    Unit quaternion of the rotation eulerToRotationMatrix3 gives for the same angles, composed from
+    the azimuth, elevation and roll rotations and renormalized.
+    """
+    (euler_angles,), array_input = _as_arrays(euler_angles)
+    azimuth, elevation, roll = np.moveaxis(euler_angles, -1, 0)
+    q = quaternionMultiply(axisAngleToQuaternion(np.array([1.0, 0.0, 0.0]), -roll),
+                           quaternionMultiply(axisAngleToQuaternion(np.array([0.0, 1.0, 0.0]), -elevation),
+                                              axisAngleToQuaternion(np.array([0.0, 0.0, 1.0]), -azimuth)))
+    return _output(normalize(q), array_input)
 
 
 def directionFromMatrix(matrix):
@@ -0,0 +1,91 @@
+"""
+Compact binary point cloud container, read through numpy.memmap.
+
+Layout, little endian: an 8 byte magic, a header of version, item size of the values (4 or 8),
+number of frames, number of points per frame and number of components, the float64 time of each
+frame, then the contiguous (frames, points, components) block of values.
+"""
+import struct
+
+import numpy as np
+
+from . import jsonstream
+from . import zincutils
+from .subsampling import subsample_frames
+
+POINT_CLOUD_FILE_EXTENSION = '.npc'
+
+_MAGIC = b'SRAPCLD\x00'
+_HEADER = struct.Struct('<IIQQI')
+_VERSION = 1
+
+
+def write_point_cloud(file_name, positions, times=None, dtype=np.float64):
+    """
+    Write a (frames, points, components) positions array, or a static (points, components) one.
+
+    :param times: Time of each frame, default the frame index.
+    :param dtype: np.float32 or np.float64 storage for the values.
+    """
+    positions = np.asarray(positions)
+    if positions.ndim == 2:
+        positions = positions[np.newaxis]
+    number_of_frames, number_of_points, number_of_components = positions.shape
+    if times is None:
+        times = np.arange(number_of_frames, dtype=np.float64)
+    times = np.asarray(times, dtype=np.float64)
+    if len(times) != number_of_frames:
+        raise ValueError('Point cloud needs one time per frame')
+    dtype = np.dtype(dtype).newbyteorder('<')
+    with open(file_name, 'wb') as f:
+        f.write(_MAGIC)
+        f.write(_HEADER.pack(_VERSION, dtype.itemsize, number_of_frames, number_of_points, number_of_components))
+        f.write(times.astype('<f8').tobytes())
+        for frame in positions:
+            f.write(np.ascontiguousarray(frame, dtype=dtype).tobytes())
+
+
+def read_point_cloud(file_name):
+    """
+    Open a point cloud file without reading its values; frames are paged in when touched.
+
+    :return: Read-only (frames, points, components) memory mapped positions and the array of frame times.
+    """
+    with open(file_name, 'rb') as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError('{} is not a point cloud file'.format(file_name))
+        version, item_size, number_of_frames, number_of_points, number_of_components = \
+            _HEADER.unpack(f.read(_HEADER.size))
+        if version != _VERSION:
+            raise ValueError('Unsupported point cloud file version {}'.format(version))
+        times = np.frombuffer(f.read(8 * number_of_frames), dtype='<f8').copy()
+        offset = f.tell()
+    dtype = {4: '<f4', 8: '<f8'}[item_size]
+    positions = np.memmap(file_name, dtype=dtype, mode='r', offset=offset,
+                          shape=(number_of_frames, number_of_points, number_of_components))
+    return positions, times
+
+
+def convert_json_to_point_cloud(json_file_name, file_name, dtype=np.float64, strategy='random', **options):
+    """
+    Convert the AnnotatedFrames of a JSON point cloud, streamed frame by frame. Frames are brought
+    to the same number of points with the named subsampling strategy.
+
+    :raises ValueError: If the strategy pads frames, as 'keep_all' and 'voxel_grid' do for frames
+     of different sizes: the format has no mask, so padding points would be read back as data.
+    """
+    with open(json_file_name, 'rb') as f:
+        frame_positions = [np.array([x[1] for x in value], dtype=np.float64).reshape(-1, 3)
+                           for _, value, _, _ in jsonstream.iterate_object_items(f, 'AnnotatedFrames')]
+    positions, mask = subsample_frames(frame_positions, strategy, **options)
+    if not np.all(mask):
+        raise ValueError('Subsampling strategy {} pads frames, which point cloud files cannot mark; '
+                         'use random or farthest_point.'.format(strategy))
+    write_point_cloud(file_name, positions, dtype=dtype)
+
+
+def convert_ex_to_point_cloud(ex_file_name, file_name, dtype=np.float64):
+    """
+    Convert the datapoints of an EX file into a single frame point cloud.
+    """
+    write_point_cloud(file_name, zincutils.read_ex_data_coordinates(ex_file_name), dtype=dtype)
@@ -0,0 +1,121 @@
+"""
+Strategies bringing every frame of a point cloud time series to the same number of points.
+
+Each strategy takes a list of per frame (n, 3) position arrays and returns a (frames, points, 3)
+positions array with a (frames, points) boolean mask which is False for padding points.
+"""
+import numpy as np
+
+
+def voxel_downsample(points, voxel_size):
+    """
+    Downsample points to the centroid of the points falling in each cell of a voxel grid.
+
+    :param points: (N, 3) array.
+    :param voxel_size: Edge length of the voxel grid cells.
+    :return: (M, 3) array with M <= N.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if voxel_size <= 0.0 or len(points) == 0:
+        return points
+    cells = np.floor((points - points.min(axis=0)) / voxel_size).astype(np.int64)
+    _, inverse, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    sums = np.stack([np.bincount(inverse, weights=points[:, c], minlength=len(counts))
+                     for c in range(points.shape[1])], axis=1)
+    return sums / counts[:, np.newaxis]
+
+
+def farthest_point_indexes(points, count):
+    """
+    Greedily pick count points each farthest from those already picked, starting from the point
+    closest to the centroid.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    indexes = np.empty(count, dtype=np.int64)
+    indexes[0] = np.argmin(np.sum((points - points.mean(axis=0)) ** 2, axis=1))
+    distances = np.sum((points - points[indexes[0]]) ** 2, axis=1)
+    for i in range(1, count):
+        indexes[i] = np.argmax(distances)
+        distances = np.minimum(distances, np.sum((points - points[indexes[i]]) ** 2, axis=1))
+    return indexes
+
+
+def _smallest_count(frame_positions, count):
+    smallest = min(len(x) for x in frame_positions)
+    if count is None or count > smallest:
+        return smallest
+    return count
+
+
+def subsample_random(frame_positions, count=None, seed=0):
+    """
+    Sample each frame down to count points, default the size of the smallest frame, with a seeded
+    random generator so runs are reproducible. Sampled points keep their order in the frame.
+    """
+    count = _smallest_count(frame_positions, count)
+    random_state = np.random.RandomState(seed)
+    positions = np.empty((len(frame_positions), count, 3))
+    for frame_index, points in enumerate(frame_positions):
+        positions[frame_index] = points[np.sort(random_state.choice(len(points), count, replace=False))]
+    return positions, np.ones(positions.shape[:2], dtype=bool)
+
+
+def subsample_farthest_point(frame_positions, count=None):
+    """
+    Sample each frame down to count points, default the size of the smallest frame, by farthest
+    point sampling, which keeps the coverage of the cloud.
+    """
+    count = _smallest_count(frame_positions, count)
+    positions = np.empty((len(frame_positions), count, 3))
+    for frame_index, points in enumerate(frame_positions):
+        positions[frame_index] = points[farthest_point_indexes(points, count)]
+    return positions, np.ones(positions.shape[:2], dtype=bool)
+
+
+def keep_all(frame_positions):
+    """
+    Keep every point, padding the smaller frames up to the largest by repeating their first point.
+    """
+    largest = max(len(x) for x in frame_positions)
+    positions = np.empty((len(frame_positions), largest, 3))
+    mask = np.zeros((len(frame_positions), largest), dtype=bool)
+    for frame_index, points in enumerate(frame_positions):
+        positions[frame_index, :len(points)] = points
+        positions[frame_index, len(points):] = points[0]
+        mask[frame_index, :len(points)] = True
+    return positions, mask
+
+
+def subsample_voxel_grid(frame_positions, voxel_size=None, voxel_fraction=0.01):
+    """
+    Merge the points of each frame falling in the same voxel grid cell, then pad to the largest frame.
+
+    :param voxel_size: Edge length of the cells, default voxel_fraction of the first frame's bounding box diagonal.
+    """
+    if voxel_size is None:
+        first_frame = frame_positions[0]
+        voxel_size = voxel_fraction * np.linalg.norm(first_frame.max(axis=0) - first_frame.min(axis=0))
+    return keep_all([voxel_downsample(points, voxel_size) for points in frame_positions])
+
+
+SUBSAMPLING_STRATEGIES = {
+    'random': subsample_random,
+    'farthest_point': subsample_farthest_point,
+    'voxel_grid': subsample_voxel_grid,
+    'keep_all': keep_all,
+}
+
+
+def subsample_frames(frame_positions, strategy='random', **options):
+    """
+    Bring all frames to the same number of points with a named strategy.
+
+    :param frame_positions: List of per frame (n, 3) arrays.
+    :param strategy: Key of SUBSAMPLING_STRATEGIES.
+    :param options: Options of the strategy function.
+    :return: (frames, points, 3) positions and (frames, points) mask of real points.
+    """
+    if strategy not in SUBSAMPLING_STRATEGIES:
+        raise ValueError('Unknown subsampling strategy: {}'.format(strategy))
+    return SUBSAMPLING_STRATEGIES[strategy](frame_positions, **options)
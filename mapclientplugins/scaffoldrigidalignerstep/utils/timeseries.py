@@ -0,0 +1,190 @@
+"""
+Frame by frame access to point cloud time series, for loading frames only when they are viewed.
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from . import jsonstream
+from . import pointcloud
+
+
+class JsonFrameSource(object):
+    """
+    Frames of the AnnotatedFrames of a JSON point cloud. The file offsets of each frame are
+    indexed once on opening by scanning brackets only, after which a frame is decoded when read,
+    by seeking straight to it.
+    """
+
+    def __init__(self, file_name, progress=None):
+        """
+        :param progress: Optional callable taking the fraction of the file indexed and a message; it may raise to abandon opening.
+        """
+        self._file_name = file_name
+        self._offsets = []
+        file_size = float(max(os.path.getsize(file_name), 1))
+        with open(file_name, 'rb') as f:
+            for _, start, end in jsonstream.index_object_items(f, 'AnnotatedFrames'):
+                self._offsets.append((start, end))
+                if progress is not None:
+                    progress(end / file_size, 'Indexed frame {}'.format(len(self._offsets)))
+        self._file = open(file_name, 'rb')
+        self._lock = threading.Lock()
+
+    def get_number_of_frames(self):
+        return len(self._offsets)
+
+    def get_times(self):
+        """
+        JSON frames carry no times; they are timed by their index.
+        """
+        return None
+
+    def get_frame_sizes(self):
+        """
+        Get the number of points of each frame. Decodes every frame, so it takes as long as reading them all.
+        """
+        return [len(self.read_frame(index)) for index in range(len(self._offsets))]
+
+    def read_frame(self, index):
+        start, end = self._offsets[index]
+        with self._lock:
+            value = jsonstream.read_value_at(self._file, start, end)
+        return np.array([x[1] for x in value], dtype=np.float64).reshape(-1, 3)
+
+    def close(self):
+        self._file.close()
+
+
+class PointCloudFrameSource(object):
+    """
+    Frames of a memory mapped point cloud file; opening reads the header only.
+    """
+
+    def __init__(self, file_name):
+        self._positions, self._times = pointcloud.read_point_cloud(file_name)
+
+    def get_number_of_frames(self):
+        return len(self._positions)
+
+    def get_times(self):
+        return self._times
+
+    def get_frame_sizes(self):
+        return [self._positions.shape[1]] * len(self._positions)
+
+    def read_frame(self, index):
+        return np.array(self._positions[index], dtype=np.float64)
+
+    def close(self):
+        self._positions = None
+
+
+def open_frame_source(file_name, progress=None):
+    """
+    Open a frame source for a JSON or point cloud file, or return None for other formats.
+    """
+    if file_name.endswith(pointcloud.POINT_CLOUD_FILE_EXTENSION):
+        return PointCloudFrameSource(file_name)
+    if file_name.endswith('.json'):
+        return JsonFrameSource(file_name, progress)
+    return None
+
+
+class FrameCache(object):
+    """
+    Least recently used cache of the frames of a frame source, bounded by a memory budget in bytes.
+    Neighbouring frames of a requested frame are read ahead on a background thread.
+    """
+
+    def __init__(self, source, memory_budget=256 * 1024 * 1024, prefetch=2):
+        self._source = source
+        self._memory_budget = memory_budget
+        self._prefetch = prefetch
+        self._frames = OrderedDict()
+        self._size = 0
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1) if prefetch > 0 else None
+
+    def get_source(self):
+        return self._source
+
+    def set_memory_budget(self, memory_budget):
+        with self._lock:
+            self._memory_budget = memory_budget
+            self._evict()
+
+    def get_memory_usage(self):
+        return self._size
+
+    def is_cached(self, index):
+        with self._lock:
+            return index in self._frames
+
+    def _evict(self):
+        # Keep the most recent frame even if it alone exceeds the budget.
+        while self._size > self._memory_budget and len(self._frames) > 1:
+            _, frame = self._frames.popitem(last=False)
+            self._size -= frame.nbytes
+
+    def _store(self, index, frame):
+        with self._lock:
+            if index not in self._frames:
+                self._frames[index] = frame
+                self._size += frame.nbytes
+                self._evict()
+            self._pending.discard(index)
+
+    def _load(self, index):
+        try:
+            frame = self._source.read_frame(index)
+        except Exception:
+            with self._lock:
+                self._pending.discard(index)
+            raise
+        self._store(index, frame)
+        return frame
+
+    def get_frame(self, index, prefetch=True):
+        """
+        Get the (n, 3) positions of frame index, reading it if not cached, and optionally schedule
+        its neighbours.
+        """
+        with self._lock:
+            frame = self._frames.pop(index, None)
+            if frame is not None:
+                self._frames[index] = frame
+        if frame is None:
+            frame = self._load(index)
+        if prefetch:
+            self._prefetch_around(index)
+        return frame
+
+    def _prefetch_around(self, index):
+        if self._executor is None:
+            return
+        number_of_frames = self._source.get_number_of_frames()
+        for distance in range(1, self._prefetch + 1):
+            for neighbour in (index + distance, index - distance):
+                if 0 <= neighbour < number_of_frames:
+                    with self._lock:
+                        if neighbour in self._frames or neighbour in self._pending:
+                            continue
+                        self._pending.add(neighbour)
+                    self._executor.submit(self._load, neighbour)
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._size = 0
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.clear()
+        self._source.close()
@@ -1,8 +1,13 @@
+import warnings
+
+import numpy as np
+
+from opencmiss.zinc.context import Context
 from opencmiss.zinc.node import Node
 from opencmiss.zinc.field import Field
 from opencmiss.zinc.status import OK as ZINC_OK
 
-from .maths import elmult, add, matrixvectormult
+from . import maths
 
 
 def remove_zero_valued_nodes(source_field, time=0.0):
@@ -76,201 +81,305 @@ def copy_nodal_parameters(source_field, target_field, time=0.0):
     return success
 
 
-def swap_axes(source_field, axes=None):
-    axis_x = 0
-    axis_y = 1
-    axis_z = 2
-    number_of_components = source_field.getNumberOfComponents()
-    field = source_field.castFiniteElement()
-    if not (field.isValid()):
-        print('field must be finite element type')
-        return False
+NODE_VALUE_LABELS = [Node.VALUE_LABEL_VALUE, Node.VALUE_LABEL_D_DS1, Node.VALUE_LABEL_D_DS2,
+                     Node.VALUE_LABEL_D2_DS1DS2, Node.VALUE_LABEL_D_DS3, Node.VALUE_LABEL_D2_DS1DS3,
+                     Node.VALUE_LABEL_D2_DS2DS3, Node.VALUE_LABEL_D3_DS1DS2DS3]
+
+
+def get_nodal_parameters(field, domain_type=Field.DOMAIN_TYPE_NODES, time=None):
+    """
+    Get all nodal parameters of a finite element field in a single traversal of the nodeset.
+
+    :param field: Finite element field to get parameters for.
+    :param domain_type: Nodeset domain type to traverse.
+    :param time: Optional time to get time-varying parameters at.
+    :return: success, node identifiers array (nodes,), parameters array of shape
+     (nodes, derivatives, versions, components) and a boolean mask of shape (nodes, derivatives, versions)
+     flagging the parameters which exist. Derivatives are indexed as in NODE_VALUE_LABELS. The number of
+     components is the field's and the number of versions the most any node has; parameters a node does
+     not have, including all of a node the field is not defined on, are left out of the mask.
+    """
+    number_of_components = field.getNumberOfComponents()
+    fe_field = field.castFiniteElement()
     success = True
     fm = field.getFieldmodule()
     fm.beginChange()
     cache = fm.createFieldcache()
-    nodes = fm.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES)
+    if time is not None:
+        cache.setTime(time)
+    nodes = fm.findNodesetByFieldDomainType(domain_type)
     node_template = nodes.createNodetemplate()
     node_iter = nodes.createNodeiterator()
+    node_identifiers = []
+    indexes = []
+    values_list = []
     node = node_iter.next()
     while node.isValid():
-        node_template.defineFieldFromNode(field, node)
+        node_index = len(node_identifiers)
+        node_identifiers.append(node.getIdentifier())
+        if node_template.defineFieldFromNode(fe_field, node) != ZINC_OK:
+            node = node_iter.next()
+            continue
         cache.setNode(node)
-        for derivative in [Node.VALUE_LABEL_VALUE, Node.VALUE_LABEL_D_DS1, Node.VALUE_LABEL_D_DS2,
-                           Node.VALUE_LABEL_D2_DS1DS2,
-                           Node.VALUE_LABEL_D_DS3, Node.VALUE_LABEL_D2_DS1DS3, Node.VALUE_LABEL_D2_DS2DS3,
-                           Node.VALUE_LABEL_D3_DS1DS2DS3]:
-            versions = node_template.getValueNumberOfVersions(field, -1, derivative)
-            for v in range(1, versions + 1):
-                result, values = field.getNodeParameters(cache, -1, derivative, v, number_of_components)
+        for derivative_index, derivative in enumerate(NODE_VALUE_LABELS):
+            versions = node_template.getValueNumberOfVersions(fe_field, -1, derivative)
+            for v in range(max(versions, 0)):
+                result, values = fe_field.getNodeParameters(cache, -1, derivative, v + 1, number_of_components)
                 if result != ZINC_OK:
                     success = False
                 else:
-                    if axes['scaffold_up'] == 'Z' and axes['data_up'] == 'Y':
-                        new_values = [values[axis_x], values[axis_z], values[axis_y]]
-                        _ = field.setNodeParameters(cache, -1, derivative, v, new_values)
-                        new_values = [new_values[0], new_values[1], -new_values[2]]
-                        result = field.setNodeParameters(cache, -1, derivative, v, new_values)
-                    elif axes['scaffold_up'] == 'Z' and axes['data_up'] == 'X':
-                        new_values = [values[axis_z], values[axis_y], values[axis_x]]
-                        _ = field.setNodeParameters(cache, -1, derivative, v, new_values)
-                        new_values = [new_values[0], new_values[1], -new_values[2]]
-                        result = field.setNodeParameters(cache, -1, derivative, v, new_values)
-                    elif axes['scaffold_up'] == 'Z' and axes['data_up'] == 'Z':
-                        pass
-                    elif axes['scaffold_up'] == 'Y' and axes['data_up'] == 'Y':
-                        pass
-                    elif axes['scaffold_up'] == 'X' and axes['data_up'] == 'X':
-                        pass
-                    else:
-                        Warning('The scaffold {} up and data {} up axes combination is not yet implemented.'.format(
-                            axes['scaffold_up'], axes['data_up']))
-                        success = False
-                    if result != ZINC_OK:
-                        success = False
+                    indexes.append((node_index, derivative_index, v))
+                    # A single component comes back as a float rather than a list.
+                    values_list.append(np.reshape(values, number_of_components))
         node = node_iter.next()
     fm.endChange()
-    if not success:
-        print('failed to get/set some values')
-    return success
 
+    indexes = np.array(indexes, dtype=np.int32).reshape(-1, 3)
+    number_of_versions = int(indexes[:, 2].max()) + 1 if len(indexes) else 1
+    shape = (len(node_identifiers), len(NODE_VALUE_LABELS), number_of_versions)
+    parameters = np.zeros(shape + (number_of_components,))
+    mask = np.zeros(shape, dtype=bool)
+    if len(indexes):
+        parameters[indexes[:, 0], indexes[:, 1], indexes[:, 2]] = values_list
+        mask[indexes[:, 0], indexes[:, 1], indexes[:, 2]] = True
+    return success, np.array(node_identifiers, dtype=np.int32), parameters, mask
 
-def transform_coordinates(field, rotation):
-    number_of_components = field.getNumberOfComponents()
-    if (number_of_components != 2) and (number_of_components != 3):
-        print('zincutils.transformCoordinates: field has invalid number of components')
-        return False
-    if len(rotation) != number_of_components:
-        print('zincutils.transformCoordinates: invalid matrix number of columns or offset size')
-        return False
-    if field.getCoordinateSystemType() != Field.COORDINATE_SYSTEM_TYPE_RECTANGULAR_CARTESIAN:
-        print('zincutils.transformCoordinates: field is not rectangular cartesian')
-        return False
+
+def set_nodal_parameters(field, node_identifiers, parameters, mask, domain_type=Field.DOMAIN_TYPE_NODES,
+                         time=None):
+    """
+    Set nodal parameters previously obtained with get_nodal_parameters in one bulk change. Only the
+    parameters flagged in mask are set, so nodes with fewer versions than others keep their own.
+
+    :return: True on success, False if any parameter could not be set.
+    """
     fe_field = field.castFiniteElement()
-    if not fe_field.isValid():
-        print('zincutils.transformCoordinates: field is not finite element field type')
-        return False
     success = True
     fm = field.getFieldmodule()
     fm.beginChange()
     cache = fm.createFieldcache()
-    nodes = fm.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES)
-    node_template = nodes.createNodetemplate()
-    node_iter = nodes.createNodeiterator()
-    node = node_iter.next()
-    while node.isValid():
-        node_template.defineFieldFromNode(fe_field, node)
+    if time is not None:
+        cache.setTime(time)
+    nodes = fm.findNodesetByFieldDomainType(domain_type)
+    for node_index, node_identifier in enumerate(node_identifiers):
+        node = nodes.findNodeByIdentifier(int(node_identifier))
+        if not node.isValid():
+            success = False
+            continue
         cache.setNode(node)
-        for derivative in [Node.VALUE_LABEL_VALUE, Node.VALUE_LABEL_D_DS1, Node.VALUE_LABEL_D_DS2,
-                           Node.VALUE_LABEL_D2_DS1DS2, Node.VALUE_LABEL_D_DS3, Node.VALUE_LABEL_D2_DS1DS3,
-                           Node.VALUE_LABEL_D2_DS2DS3, Node.VALUE_LABEL_D3_DS1DS2DS3]:
-            versions = node_template.getValueNumberOfVersions(fe_field, -1, derivative)
-            for v in range(1, versions + 1):
-                result, values = fe_field.getNodeParameters(cache, -1, derivative, v, number_of_components)
-                if result != ZINC_OK:
-                    success = False
-                else:
-                    new_values = matrixvectormult(rotation, values)
-                    result = fe_field.setNodeParameters(cache, -1, derivative, v, new_values)
-                    if result != ZINC_OK:
-                        success = False
-        node = node_iter.next()
+        node_parameters = parameters[node_index]
+        for derivative_index, v in zip(*np.nonzero(mask[node_index])):
+            result = fe_field.setNodeParameters(cache, -1, NODE_VALUE_LABELS[derivative_index], int(v) + 1,
+                                                node_parameters[derivative_index, v].tolist())
+            if result != ZINC_OK:
+                success = False
     fm.endChange()
-    if not success:
-        print('zincutils.transformCoordinates: failed to get/set some values')
     return success
 
 
-def scale_coordinates(field, scale):
+def _get_component_transform(number_of_components, matrix=None, offset=None):
+    """
+    Get the part of the affine transform acting on the leading number_of_components components.
+
+    :raises ValueError: If the transform moves those components out of their plane.
+    """
+    if matrix is not None:
+        matrix = np.asarray(matrix, dtype=np.float64)
+        if np.any(matrix[number_of_components:, :number_of_components] != 0.0):
+            raise ValueError('Transform moves a {} component field out of its plane'.format(number_of_components))
+        matrix = matrix[:number_of_components, :number_of_components]
+    if offset is not None:
+        offset = np.asarray(offset, dtype=np.float64)
+        if np.any(offset[number_of_components:] != 0.0):
+            raise ValueError('Offset moves a {} component field out of its plane'.format(number_of_components))
+        offset = offset[:number_of_components]
+    return matrix, offset
+
+
+def apply_affine_to_nodal_parameters(parameters, matrix=None, offset=None):
+    """
+    Apply an affine transform to a nodal parameters array in a single batched operation.
+    Value parameters get the full transform while derivatives only get the linear part.
+
+    :param parameters: Array of shape (nodes, derivatives, versions, components).
+    :param matrix: Linear part as a square matrix, or None for identity. A larger matrix, such as a 3x3
+     transform of a 2D field in the x-y plane, is applied to the leading components; it must keep
+     the plane of those components.
+    :param offset: Translation applied to the values, or None, likewise restricted to the components.
+    :return: New transformed parameters array.
+    """
+    matrix, offset = _get_component_transform(parameters.shape[-1], matrix, offset)
+    if matrix is not None:
+        transformed = maths.matrixvectormult(matrix, parameters)
+    else:
+        transformed = parameters.copy()
+    if offset is not None:
+        transformed[:, 0] += offset
+    return transformed
+
+
+def _check_coordinate_field(field, size, name):
     number_of_components = field.getNumberOfComponents()
     if (number_of_components != 2) and (number_of_components != 3):
-        print('zincutils.scale_coordinates: field has invalid number of components')
+        print('zincutils.{}: field has invalid number of components'.format(name))
         return False
-    if len(scale) != number_of_components:
-        print('zincutils.scale_coordinates: invalid matrix number of columns or offset size')
+    if size != number_of_components:
+        print('zincutils.{}: invalid matrix number of columns or offset size'.format(name))
         return False
     if field.getCoordinateSystemType() != Field.COORDINATE_SYSTEM_TYPE_RECTANGULAR_CARTESIAN:
-        print('zincutils.transformCoordinates: field is not rectangular cartesian')
+        print('zincutils.{}: field is not rectangular cartesian'.format(name))
         return False
-    fe_field = field.castFiniteElement()
-    if not fe_field.isValid():
-        print('zincutils.scale_coordinates: field is not finite element field type')
+    if not field.castFiniteElement().isValid():
+        print('zincutils.{}: field is not finite element field type'.format(name))
         return False
-    success = True
+    return True
+
+
+def transform_nodal_parameters(field, matrix=None, offset=None):
+    """
+    Transform all nodal parameters of field in bulk. The field is assigned the field multiplied by
+    the matrix plus the offset over its whole nodeset with a Zinc field assignment, which transforms
+    the derivatives by the linear part only, so the number of calls does not depend on the number of
+    nodes. Zinc versions without field assignment fall back to getting the parameters in one
+    traversal, applying the transform as one batched matrix operation and setting the results back.
+    """
+    fe_field = field.castFiniteElement()
+    if not hasattr(fe_field, 'createFieldassignment'):
+        success, node_identifiers, parameters, mask = get_nodal_parameters(field)
+        transformed = apply_affine_to_nodal_parameters(parameters, matrix, offset)
+        if not set_nodal_parameters(field, node_identifiers, transformed, mask):
+            success = False
+        return success
+    number_of_components = field.getNumberOfComponents()
+    matrix, offset = _get_component_transform(number_of_components, matrix, offset)
+    if (matrix is None) and (offset is None):
+        return True
     fm = field.getFieldmodule()
     fm.beginChange()
-    cache = fm.createFieldcache()
-    nodes = fm.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES)
-    node_template = nodes.createNodetemplate()
-    node_iter = nodes.createNodeiterator()
-    node = node_iter.next()
-    while node.isValid():
-        node_template.defineFieldFromNode(fe_field, node)
-        cache.setNode(node)
-        for derivative in [Node.VALUE_LABEL_VALUE, Node.VALUE_LABEL_D_DS1, Node.VALUE_LABEL_D_DS2,
-                           Node.VALUE_LABEL_D2_DS1DS2, Node.VALUE_LABEL_D_DS3, Node.VALUE_LABEL_D2_DS1DS3,
-                           Node.VALUE_LABEL_D2_DS2DS3, Node.VALUE_LABEL_D3_DS1DS2DS3]:
-            versions = node_template.getValueNumberOfVersions(fe_field, -1, derivative)
-            for v in range(1, versions + 1):
-                result, values = fe_field.getNodeParameters(cache, -1, derivative, v, number_of_components)
-                if result != ZINC_OK:
-                    success = False
-                else:
-                    new_values = elmult(scale, values)
-                    result = fe_field.setNodeParameters(cache, -1, derivative, v, new_values)
-                    if result != ZINC_OK:
-                        success = False
-        node = node_iter.next()
+    source_field = fe_field
+    if matrix is not None:
+        matrix_field = fm.createFieldConstant(matrix.ravel().tolist())
+        source_field = fm.createFieldMatrixMultiply(number_of_components, matrix_field, source_field)
+    if offset is not None:
+        source_field = fm.createFieldAdd(source_field, fm.createFieldConstant(offset.tolist()))
+    field_assignment = fe_field.createFieldassignment(source_field)
+    field_assignment.setNodeset(fm.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES))
+    result = field_assignment.assign()
     fm.endChange()
+    return result == ZINC_OK
+
+
+def get_swap_axes_matrix(axes):
+    """
+    Get the signed permutation matrix mapping the scaffold up axis onto the data up axis.
+
+    :return: 3x3 matrix as nested lists, or None if the combination is not implemented.
+    """
+    if axes['scaffold_up'] == 'Z' and axes['data_up'] == 'Y':
+        return [[1.0, 0.0, 0.0], [0.0, 0.0, 1.0], [0.0, -1.0, 0.0]]
+    elif axes['scaffold_up'] == 'Z' and axes['data_up'] == 'X':
+        return [[0.0, 0.0, 1.0], [0.0, 1.0, 0.0], [-1.0, 0.0, 0.0]]
+    elif axes['scaffold_up'] == axes['data_up'] and axes['scaffold_up'] in ['X', 'Y', 'Z']:
+        return [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]]
+    return None
+
+
+def swap_axes(source_field, axes=None):
+    field = source_field.castFiniteElement()
+    if not (field.isValid()):
+        print('field must be finite element type')
+        return False
+    matrix = get_swap_axes_matrix(axes)
+    if matrix is None:
+        warnings.warn('The scaffold {} up and data {} up axes combination is not yet implemented.'.format(
+            axes['scaffold_up'], axes['data_up']))
+        print('failed to get/set some values')
+        return False
+    if axes['scaffold_up'] == axes['data_up']:
+        return True
+    success = transform_nodal_parameters(field, matrix=matrix)
     if not success:
-        print('zincutils.transformCoordinates: failed to get/set some values')
+        print('failed to get/set some values')
     return success
 
 
-def offset_scaffold(field, offset):
-    number_of_components = field.getNumberOfComponents()
-    if (number_of_components != 2) and (number_of_components != 3):
-        print('zincutils.offset_scaffold: field has invalid number of components')
-        return False
-    if len(offset) != number_of_components:
-        print('zincutils.offset_scaffold: invalid matrix number of columns or offset size')
+def transform_coordinates(field, rotation):
+    if not _check_coordinate_field(field, len(rotation), 'transformCoordinates'):
         return False
-    if field.getCoordinateSystemType() != Field.COORDINATE_SYSTEM_TYPE_RECTANGULAR_CARTESIAN:
-        print('zincutils.offset_scaffold: field is not rectangular cartesian')
+    success = transform_nodal_parameters(field, matrix=rotation)
+    if not success:
+        print('zincutils.transformCoordinates: failed to get/set some values')
+    return success
+
+
+def scale_coordinates(field, scale):
+    if not _check_coordinate_field(field, len(scale), 'scale_coordinates'):
         return False
-    fe_field = field.castFiniteElement()
-    if not fe_field.isValid():
-        print('zincutils.transformCoordinates: field is not finite element field type')
+    success = transform_nodal_parameters(field, matrix=np.diag(scale))
+    if not success:
+        print('zincutils.scale_coordinates: failed to get/set some values')
+    return success
+
+
+def offset_scaffold(field, offset):
+    if not _check_coordinate_field(field, len(offset), 'offset_scaffold'):
         return False
-    success = True
+    success = transform_nodal_parameters(field, offset=offset)
+    if not success:
+        print('zincutils.offset_scaffold: failed to get/set some values')
+    return success
+
+
+def get_nodeset_coordinates(field, domain_type=Field.DOMAIN_TYPE_DATAPOINTS, time=None):
+    """
+    Evaluate field at every node of a nodeset.
+
+    :return: (nodes, components) array.
+    """
+    number_of_components = field.getNumberOfComponents()
     fm = field.getFieldmodule()
     fm.beginChange()
     cache = fm.createFieldcache()
-    nodes = fm.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES)
-    node_template = nodes.createNodetemplate()
+    if time is not None:
+        cache.setTime(time)
+    nodes = fm.findNodesetByFieldDomainType(domain_type)
     node_iter = nodes.createNodeiterator()
+    positions = []
     node = node_iter.next()
     while node.isValid():
-        node_template.defineFieldFromNode(fe_field, node)
         cache.setNode(node)
-        for derivative in [Node.VALUE_LABEL_VALUE, Node.VALUE_LABEL_D_DS1, Node.VALUE_LABEL_D_DS2,
-                           Node.VALUE_LABEL_D2_DS1DS2, Node.VALUE_LABEL_D_DS3, Node.VALUE_LABEL_D2_DS1DS3,
-                           Node.VALUE_LABEL_D2_DS2DS3, Node.VALUE_LABEL_D3_DS1DS2DS3]:
-            versions = node_template.getValueNumberOfVersions(fe_field, -1, derivative)
-            for v in range(1, versions + 1):
-                result, values = fe_field.getNodeParameters(cache, -1, derivative, v, number_of_components)
-                if result != ZINC_OK:
-                    success = False
-                else:
-                    if derivative == Node.VALUE_LABEL_VALUE:
-                        new_values = add(values, offset)
-                    else:
-                        new_values = values
-                    result = fe_field.setNodeParameters(cache, -1, derivative, v, new_values)
-                    if result != ZINC_OK:
-                        success = False
+        result, position = field.evaluateReal(cache, number_of_components)
+        if result == ZINC_OK:
+            positions.append(position)
         node = node_iter.next()
     fm.endChange()
-    if not success:
-        print('zincutils.offset_scaffold: failed to get/set some values')
-    return success
+    return np.array(positions, dtype=np.float64).reshape(-1, number_of_components)
+
+
+def read_ex_data_coordinates(file_name):
+    """
+    Read the datapoints of an EX file into a scratch region and get their coordinates.
+
+    :return: (datapoints, components) array.
+    """
+    context = Context('point_cloud')
+    region = context.getDefaultRegion()
+    sir = region.createStreaminformationRegion()
+    resource = sir.createStreamresourceFile(file_name)
+    sir.setResourceDomainTypes(resource, Field.DOMAIN_TYPE_DATAPOINTS)
+    if region.read(sir) != ZINC_OK:
+        raise ValueError('Failed to read point cloud')
+    fm = region.getFieldmodule()
+    data_points = fm.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_DATAPOINTS)
+    data_point = data_points.createNodeiterator().next()
+    if not data_point.isValid():
+        raise ValueError('Data cloud is empty')
+    cache = fm.createFieldcache()
+    cache.setNode(data_point)
+    field_iter = fm.createFielditerator()
+    field = field_iter.next()
+    while field.isValid():
+        if field.isTypeCoordinate() and (field.getNumberOfComponents() <= 3) and field.isDefinedAtLocation(cache):
+            return get_nodeset_coordinates(field)
+        field = field_iter.next()
+    raise ValueError('Could not determine data coordinate field')
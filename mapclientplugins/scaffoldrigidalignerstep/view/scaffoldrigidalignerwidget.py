@@ -1,6 +1,7 @@
 from PySide import QtGui
 
 from .ui_scaffoldrigidalignerwidget import Ui_ScaffoldRigidAlignerWidget
+from .worker import Worker
 
 from opencmiss.zinchandlers.scenemanipulation import SceneManipulation
 from opencmiss.zincwidgets.basesceneviewerwidget import BaseSceneviewerWidget
@@ -27,6 +28,8 @@ class ScaffoldRigidAlignerWidget(QtGui.QWidget):
         self._model.set_settings_change_callback(self._setting_display)
         self._temporal_data_flag = False
         self._model_description = None
+        self._worker = None
+        self._ui.progress_frame.setVisible(False)
         self._make_connections()
 
     def _make_connections(self):
@@ -47,6 +50,7 @@ class ScaffoldRigidAlignerWidget(QtGui.QWidget):
         self._ui.dataX_radioButton.clicked.connect(self._data_x_up)
         self._ui.upsideDown_checkBox.clicked.connect(self._data_upside_down)
         self._ui.axisDone_pushButton.clicked.connect(self._apply_axis_orientation)
+        self._ui.autoAlign_pushButton.clicked.connect(self._auto_align_clicked)
         self._ui.yaw_doubleSpinBox.valueChanged.connect(self._yaw_clicked)
         self._ui.pitch_doubleSpinBox.valueChanged.connect(self._pitch_clicked)
         self._ui.roll_doubleSpinBox.valueChanged.connect(self._roll_clicked)
@@ -54,6 +58,11 @@ class ScaffoldRigidAlignerWidget(QtGui.QWidget):
         self._ui.saveSettingsButton.clicked.connect(self._save_settings)
         self._ui.loadSettingsButton.clicked.connect(self._load_settings)
         self._ui.alignResetButton.clicked.connect(self._reset)
+        self._ui.cancelButton.clicked.connect(self._cancel_clicked)
+        self._undo_shortcut = QtGui.QShortcut(QtGui.QKeySequence('Ctrl+Z'), self)
+        self._undo_shortcut.activated.connect(self._undo)
+        self._redo_shortcut = QtGui.QShortcut(QtGui.QKeySequence('Ctrl+Shift+Z'), self)
+        self._redo_shortcut.activated.connect(self._redo)
 
     def _setting_display(self):
         self._display_real(self._ui.yaw_doubleSpinBox, self._model.get_yaw_value())
@@ -125,11 +134,60 @@ class ScaffoldRigidAlignerWidget(QtGui.QWidget):
         if self._ui.overlaySceneviewerWidget.get_zinc_sceneviewer() is not None:
             self._ui.overlaySceneviewerWidget.view_all()
 
+    def _run_in_background(self, function, finished, abandoned=None):
+        """
+        Run function on a worker thread while showing its progress, then call finished with its
+        result back on the GUI thread, or abandoned if it failed or was cancelled. Zinc objects are
+        only touched in these slots.
+        """
+        if self._worker is not None:
+            self._worker.wait()
+        self._worker = Worker(function)
+        self._worker.progress.connect(self._worker_progress)
+        for signal in [self._worker.finished, self._worker.failed, self._worker.cancelled]:
+            signal.connect(self._worker_stopped)
+        self._worker.finished.connect(finished)
+        self._worker.failed.connect(self._worker_failed)
+        if abandoned is not None:
+            self._worker.failed.connect(abandoned)
+            self._worker.cancelled.connect(abandoned)
+        self._ui.toolBox.setEnabled(False)
+        self._ui.frame.setEnabled(False)
+        self._ui.progressBar.setValue(0)
+        self._ui.cancelButton.setEnabled(True)
+        self._ui.progress_frame.setVisible(True)
+        self._worker.start()
+
+    def _worker_progress(self, fraction, message):
+        self._ui.progressBar.setValue(int(100 * fraction))
+        self._ui.progressBar.setToolTip(message)
+
+    def _worker_stopped(self, *args):
+        self._ui.progress_frame.setVisible(False)
+        self._ui.toolBox.setEnabled(True)
+        self._ui.frame.setEnabled(True)
+
+    def _worker_failed(self, message):
+        QtGui.QMessageBox.warning(self, 'Scaffold Rigid Aligner', message)
+
+    def _cancel_clicked(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._ui.cancelButton.setEnabled(False)
+
     def _done_clicked(self):
+        self._run_in_background(self._model.read_all_data, self._all_data_read)
+
+    def _all_data_read(self, frames):
+        self._run_in_background(self._model.create_done_task(frames), self._done_task_finished)
+
+    def _done_task_finished(self, result):
+        self._model_description = self._model.apply_done_result(result, self._temporal_data_flag)
         self._done_callback()
 
     def get_model_description(self):
-        self._model_description = self._model.done(self._temporal_data_flag)
+        if self._model_description is None:
+            self._model_description = self._model.done(self._temporal_data_flag)
         return self._model_description
 
     def _set_scaffold_checkbox(self, value):
@@ -213,10 +271,22 @@ class ScaffoldRigidAlignerWidget(QtGui.QWidget):
     def _apply_axis_orientation(self):
         self._check_if_data_is_partial()
         # Apply orientation
-        self._model.apply_orientation()
+        try:
+            self._model.apply_orientation()
+        except ValueError as e:
+            QtGui.QMessageBox.warning(self, 'Scaffold Rigid Aligner', str(e))
+            return
         self._ui.axisDone_pushButton.setEnabled(False)
         self._ui.scaleRatio_pushButton.setEnabled(True)
 
+    def _auto_align_clicked(self):
+        self._run_in_background(self._model.create_registration_task(similarity=True), self._registration_solved)
+
+    def _registration_solved(self, result):
+        self._model.apply_registration_result(result)
+        self._ui.autoAlign_label.setText('RMS error: {:.4g} ({} iterations)'.format(result.rms_error,
+                                                                                  result.iterations))
+
     def _calculate_scale_clicked(self):
         self._check_if_data_is_partial()
         self._scale_ratio_display(self._partial_data)
@@ -242,31 +312,50 @@ class ScaffoldRigidAlignerWidget(QtGui.QWidget):
         self._model.save_settings()
 
     def _load_settings(self):
-        self._model.load_settings()
-        self._ui.axisDone_pushButton.setEnabled(True)
+        try:
+            self._model.restore_settings()
+        except ValueError as e:
+            QtGui.QMessageBox.warning(self, 'Scaffold Rigid Aligner', str(e))
+
+    def _undo(self):
+        if (self._worker is None) or not self._worker.is_running():
+            self._model.undo()
+
+    def _redo(self):
+        if (self._worker is None) or not self._worker.is_running():
+            self._model.redo()
 
     def _data_is_temporal(self):
         self._temporal_data_flag = True
         self._ui.timeSkip_pushButton.setEnabled(True)
 
     def _confirm_and_load(self):
+        self._ui.timeSkip_pushButton.setEnabled(False)
+        self._run_in_background(self._model.read_data, self._data_read, self._data_read_abandoned)
+
+    def _data_read_abandoned(self, *args):
+        self._ui.timeSkip_pushButton.setEnabled(True)
+
+    def _data_read(self, data):
         if self._temporal_data_flag:
             self._ui.timePoint_spinBox.setEnabled(True)
             self._ui.timePoint_label.setEnabled(True)
-            self._model.load_json_data()
-        else:
-            self._model.load_ex_data()
+        self._model.load_data(data)
         self._model.initialise_scaffold()
         self._create_graphics()
+        self._ui.autoAlign_pushButton.setEnabled(True)
         self._model.set_time_value(0.0)
         self._model.initialise_time_graphics(0.0)
         self._view_all()
         if self._temporal_data_flag:
-            self._ui.timePoint_spinBox.setMaximum(self._model.get_maximum_time_from_data())
+            self._ui.timePoint_spinBox.setMaximum(len(self._model.get_time_sequence()) - 1)
         # self._set_scale(self._model.get_scale())
 
     def _time_changed(self):
-        time_value = self._ui.timePoint_spinBox.value()
+        # The spin box counts frames, which point cloud files may time otherwise.
+        time_sequence = self._model.get_time_sequence()
+        frame = self._ui.timePoint_spinBox.value()
+        time_value = time_sequence[min(frame, len(time_sequence) - 1)] if time_sequence else frame
         self._model.set_time_value(time_value)
 
     def _skip_value_changed(self):
@@ -299,3 +388,4 @@ class ScaffoldRigidAlignerWidget(QtGui.QWidget):
         self._ui.axisDone_pushButton.setEnabled(True)
         self._ui.upsideDown_checkBox.setChecked(False)
         self._ui.scaleRatio_lineEdit.clear()
+        self._ui.autoAlign_label.clear()
@@ -319,6 +319,19 @@ class Ui_ScaffoldRigidAlignerWidget(object):
         self.upsideDown_label.setSizePolicy(sizePolicy)
         self.upsideDown_label.setObjectName("upsideDown_label")
         self.gridLayout_6.addWidget(self.upsideDown_label, 3, 0, 1, 1)
+        self.autoAlign_pushButton = QtGui.QPushButton(self.swapAxis_frame)
+        self.autoAlign_pushButton.setEnabled(False)
+        sizePolicy = QtGui.QSizePolicy(QtGui.QSizePolicy.Minimum, QtGui.QSizePolicy.Fixed)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(self.autoAlign_pushButton.sizePolicy().hasHeightForWidth())
+        self.autoAlign_pushButton.setSizePolicy(sizePolicy)
+        self.autoAlign_pushButton.setObjectName("autoAlign_pushButton")
+        self.gridLayout_6.addWidget(self.autoAlign_pushButton, 10, 0, 1, 1)
+        self.autoAlign_label = QtGui.QLabel(self.swapAxis_frame)
+        self.autoAlign_label.setText("")
+        self.autoAlign_label.setObjectName("autoAlign_label")
+        self.gridLayout_6.addWidget(self.autoAlign_label, 10, 2, 1, 3)
         spacerItem4 = QtGui.QSpacerItem(20, 20, QtGui.QSizePolicy.Minimum, QtGui.QSizePolicy.Preferred)
         self.gridLayout_6.addItem(spacerItem4, 11, 1, 1, 1)
         self.pitch_label = QtGui.QLabel(self.swapAxis_frame)
@@ -416,6 +429,21 @@ class Ui_ScaffoldRigidAlignerWidget(object):
         self.verticalLayout_5.addItem(spacerItem10)
         self.toolBox.addItem(self.alignPage, "")
         self.verticalLayout_3.addWidget(self.toolBox)
+        self.progress_frame = QtGui.QFrame(self.scrollAreaWidgetContents)
+        self.progress_frame.setFrameShape(QtGui.QFrame.StyledPanel)
+        self.progress_frame.setFrameShadow(QtGui.QFrame.Raised)
+        self.progress_frame.setObjectName("progress_frame")
+        self.horizontalLayout_6 = QtGui.QHBoxLayout(self.progress_frame)
+        self.horizontalLayout_6.setContentsMargins(3, 3, 3, 3)
+        self.horizontalLayout_6.setObjectName("horizontalLayout_6")
+        self.progressBar = QtGui.QProgressBar(self.progress_frame)
+        self.progressBar.setProperty("value", 0)
+        self.progressBar.setObjectName("progressBar")
+        self.horizontalLayout_6.addWidget(self.progressBar)
+        self.cancelButton = QtGui.QPushButton(self.progress_frame)
+        self.cancelButton.setObjectName("cancelButton")
+        self.horizontalLayout_6.addWidget(self.cancelButton)
+        self.verticalLayout_3.addWidget(self.progress_frame)
         self.frame = QtGui.QFrame(self.scrollAreaWidgetContents)
         self.frame.setFrameShape(QtGui.QFrame.StyledPanel)
         self.frame.setFrameShadow(QtGui.QFrame.Raised)
@@ -492,6 +520,7 @@ class Ui_ScaffoldRigidAlignerWidget(object):
         self.rotateAxis_label.setText(QtGui.QApplication.translate("ScaffoldRigidAlignerWidget", "Rotation (Euler angles):", None, QtGui.QApplication.UnicodeUTF8))
         self.upsideDown_label.setText(QtGui.QApplication.translate("ScaffoldRigidAlignerWidget", "Is UP axis upside down?", None, QtGui.QApplication.UnicodeUTF8))
         self.pitch_label.setText(QtGui.QApplication.translate("ScaffoldRigidAlignerWidget", "Pitch", None, QtGui.QApplication.UnicodeUTF8))
+        self.autoAlign_pushButton.setText(QtGui.QApplication.translate("ScaffoldRigidAlignerWidget", "Auto Align", None, QtGui.QApplication.UnicodeUTF8))
         self.scaleRatio_label.setText(QtGui.QApplication.translate("ScaffoldRigidAlignerWidget", "Scaffold to data scale ratio:", None, QtGui.QApplication.UnicodeUTF8))
         self.scaleRatio_pushButton.setText(QtGui.QApplication.translate("ScaffoldRigidAlignerWidget", "Calculate", None, QtGui.QApplication.UnicodeUTF8))
         self.loadSettingsButton.setToolTip(QtGui.QApplication.translate("ScaffoldRigidAlignerWidget", "Load pre-saved alignment settings", None, QtGui.QApplication.UnicodeUTF8))
@@ -501,6 +530,8 @@ class Ui_ScaffoldRigidAlignerWidget(object):
         self.alignResetButton.setToolTip(QtGui.QApplication.translate("ScaffoldRigidAlignerWidget", "Reset the alignment settings", None, QtGui.QApplication.UnicodeUTF8))
         self.alignResetButton.setText(QtGui.QApplication.translate("ScaffoldRigidAlignerWidget", "Reset", None, QtGui.QApplication.UnicodeUTF8))
         self.toolBox.setItemText(self.toolBox.indexOf(self.alignPage), QtGui.QApplication.translate("ScaffoldRigidAlignerWidget", "Control Panel", None, QtGui.QApplication.UnicodeUTF8))
+        self.cancelButton.setToolTip(QtGui.QApplication.translate("ScaffoldRigidAlignerWidget", "Abandon the running operation", None, QtGui.QApplication.UnicodeUTF8))
+        self.cancelButton.setText(QtGui.QApplication.translate("ScaffoldRigidAlignerWidget", "Cancel", None, QtGui.QApplication.UnicodeUTF8))
         self.viewAllButton.setToolTip(QtGui.QApplication.translate("ScaffoldRigidAlignerWidget", "Adjust the view to see the whole model", None, QtGui.QApplication.UnicodeUTF8))
         self.viewAllButton.setText(QtGui.QApplication.translate("ScaffoldRigidAlignerWidget", "View All", None, QtGui.QApplication.UnicodeUTF8))
         self.doneButton.setToolTip(QtGui.QApplication.translate("ScaffoldRigidAlignerWidget", "Finish this step", None, QtGui.QApplication.UnicodeUTF8))
@@ -0,0 +1,56 @@
+from PySide import QtCore
+
+
+class OperationCancelled(Exception):
+    pass
+
+
+class Worker(QtCore.QObject):
+    """
+    Runs a function on its own QThread so the user interface stays responsive. The function is
+    called with a progress callable taking the fraction done and a message; once cancel() has been
+    called the progress callable raises OperationCancelled to abandon the function.
+    Signals are delivered to slots of objects living in the GUI thread through its event loop.
+    """
+
+    progress = QtCore.Signal(float, str)
+    finished = QtCore.Signal(object)
+    failed = QtCore.Signal(str)
+    cancelled = QtCore.Signal()
+
+    def __init__(self, function):
+        super(Worker, self).__init__()
+        self._function = function
+        self._cancel_requested = False
+        self._thread = QtCore.QThread()
+        self.moveToThread(self._thread)
+        self._thread.started.connect(self._run)
+
+    def start(self):
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel_requested = True
+
+    def is_running(self):
+        return self._thread.isRunning()
+
+    def wait(self):
+        self._thread.wait()
+
+    def _report_progress(self, fraction, message):
+        if self._cancel_requested:
+            raise OperationCancelled()
+        self.progress.emit(fraction, message)
+
+    def _run(self):
+        try:
+            result = self._function(self._report_progress)
+        except OperationCancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.failed.emit(str(e))
+        else:
+            self.finished.emit(result)
+        finally:
+            self._thread.quit()
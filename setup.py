@@ -50,4 +50,9 @@ setup(name='mapclientplugins.scaffoldrigidalignerstep',
     include_package_data=True,
     zip_safe=False,
     install_requires=requires,
+    entry_points={
+      'console_scripts': [
+        'scaffold-rigid-align-batch = mapclientplugins.scaffoldrigidalignerstep.batch:main',
+      ],
+    },
     )
@@ -0,0 +1,77 @@
+import unittest
+
+import numpy as np
+
+from mapclientplugins.scaffoldrigidalignerstep.utils import framestatistics
+
+
+def _create_frames(sizes=(30, 45, 20), seed=0):
+    random_state = np.random.RandomState(seed)
+    return [random_state.uniform(-1.0, 1.0, size=(size, 3)) * (index + 1) + index
+            for index, size in enumerate(sizes)]
+
+
+def _pad_frames(frames):
+    size = max(len(frame) for frame in frames)
+    positions = np.zeros((len(frames), size, 3))
+    mask = np.zeros((len(frames), size), dtype=bool)
+    for index, frame in enumerate(frames):
+        positions[index, :len(frame)] = frame
+        positions[index, len(frame):] = 1000.0
+        mask[index, :len(frame)] = True
+    return positions, mask
+
+
+class FrameStatisticsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._frames = _create_frames()
+
+    def _check_statistics(self, statistics):
+        self.assertEqual(statistics.get_number_of_frames(), 3)
+        np.testing.assert_array_equal(statistics.get_counts(), [30, 45, 20])
+        for index, frame in enumerate(self._frames):
+            np.testing.assert_allclose(statistics.get_minimums()[index], frame.min(axis=0))
+            np.testing.assert_allclose(statistics.get_maximums()[index], frame.max(axis=0))
+            np.testing.assert_allclose(statistics.get_centroids()[index], frame.mean(axis=0))
+            np.testing.assert_allclose(statistics.get_covariances()[index], np.cov(frame.T, bias=True), atol=1.0e-12)
+
+    def test_masked_positions(self):
+        positions, mask = _pad_frames(self._frames)
+        for block_size in [1, 2, 64]:
+            self._check_statistics(framestatistics.compute_frame_statistics(positions, mask, block_size))
+
+    def test_frames(self):
+        self._check_statistics(framestatistics.compute_frame_statistics_from_frames(iter(self._frames)))
+
+    def test_unmasked_positions(self):
+        positions = np.array([frame[:20] for frame in self._frames])
+        statistics = framestatistics.compute_frame_statistics(positions)
+        np.testing.assert_allclose(statistics.get_centroids(), positions.mean(axis=1))
+        np.testing.assert_array_equal(statistics.get_counts(), [20, 20, 20])
+
+    def test_range(self):
+        statistics = framestatistics.compute_frame_statistics_from_frames(self._frames)
+        all_points = np.concatenate(self._frames)
+        minimums, maximums = statistics.get_range('reference', 1)
+        np.testing.assert_allclose(minimums, self._frames[1].min(axis=0))
+        np.testing.assert_allclose(maximums, self._frames[1].max(axis=0))
+        minimums, maximums = statistics.get_range('union')
+        np.testing.assert_allclose(minimums, all_points.min(axis=0))
+        np.testing.assert_allclose(maximums, all_points.max(axis=0))
+        minimums, maximums = statistics.get_range('mean')
+        np.testing.assert_allclose(minimums, np.mean([frame.min(axis=0) for frame in self._frames], axis=0))
+        np.testing.assert_allclose(maximums, np.mean([frame.max(axis=0) for frame in self._frames], axis=0))
+        self.assertRaises(ValueError, statistics.get_range, 'median')
+
+    def test_centroid(self):
+        statistics = framestatistics.compute_frame_statistics_from_frames(self._frames)
+        np.testing.assert_allclose(statistics.get_centroid('reference', 2), self._frames[2].mean(axis=0))
+        all_points = np.concatenate(self._frames)
+        np.testing.assert_allclose(statistics.get_centroid('union'), all_points.mean(axis=0))
+        np.testing.assert_allclose(statistics.get_centroid('mean'), all_points.mean(axis=0))
+        self.assertRaises(ValueError, statistics.get_centroid, 'median')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import io
+import json
+import unittest
+
+import numpy as np
+
+from mapclientplugins.scaffoldrigidalignerstep.utils import jsonstream
+
+
+def _create_document():
+    frames = dict()
+    for index in range(5):
+        positions = np.random.RandomState(index).uniform(-100.0, 100.0, size=(index * 40 + 1, 3))
+        frames[str(index)] = dict(Positions=positions.tolist(), Name='frame "{}" [{{\\'.format(index))
+    # Large enough for the bracket scan to need several windows.
+    frames['5'] = dict(Positions=np.random.RandomState(5).uniform(size=(3000, 3)).tolist(), Name=u'\u00e9t\u00e9')
+    return dict(Header=dict(Version=[1, 2], Note='a } b'), AnnotatedFrames=frames, Trailer=-1.5e-3)
+
+
+def _get_stream(document):
+    return io.BytesIO(json.dumps(document, indent=1, ensure_ascii=False).encode('utf-8'))
+
+
+class JsonStreamTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._document = _create_document()
+
+    def test_iterate_object_items(self):
+        for chunk_size in [13, 1 << 12, 1 << 20]:
+            items = [(key, value) for key, value, _, _ in
+                     jsonstream.iterate_object_items(_get_stream(self._document), 'AnnotatedFrames', chunk_size)]
+            self.assertEqual(items, sorted(self._document['AnnotatedFrames'].items()))
+
+    def test_index_object_items(self):
+        for chunk_size in [13, 1 << 12, 1 << 20]:
+            stream = _get_stream(self._document)
+            index = list(jsonstream.index_object_items(stream, 'AnnotatedFrames', chunk_size))
+            self.assertEqual([key for key, _, _ in index], sorted(self._document['AnnotatedFrames']))
+            for key, start, end in index:
+                self.assertEqual(jsonstream.read_value_at(stream, start, end), self._document['AnnotatedFrames'][key])
+
+    def test_offsets_match(self):
+        stream = _get_stream(self._document)
+        offsets = [(key, start, end) for key, _, start, end in
+                   jsonstream.iterate_object_items(stream, 'AnnotatedFrames', 1 << 10)]
+        stream.seek(0)
+        self.assertEqual(offsets, list(jsonstream.index_object_items(stream, 'AnnotatedFrames', 1 << 10)))
+
+    def test_missing_key(self):
+        stream = _get_stream(dict(Header=[1, 2, 3]))
+        self.assertRaises(KeyError, list, jsonstream.index_object_items(stream, 'AnnotatedFrames'))
+
+    def test_unterminated_value(self):
+        stream = io.BytesIO(b'{"AnnotatedFrames": {"0": [[1.0, 2.0], [3.0')
+        self.assertRaises(ValueError, list, jsonstream.index_object_items(stream, 'AnnotatedFrames', 8))
+
+
+if __name__ == '__main__':
+    unittest.main()
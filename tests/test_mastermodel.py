@@ -0,0 +1,159 @@
+import math
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+try:
+    from opencmiss.zinc.context import Context
+except ImportError:
+    Context = None
+
+if Context is not None:
+    from opencmiss.zinc.element import Element, Elementbasis
+    from opencmiss.zinc.field import Field
+    from opencmiss.zinc.node import Node
+    from opencmiss.zinc.status import OK as ZINC_OK
+
+    from mapclientplugins.scaffoldrigidalignerstep.model.filescaffold import FileScaffoldDescription
+    from mapclientplugins.scaffoldrigidalignerstep.model.mastermodel import MasterModel
+    from mapclientplugins.scaffoldrigidalignerstep.model.registration import RegistrationResult
+    from mapclientplugins.scaffoldrigidalignerstep.utils import maths
+    from mapclientplugins.scaffoldrigidalignerstep.utils import zincutils
+
+NODE_VALUES = [[1.0, 2.0, 3.0], [-4.0, 0.5, 2.0], [0.0, -3.0, 7.5]]
+
+
+def _create_coordinate_field(region):
+    """
+    Create a coordinate field on nodes with NODE_VALUES and a line element, as the model looks for the
+    coordinate field on its mesh.
+    """
+    fm = region.getFieldmodule()
+    field = fm.createFieldFiniteElement(3)
+    field.setName('coordinates')
+    field.setManaged(True)
+    field.setTypeCoordinate(True)
+    field.setCoordinateSystemType(Field.COORDINATE_SYSTEM_TYPE_RECTANGULAR_CARTESIAN)
+    nodes = fm.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES)
+    node_template = nodes.createNodetemplate()
+    node_template.defineField(field)
+    cache = fm.createFieldcache()
+    for identifier, values in enumerate(NODE_VALUES, 1):
+        cache.setNode(nodes.createNode(identifier, node_template))
+        field.setNodeParameters(cache, -1, Node.VALUE_LABEL_VALUE, 1, values)
+    mesh = fm.findMeshByDimension(1)
+    element_field_template = mesh.createElementfieldtemplate(
+        fm.createElementbasis(1, Elementbasis.FUNCTION_TYPE_LINEAR_LAGRANGE))
+    element_template = mesh.createElementtemplate()
+    element_template.setElementShapeType(Element.SHAPE_TYPE_LINE)
+    element_template.defineField(field, -1, element_field_template)
+    element = mesh.createElement(1, element_template)
+    element.setNodesByIdentifier(element_field_template, [1, 2])
+    return field
+
+
+def _get_values(field):
+    fm = field.getFieldmodule()
+    nodes = fm.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES)
+    cache = fm.createFieldcache()
+    values = []
+    for identifier in range(1, len(NODE_VALUES) + 1):
+        cache.setNode(nodes.findNodeByIdentifier(identifier))
+        result, node_values = field.getNodeParameters(cache, -1, Node.VALUE_LABEL_VALUE, 1, 3)
+        assert result == ZINC_OK
+        values.append(node_values)
+    return np.array(values)
+
+
+def _write_scaffold(file_name):
+    """
+    Write a scaffold with the coordinate field of _create_coordinate_field to file_name, for
+    FileScaffoldDescription to read.
+    """
+    region = Context('scaffold_file').getDefaultRegion()
+    _create_coordinate_field(region)
+    assert region.writeFile(file_name) == ZINC_OK
+
+
+@unittest.skipIf(Context is None, 'OpenCMISS Zinc is not installed')
+class ScaffoldTransformTestCase(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        file_name = os.path.join(directory, 'scaffold.exf')
+        _write_scaffold(file_name)
+        description = FileScaffoldDescription(file_name)
+        self._context = description.get_context()
+        self._generator = description.get_generator()
+        self._model = MasterModel(description)
+        self._model.initialise_scaffold()
+        self._field = self._model.get_scaffold_model().get_coordinate_field()
+
+    def _get_baseline_values(self, axes, yaw):
+        """
+        Get the node coordinates after swapping the axes then rotating by the yaw in degrees, one
+        node traversal each, as rotate_scaffold did before the rotation was held as a quaternion.
+        """
+        region = self._context.getDefaultRegion().createChild('baseline')
+        field = _create_coordinate_field(region)
+        self.assertTrue(zincutils.swap_axes(field, axes))
+        self.assertTrue(zincutils.transform_coordinates(field, maths.eulerToRotationMatrix3([math.radians(yaw), 0.0,
+                                                                                             0.0])))
+        return _get_values(field)
+
+    def test_swap_then_yaw(self):
+        self._model.set_scaffold_axis('Z')
+        self._model.set_data_axis('Y')
+        self._model.apply_orientation()
+        self._model.rotate_scaffold('yaw', 30.0)
+        self.assertTrue(self._model._commit_transform())
+        np.testing.assert_allclose(_get_values(self._field),
+                                   self._get_baseline_values(dict(scaffold_up='Z', data_up='Y'), 30.0), atol=1.0e-12)
+
+    def test_set_pending_transform(self):
+        self._model.set_scaffold_axis('Z')
+        self._model.set_data_axis('X')
+        self._model.apply_orientation()
+        self._model.set_rotation(20.0, -35.0, 10.0)
+        matrix = np.identity(4)
+        matrix[:3, :3] = maths.eulerToRotationMatrix3([0.3, 0.2, -0.1])
+        matrix[:3, 3] = [1.0, -2.0, 3.0]
+        self._model._set_pending_transform(matrix)
+        np.testing.assert_allclose(self._model.get_transform(), matrix, atol=1.0e-12)
+
+    def test_undo_orientation(self):
+        self._model.set_scaffold_axis('Z')
+        self._model.set_data_axis('Y')
+        self._model.apply_orientation()
+        self._model.rotate_scaffold('yaw', 45.0)
+        oriented = self._model.get_transform()
+        self.assertTrue(self._model.undo())
+        self.assertFalse(np.allclose(self._model.get_transform(), oriented))
+        self.assertTrue(self._model.redo())
+        np.testing.assert_allclose(self._model.get_transform(), oriented, atol=1.0e-12)
+
+    def test_undo_registration_scale(self):
+        generator_settings = []
+        self._generator.setSettings = generator_settings.append
+        matrix = np.identity(4)
+        matrix[:3, :3] *= 2.0
+        matrix[:3, 3] = [1.0, 0.0, -1.0]
+        self._model.apply_registration_result(RegistrationResult(matrix, 0.0, 1, True))
+        self.assertEqual(self._model.get_generator_settings()['scale'], '2.00*2.00*2.00')
+        self.assertTrue(self._model.undo())
+        self.assertEqual(self._model.get_generator_settings()['scale'], '1.0*1.0*1.0')
+        np.testing.assert_allclose(self._model.get_transform(), np.identity(4), atol=1.0e-12)
+        self.assertTrue(self._model.redo())
+        self.assertEqual(self._model.get_generator_settings()['scale'], '2.00*2.00*2.00')
+        np.testing.assert_allclose(self._model.get_transform(), matrix, atol=1.0e-12)
+        # The scaffold is not regenerated under the aligner.
+        self.assertEqual(generator_settings, [])
+        np.testing.assert_allclose(_get_values(self._field), NODE_VALUES)
+
+
+if __name__ == '__main__':
+    unittest.main()
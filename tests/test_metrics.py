@@ -0,0 +1,92 @@
+import unittest
+
+import numpy as np
+
+from mapclientplugins.scaffoldrigidalignerstep.model import metrics
+
+OFFSET = 0.05
+
+
+def _create_plane_points(count=21):
+    """
+    Get samples of the unit square in the z = 0 plane, spaced 1 / (count - 1) apart.
+    """
+    x, y = np.meshgrid(np.linspace(0.0, 1.0, count), np.linspace(0.0, 1.0, count))
+    return np.column_stack([x.ravel(), y.ravel(), np.zeros(x.size)])
+
+
+def _create_data_points(count=200, seed=0):
+    """
+    Get points inside the square, OFFSET above the plane.
+    """
+    points = np.random.RandomState(seed).uniform(0.1, 0.9, size=(count, 3))
+    points[:, 2] = OFFSET
+    return points
+
+
+def _get_closest_distances(points, other_points):
+    return np.sqrt(((points[:, np.newaxis] - other_points[np.newaxis]) ** 2).sum(axis=2)).min(axis=1)
+
+
+class AlignmentMetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._scaffold_points = _create_plane_points()
+        self._data_points = _create_data_points()
+
+    def test_estimate_normals(self):
+        normals = metrics.estimate_normals(self._scaffold_points)
+        np.testing.assert_allclose(np.abs(normals[:, 2]), 1.0, atol=1.0e-12)
+
+    def test_point_to_surface(self):
+        alignment_metrics = metrics.compute_alignment_metrics(self._scaffold_points, self._data_points)
+        np.testing.assert_allclose(alignment_metrics.point_to_surface, OFFSET, atol=1.0e-12)
+        self.assertAlmostEqual(alignment_metrics.get_rms_error(), OFFSET, places=12)
+        np.testing.assert_allclose(alignment_metrics.data_to_scaffold,
+                                   _get_closest_distances(self._data_points, self._scaffold_points))
+        np.testing.assert_allclose(alignment_metrics.scaffold_to_data,
+                                   _get_closest_distances(self._scaffold_points, self._data_points))
+        self.assertTrue(np.all(alignment_metrics.point_to_surface <= alignment_metrics.data_to_scaffold + 1.0e-12))
+
+    def test_far_point(self):
+        data_points = np.array([[0.5, 0.5, OFFSET], [3.0, 0.5, 0.0]])
+        alignment_metrics = metrics.compute_alignment_metrics(self._scaffold_points, data_points)
+        # Beyond the sample spacing along the plane the distance to the closest sample is used.
+        np.testing.assert_allclose(alignment_metrics.point_to_surface, [OFFSET, 2.0], atol=1.0e-12)
+
+    def test_hausdorff_distance(self):
+        alignment_metrics = metrics.compute_alignment_metrics(self._scaffold_points, self._data_points)
+        expected = max(_get_closest_distances(self._data_points, self._scaffold_points).max(),
+                       _get_closest_distances(self._scaffold_points, self._data_points).max())
+        self.assertAlmostEqual(alignment_metrics.get_hausdorff_distance(), expected, places=12)
+
+    def test_summarise_distances(self):
+        summary = metrics.summarise_distances([3.0, 4.0], percentiles=[50])
+        self.assertAlmostEqual(summary['rms'], np.sqrt(12.5))
+        self.assertEqual(summary['mean'], 3.5)
+        self.assertEqual(summary['max'], 4.0)
+        self.assertEqual(summary['percentiles'], {'50': 3.5})
+        self.assertEqual(metrics.summarise_distances([], percentiles=[90]),
+                         dict(rms=None, mean=None, max=None, percentiles={'90': None}))
+
+    def test_empty(self):
+        alignment_metrics = metrics.compute_alignment_metrics(self._scaffold_points, np.zeros((0, 3)))
+        self.assertIsNone(alignment_metrics.get_rms_error())
+        self.assertIsNone(alignment_metrics.get_hausdorff_distance())
+        self.assertEqual(alignment_metrics.as_dict()['data_points'], 0)
+
+    def test_as_dict(self):
+        alignment_metrics = metrics.compute_alignment_metrics(self._scaffold_points, self._data_points,
+                                                              percentiles=[50, 95])
+        description = alignment_metrics.as_dict()
+        self.assertEqual(description['data_points'], 200)
+        self.assertEqual(description['scaffold_points'], 441)
+        self.assertEqual(sorted(description['point_to_surface']['percentiles']), ['50', '95'])
+        self.assertNotIn('residuals', description)
+        residuals = alignment_metrics.as_dict(residuals=True)['residuals']
+        self.assertEqual(len(residuals['scaffold_to_data']), 441)
+        np.testing.assert_allclose(residuals['point_to_surface'], OFFSET, atol=1.0e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import math
+import unittest
+
+import numpy as np
+
+from mapclientplugins.scaffoldrigidalignerstep.model import registration
+from mapclientplugins.scaffoldrigidalignerstep.utils import maths
+
+
+def _create_points(count=600, seed=1):
+    """
+    Get points on an ellipsoid with distinct semi-axes, so its principal axes are well defined.
+    """
+    directions = np.random.RandomState(seed).normal(size=(count, 3))
+    directions /= np.linalg.norm(directions, axis=1)[:, np.newaxis]
+    return directions * [4.0, 2.0, 1.0] + [0.5, -1.0, 2.0]
+
+
+def _create_matrix(euler_angles, translation, scale=1.0):
+    return registration.to_matrix(maths.eulerToRotationMatrix3(euler_angles), translation, scale)
+
+
+class KabschTestCase(unittest.TestCase):
+
+    def test_rigid(self):
+        source = _create_points()
+        matrix = _create_matrix([0.7, -0.4, 1.2], [3.0, -2.0, 5.0])
+        rotation, translation, scale = registration.kabsch(source, registration.transform_points(matrix, source))
+        np.testing.assert_allclose(registration.to_matrix(rotation, translation, scale), matrix, atol=1.0e-10)
+        self.assertEqual(scale, 1.0)
+
+    def test_similarity(self):
+        source = _create_points()
+        matrix = _create_matrix([-0.3, 0.9, 0.2], [1.0, 4.0, -3.0], 2.5)
+        rotation, translation, scale = registration.kabsch(source, registration.transform_points(matrix, source),
+                                                           similarity=True)
+        self.assertAlmostEqual(scale, 2.5, places=10)
+        np.testing.assert_allclose(registration.to_matrix(rotation, translation, scale), matrix, atol=1.0e-10)
+
+    def test_no_reflection(self):
+        source = _create_points()
+        target = source * [1.0, 1.0, -1.0]
+        rotation, _, _ = registration.kabsch(source, target)
+        self.assertAlmostEqual(np.linalg.det(rotation), 1.0, places=10)
+
+
+class IterativeClosestPointTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._source = _create_points()
+
+    def test_rigid(self):
+        matrix = _create_matrix([0.15, -0.1, 0.2], [0.3, -0.2, 0.4])
+        solver = registration.IterativeClosestPoint(registration.transform_points(matrix, self._source),
+                                                    max_iterations=100)
+        result = solver.solve(self._source)
+        np.testing.assert_allclose(result.matrix, matrix, atol=1.0e-6)
+        self.assertLess(result.rms_error, 1.0e-6)
+        self.assertAlmostEqual(result.get_scale(), 1.0, places=6)
+
+    def test_similarity(self):
+        matrix = _create_matrix([-0.1, 0.15, 0.1], [0.2, 0.1, -0.3], 1.2)
+        solver = registration.IterativeClosestPoint(registration.transform_points(matrix, self._source),
+                                                    similarity=True, max_iterations=200)
+        result = solver.solve(self._source)
+        np.testing.assert_allclose(result.matrix, matrix, atol=1.0e-6)
+        self.assertAlmostEqual(result.get_scale(), 1.2, places=6)
+
+    def test_initial_orientation(self):
+        matrix = _create_matrix([2.0, -1.0, 2.5], [10.0, -5.0, 3.0], 0.5)
+        target = registration.transform_points(matrix, self._source)
+        initial_matrix, scores = registration.estimate_initial_orientation(self._source, target, similarity=True)
+        self.assertEqual(scores.shape, (24,))
+        solver = registration.IterativeClosestPoint(target, similarity=True, max_iterations=100)
+        result = solver.solve(self._source, initial_matrix)
+        np.testing.assert_allclose(result.matrix, matrix, atol=1.0e-6)
+
+    def test_pyramid(self):
+        matrix = _create_matrix([0.1, 0.2, -0.15], [0.5, 0.2, -0.1])
+        target = registration.transform_points(matrix, _create_points(5000, seed=2))
+        solver = registration.create_solver(target, levels=3, max_iterations=100, coarsest_voxel_fraction=0.05)
+        self.assertIsInstance(solver, registration.PyramidRegistration)
+        self.assertEqual(solver.get_voxel_sizes()[-1], 0.0)
+        result = solver.solve(_create_points(5000, seed=2))
+        np.testing.assert_allclose(result.matrix, matrix, atol=1.0e-5)
+
+
+class MultiStartRegistrationTestCase(unittest.TestCase):
+
+    def test_axis_aligned_rotations(self):
+        rotations = registration.axis_aligned_rotations()
+        self.assertEqual(rotations.shape, (24, 3, 3))
+        np.testing.assert_allclose(np.linalg.det(rotations), 1.0)
+        self.assertEqual(len(set(rotation.tobytes() for rotation in rotations)), 24)
+
+    def test_random_rotations(self):
+        rotations = registration.random_rotations(10, seed=3)
+        np.testing.assert_allclose(np.einsum('nji,njk->nik', rotations, rotations),
+                                   np.broadcast_to(np.identity(3), (10, 3, 3)), atol=1.0e-12)
+        np.testing.assert_array_equal(rotations, registration.random_rotations(10, seed=3))
+
+    def test_best_start(self):
+        source = _create_points()
+        matrix = _create_matrix([math.pi / 2.0, 0.3, -2.0], [-4.0, 1.0, 2.0])
+        target = registration.transform_points(matrix, source)
+        initial_matrices = registration.start_matrices(source, target)
+        self.assertEqual(initial_matrices.shape, (24, 4, 4))
+        solver = registration.MultiStartRegistration(target, max_workers=1, max_iterations=100)
+        result, candidates = solver.solve(source, initial_matrices)
+        self.assertEqual(len(candidates), 24)
+        self.assertEqual(result.rms_error, min(candidate.rms_error for candidate in candidates))
+        np.testing.assert_allclose(result.matrix, matrix, atol=1.0e-6)
+
+
+class TemporalRegistrationTestCase(unittest.TestCase):
+
+    def test_frames(self):
+        source = _create_points()
+        matrix = _create_matrix([0.1, -0.15, 0.05], [0.3, 0.1, -0.2], 1.1)
+        target = registration.transform_points(matrix, source)
+        frames = [target[0::2], target[1::2], target[::3]]
+        solver = registration.TemporalRegistration(frames, similarity=True, max_iterations=200)
+        result = solver.solve(source)
+        np.testing.assert_allclose(result.matrix, matrix, atol=1.0e-2)
+        self.assertEqual(len(result.frame_rms_errors), 3)
+
+        result.set_frame_results(registration.solve_frames(frames, source, result.matrix, max_workers=1,
+                                                           similarity=True, max_iterations=200))
+        self.assertEqual(len(result.frame_results), 3)
+        np.testing.assert_allclose(result.drift['scale_ratio'], 1.0, atol=1.0e-2)
+        self.assertLess(max(result.drift['rotation_degrees']), 1.0)
+
+    def test_frame_drift(self):
+        reference_matrix = _create_matrix([0.2, 0.1, -0.3], [1.0, 2.0, 3.0], 2.0)
+        matrices = [reference_matrix, np.dot(_create_matrix([0.0, 0.0, 0.1], [0.0, 3.0, 4.0], 1.5), reference_matrix)]
+        angles, translations, scales = registration.frame_drift(matrices, reference_matrix)
+        np.testing.assert_allclose(angles, [0.0, math.degrees(0.1)], atol=1.0e-6)
+        np.testing.assert_allclose(scales, [1.0, 1.5])
+        self.assertAlmostEqual(translations[0], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+
+import numpy as np
+
+from mapclientplugins.scaffoldrigidalignerstep.utils import subsampling
+
+
+def _create_frames(sizes=(50, 80, 65), seed=0):
+    random_state = np.random.RandomState(seed)
+    return [random_state.uniform(-1.0, 1.0, size=(size, 3)) for size in sizes]
+
+
+def _contains_rows(points, rows):
+    return all(np.any(np.all(points == row, axis=1)) for row in rows)
+
+
+class SubsamplingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._frames = _create_frames()
+
+    def test_random(self):
+        positions, mask = subsampling.subsample_frames(self._frames, 'random', seed=4)
+        self.assertEqual(positions.shape, (3, 50, 3))
+        self.assertTrue(np.all(mask))
+        for frame, points in zip(self._frames, positions):
+            self.assertTrue(_contains_rows(frame, points))
+            self.assertEqual(len(np.unique(points, axis=0)), 50)
+        same_positions, _ = subsampling.subsample_frames(self._frames, 'random', seed=4)
+        np.testing.assert_array_equal(positions, same_positions)
+        other_positions, _ = subsampling.subsample_frames(self._frames, 'random', seed=5)
+        self.assertFalse(np.array_equal(positions[1], other_positions[1]))
+
+    def test_random_count(self):
+        positions, _ = subsampling.subsample_random(self._frames, count=20)
+        self.assertEqual(positions.shape, (3, 20, 3))
+        positions, _ = subsampling.subsample_random(self._frames, count=500)
+        self.assertEqual(positions.shape, (3, 50, 3))
+
+    def test_farthest_point(self):
+        corners = np.array([[0.0, 0.0, 0.0], [10.0, 0.0, 0.0], [0.0, 10.0, 0.0], [0.0, 0.0, 10.0]])
+        points = np.concatenate([np.random.RandomState(1).uniform(4.0, 5.0, size=(40, 3)), corners])
+        positions, mask = subsampling.subsample_farthest_point([points, points[::-1]], count=5)
+        self.assertEqual(positions.shape, (2, 5, 3))
+        self.assertTrue(np.all(mask))
+        for frame_points in positions:
+            self.assertTrue(_contains_rows(frame_points, corners))
+
+    def test_keep_all(self):
+        positions, mask = subsampling.subsample_frames(self._frames, 'keep_all')
+        self.assertEqual(positions.shape, (3, 80, 3))
+        self.assertEqual(mask.sum(axis=1).tolist(), [50, 80, 65])
+        for frame, points, frame_mask in zip(self._frames, positions, mask):
+            np.testing.assert_array_equal(points[frame_mask], frame)
+            np.testing.assert_array_equal(points[~frame_mask], np.broadcast_to(frame[0], points[~frame_mask].shape))
+
+    def test_voxel_grid(self):
+        positions, mask = subsampling.subsample_frames(self._frames, 'voxel_grid', voxel_size=1.0)
+        for frame, points, frame_mask in zip(self._frames, positions, mask):
+            np.testing.assert_allclose(points[frame_mask], subsampling.voxel_downsample(frame, 1.0))
+        self.assertEqual(positions.shape[1], mask.sum(axis=1).max())
+
+    def test_voxel_downsample(self):
+        points = np.array([[0.1, 0.1, 0.1], [0.3, 0.3, 0.3], [1.5, 0.2, 0.2], [0.2, 0.2, 2.6]])
+        downsampled = subsampling.voxel_downsample(points, 1.0)
+        self.assertEqual(len(downsampled), 3)
+        self.assertTrue(_contains_rows(downsampled, [[0.2, 0.2, 0.2], [1.5, 0.2, 0.2], [0.2, 0.2, 2.6]]))
+        np.testing.assert_array_equal(subsampling.voxel_downsample(points, 0.0), points)
+
+    def test_unknown_strategy(self):
+        self.assertRaises(ValueError, subsampling.subsample_frames, self._frames, 'median')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+
+import numpy as np
+
+try:
+    from opencmiss.zinc.context import Context
+except ImportError:
+    Context = None
+
+if Context is not None:
+    from opencmiss.zinc.field import Field
+    from opencmiss.zinc.node import Node
+    from opencmiss.zinc.status import OK as ZINC_OK
+
+    from mapclientplugins.scaffoldrigidalignerstep.utils import zincutils
+
+
+def _create_coordinate_field(region, number_of_components):
+    fm = region.getFieldmodule()
+    field = fm.createFieldFiniteElement(number_of_components)
+    field.setName('coordinates')
+    field.setManaged(True)
+    field.setTypeCoordinate(True)
+    field.setCoordinateSystemType(Field.COORDINATE_SYSTEM_TYPE_RECTANGULAR_CARTESIAN)
+    return field
+
+
+def _create_node(field, identifier, version_values):
+    """
+    Create a node with one value parameter per entry of version_values.
+    """
+    fm = field.getFieldmodule()
+    nodes = fm.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES)
+    node_template = nodes.createNodetemplate()
+    node_template.defineField(field)
+    node_template.setValueNumberOfVersions(field, -1, Node.VALUE_LABEL_VALUE, len(version_values))
+    node = nodes.createNode(identifier, node_template)
+    cache = fm.createFieldcache()
+    cache.setNode(node)
+    for version, values in enumerate(version_values, 1):
+        field.setNodeParameters(cache, -1, Node.VALUE_LABEL_VALUE, version, values)
+    return node
+
+
+def _get_values(field, identifier, version=1):
+    fm = field.getFieldmodule()
+    cache = fm.createFieldcache()
+    cache.setNode(fm.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES).findNodeByIdentifier(identifier))
+    result, values = field.getNodeParameters(cache, -1, Node.VALUE_LABEL_VALUE, version,
+                                             field.getNumberOfComponents())
+    assert result == ZINC_OK
+    return values
+
+
+@unittest.skipIf(Context is None, 'OpenCMISS Zinc is not installed')
+class NodalParametersTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._context = Context('nodal_parameters')
+        self._region = self._context.getDefaultRegion()
+
+    def test_two_component_field(self):
+        field = _create_coordinate_field(self._region, 2)
+        _create_node(field, 1, [[1.0, 2.0]])
+        _create_node(field, 2, [[-3.0, 4.0]])
+
+        success, node_identifiers, parameters, mask = zincutils.get_nodal_parameters(field)
+        self.assertTrue(success)
+        self.assertEqual(node_identifiers.tolist(), [1, 2])
+        self.assertEqual(parameters.shape, (2, len(zincutils.NODE_VALUE_LABELS), 1, 2))
+        self.assertEqual(parameters[:, 0, 0].tolist(), [[1.0, 2.0], [-3.0, 4.0]])
+        self.assertEqual(int(mask.sum()), 2)
+
+        rotation = [[0.0, -1.0, 0.0], [1.0, 0.0, 0.0], [0.0, 0.0, 1.0]]
+        self.assertTrue(zincutils.transform_nodal_parameters(field, rotation, [10.0, 20.0, 0.0]))
+        np.testing.assert_allclose(_get_values(field, 1), [8.0, 21.0])
+        np.testing.assert_allclose(_get_values(field, 2), [6.0, 17.0])
+
+        swap = zincutils.get_swap_axes_matrix(dict(scaffold_up='Z', data_up='Y'))
+        self.assertRaises(ValueError, zincutils.transform_nodal_parameters, field, swap)
+
+    def test_missing_versions(self):
+        field = _create_coordinate_field(self._region, 3)
+        _create_node(field, 1, [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+        _create_node(field, 2, [[7.0, 8.0, 9.0]])
+        nodes = self._region.getFieldmodule().findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES)
+        nodes.createNode(3, nodes.createNodetemplate())
+
+        success, node_identifiers, parameters, mask = zincutils.get_nodal_parameters(field)
+        self.assertTrue(success)
+        self.assertEqual(node_identifiers.tolist(), [1, 2, 3])
+        self.assertEqual(mask.shape, (3, len(zincutils.NODE_VALUE_LABELS), 2))
+        self.assertEqual(mask[:, 0].tolist(), [[True, True], [True, False], [False, False]])
+        self.assertEqual(parameters[0, 0, 1].tolist(), [4.0, 5.0, 6.0])
+        self.assertEqual(parameters[1, 0, 0].tolist(), [7.0, 8.0, 9.0])
+
+        self.assertTrue(zincutils.set_nodal_parameters(field, node_identifiers, 2.0 * parameters, mask))
+        np.testing.assert_allclose(_get_values(field, 1, 1), [2.0, 4.0, 6.0])
+        np.testing.assert_allclose(_get_values(field, 1, 2), [8.0, 10.0, 12.0])
+        np.testing.assert_allclose(_get_values(field, 2, 1), [14.0, 16.0, 18.0])
+
+
+if __name__ == '__main__':
+    unittest.main()